@@ -5,6 +5,7 @@ from torch.utils.data import DataLoader, TensorDataset
 from transformers import BertTokenizer, BertModel, BertPreTrainedModel
 from tqdm import tqdm
 from torch import nn
+from multitask import MultiTaskDataset, TemperatureBatchSampler
 import warnings
 import logging
 logging.getLogger("transformers").setLevel(logging.ERROR)
@@ -14,6 +15,9 @@ tokenizer = BertTokenizer.from_pretrained("bert-base-uncased")
 batch_size = 8
 num_epochs = 4
 learning_rate = 5e-5
+# Task sampling temperature for the joint NER + RE batches: 1 samples in
+# proportion to the number of examples, larger values move towards equal shares
+task_temperature = 2.0
 
 unique_ner_labels = set()
 unique_relation_labels = set()
@@ -241,16 +245,49 @@ if len(re_input_ids) > 0:
 else:
     re_input_ids = torch.tensor([])
 
-# Defining re_loader if there is relation data
-if len(re_input_ids) > 0:
-    re_dataset = TensorDataset(re_input_ids, re_attention_masks, re_labels)
-    re_loader = DataLoader(re_dataset, batch_size=batch_size)
-else:
-    re_loader = None
+ner_task, re_task = 0, 1
+
+
+def joint_collate(items):
+    """One batch for both tasks from (task, example) items.
+
+    Rows are padded to the longest attended length or NER label in the
+    batch, which leaves every loss term as it was at full padding. Each row
+    gets -100 (ignored) labels for the task it does not belong to.
+    """
+    lengths = []
+    for task, (input_ids, attention_mask, labels) in items:
+        length = int(attention_mask.sum())
+        if task == ner_task:
+            labelled = (labels != -100).nonzero()
+            if len(labelled):
+                length = max(length, int(labelled[-1]) + 1)
+        lengths.append(length)
+    seq_len = max(lengths)
+
+    batch_input_ids = torch.full((len(items), seq_len), tokenizer.pad_token_id, dtype=torch.long)
+    batch_attention_mask = torch.zeros((len(items), seq_len), dtype=torch.long)
+    batch_ner_labels = torch.full((len(items), seq_len), -100, dtype=torch.long)
+    batch_re_labels = torch.full((len(items),), -100, dtype=torch.long)
+    for row, (task, (input_ids, attention_mask, labels)) in enumerate(items):
+        length = min(len(input_ids), seq_len)
+        batch_input_ids[row, :length] = input_ids[:length]
+        batch_attention_mask[row, :length] = attention_mask[:length]
+        if task == ner_task:
+            batch_ner_labels[row, :length] = labels[:length]
+        else:
+            batch_re_labels[row] = labels
+    return batch_input_ids, batch_attention_mask, batch_ner_labels, batch_re_labels
 
-# Create separate DataLoaders for NER and RE tasks
+
+# NER and RE examples share batches: one forward pass, one summed loss and one
+# optimizer step per batch. Without relation data every batch is NER only
 ner_dataset = TensorDataset(ner_input_ids, ner_attention_masks, ner_labels)
-ner_loader = DataLoader(ner_dataset, batch_size=batch_size)
+datasets = [ner_dataset]
+if len(re_input_ids) > 0:
+    datasets.append(TensorDataset(re_input_ids, re_attention_masks, re_labels))
+task_sampler = TemperatureBatchSampler([len(dataset) for dataset in datasets], batch_size, temperature=task_temperature)
+train_loader = DataLoader(MultiTaskDataset(datasets), batch_sampler=task_sampler, collate_fn=joint_collate)
 
 
 # Initialize the custom BERT model
@@ -264,7 +301,8 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model.to(device)
 
 optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
-total_steps = len(ner_loader) * num_epochs  # You can adjust this based on your requirements
+total_steps = len(train_loader) * num_epochs  # You can adjust this based on your requirements
+loss_fct = nn.CrossEntropyLoss()
 
 for epoch in tqdm(range(num_epochs), desc="Training epochs"):
     print(f'Epoch {epoch+1}/{num_epochs}')
@@ -275,29 +313,32 @@ for epoch in tqdm(range(num_epochs), desc="Training epochs"):
     ner_num_batches = 0
     re_num_batches = 0
 
-    for ner_batch, re_batch in tqdm(zip(ner_loader, re_loader) if re_loader is not None else zip(ner_loader, [None] * len(ner_loader)), desc="Training batches"):
-        # Training NER
-        optimizer.zero_grad()
-        input_ids, attention_masks, ner_labels = tuple(t.to(device) for t in ner_batch)
-        outputs = model(input_ids, attention_mask=attention_masks, ner_labels=ner_labels)
-        ner_loss = outputs[0]
-        ner_epoch_loss += ner_loss.item()
-        ner_num_batches += 1
-        ner_loss.backward()
-        optimizer.step()
+    task_sampler.set_epoch(epoch)
+    for batch in tqdm(train_loader, desc="Training batches"):
+        input_ids, attention_masks, ner_labels, re_labels = batch
+        # Checked on the CPU batch, so there is no device sync; a task with no
+        # rows in this batch adds no loss term (its mean would be NaN)
+        has_ner = bool((ner_labels != -100).any())
+        has_re = bool((re_labels != -100).any())
+        input_ids, attention_masks, ner_labels, re_labels = (t.to(device) for t in batch)
 
-        # Training RE
-        if re_batch is not None:
-            optimizer.zero_grad()
-            input_ids, attention_masks, re_labels = tuple(t.to(device) for t in re_batch)
-            outputs = model(input_ids, attention_mask=attention_masks, re_labels=re_labels)
-            re_loss = outputs[0]
+        optimizer.zero_grad()
+        ner_logits, re_logits = model(input_ids, attention_mask=attention_masks)
+        loss = 0
+        if has_ner:
+            ner_loss = loss_fct(ner_logits.view(-1, model.config.num_ner_labels), ner_labels.view(-1))
+            ner_epoch_loss += ner_loss.item()
+            ner_num_batches += 1
+            loss = loss + ner_loss
+        if has_re:
+            re_loss = loss_fct(re_logits.view(-1, model.config.num_re_labels), re_labels)
             re_epoch_loss += re_loss.item()
             re_num_batches += 1
-            re_loss.backward()
-            optimizer.step()
+            loss = loss + re_loss
+        loss.backward()
+        optimizer.step()
 
-    ner_epoch_loss /= ner_num_batches
+    ner_epoch_loss /= ner_num_batches if ner_num_batches > 0 else 1
     re_epoch_loss /= re_num_batches if re_num_batches > 0 else 1
 
     print(f'Train loss NER: {ner_epoch_loss} Train loss RE: {re_epoch_loss}')
@@ -306,7 +347,7 @@ for epoch in tqdm(range(num_epochs), desc="Training epochs"):
 # Save the fine-tuned custom BERT model and tokenizer
 output_dir = "models/combined"
 os.makedirs(output_dir, exist_ok=True)
-model.save_pretrained(output_dir)
+model.save_pretrained(output_dir, safe_serialization=True)
 tokenizer.save_pretrained(output_dir)
 
 # Save the label_to_id and relation_to_id mappings
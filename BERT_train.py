@@ -1,255 +1,129 @@
 import os
 import torch
 import json
-from torch.utils.data import DataLoader, Dataset
-from transformers import BertTokenizer, BertModel, BertPreTrainedModel, DistilBertPreTrainedModel, BertConfig, get_linear_schedule_with_warmup, AdamW, BertTokenizerFast, DistilBertConfig, DistilBertTokenizerFast, DistilBertModel
+from torch.utils.data import DataLoader
+from transformers import BertConfig, get_linear_schedule_with_warmup, AdamW, BertTokenizerFast
 from tqdm import tqdm
-from torch import nn
 from torch.nn import CrossEntropyLoss
-import warnings
 import logging
-import torch.nn as nn
-import itertools
+from contextlib import nullcontext
 logging.getLogger("transformers").setLevel(logging.ERROR)
-from torch.nn.utils.rnn import pad_sequence
-from torch.cuda.amp import autocast, GradScaler
-import torch.distributed as dist
-
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+from torch.cuda.amp import autocast
+from autotune import apply_profile
+from models import BertForNERAndRE
+from bert_data import preprocess_data, NERRE_Dataset, window_examples, custom_collate_fn, validate_json, label_maps_from_index, document_key
+from dict_store import build_store
+from checkpoint import CheckpointManager, ResumableSampler, training_state, restore_training_state
+import profiling
+from memory import MemoryTracker, MemoryBudget
+from evaluate import Evaluator, split_dataset, format_metrics
+from shards import ShardedJSONLDataset, load_index, read_documents, split_key_name
+from schema import iter_documents
+import argparse
+import shutil
+import time
+
+parser = argparse.ArgumentParser(description="Train BertForNERAndRE")
+parser.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint in --checkpoint-dir")
+parser.add_argument("--checkpoint-dir", default="models/checkpoints/bert")
+parser.add_argument("--checkpoint-every-steps", type=int, default=500)
+parser.add_argument("--checkpoint-every-minutes", type=float, default=None)
+parser.add_argument("--keep-checkpoints", type=int, default=3)
+profiling.add_profiling_args(parser)
+parser.add_argument("--activation-checkpointing", type=int, default=0, metavar="STRIDE", help="Recompute every STRIDE-th encoder layer in backward (0: off)")
+parser.add_argument("--memory-budget-mb", type=float, default=None, help="Split batches (then shorten sequences) whose estimated activations exceed this")
+parser.add_argument("--memory-report-only", action="store_true", help="Only warn about over-budget batches")
+parser.add_argument("--memory-report", default=None, help="Track per-step memory and write the report to this JSON file")
+parser.add_argument("--dev-fraction", type=float, default=0.1, help="Documents held out for evaluation (0: none)")
+parser.add_argument("--eval-steps", type=int, default=500, help="Evaluate on the dev set every N steps, and after every epoch (0: epochs only)")
+parser.add_argument("--eval-batch-size", type=int, default=64)
+parser.add_argument("--shards", default=None, help="Stream a shards.py corpus directory instead of reading every file in test/")
+parser.add_argument("--shuffle-buffer", type=int, default=1000, help="Windows in the shuffle buffer of each streaming reader")
+# parse_known_args leaves options meant for scripts that import this one (dis_train.py)
+args = parser.parse_known_args()[0]
+
+# Settings tuned by autotune.py override these defaults when a profile exists
+tuning = apply_profile("train.bert", {"tokenizers_parallelism": False, "intra_op_threads": None, "inter_op_threads": None, "batch_size": 8, "num_workers": None})
 tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-batch_size = 8
+batch_size = tuning["batch_size"]
 num_epochs = 4
 learning_rate = 5e-5
+# "entity" labels tokens B-/I-{type}-{entity_name}; "type" labels them B-/I-{type}
+# only and resolves entity names afterwards through the corpus dictionary store
+label_scheme = "entity"
 
 unique_ner_labels = set()
 unique_relation_labels = set()
 unique_ner_labels.add("O")
 
-# Existing preprocessing functions
-def preprocess_data(json_data, tokenizer, label_to_id, relation_to_id):
-    ner_data = []
-    re_data = []
-    re_indices = []
-
-    entities_dict = {entity["entityId"]: entity for entity in json_data["entities"]}
-    entity_ids = set(entities_dict.keys())
-
-    relation_dict = {}
-    for relation in json_data["relation_info"]:
-        subject_id = relation["subjectID"]
-        obj_id = relation["objectId"]
-        if subject_id not in relation_dict:
-            relation_dict[subject_id] = {}
-        relation_dict[subject_id][obj_id] = relation["rel_name"]
-
-    text = json_data["text"]
-    current_idx = 0
-    for entity in sorted(json_data["entities"], key=lambda x: x["span"]["begin"]):
-        begin, end = entity["span"]["begin"], entity["span"]["end"]
-        entity_type = entity["entityType"]
-        entity_id = entity["entityId"]
-        entity_name = entity["entityName"]
-
-        entity_text = text[begin:end].strip()
-        entity_tokens = tokenizer.tokenize(entity_text)
-
-        while current_idx < begin:
-            ner_data.append((text[current_idx], "O", len(ner_data)))
-            current_idx += 1
-
-        for i, token in enumerate(entity_tokens):
-            if i == 0:
-                label = f"B-{entity_type}-{entity_name}"
-            else:
-                label = f"I-{entity_type}-{entity_name}"
-
-            if label not in label_to_id:
-                label_to_id[label] = len(label_to_id)
-
-            ner_data.append((token, label, len(ner_data)))
-            current_idx += len(token)
-
-        current_idx = end
-
-        if f"{entity_type}-{entity_name}" not in label_to_id:
-            label_to_id[f"{entity_type}-{entity_name}"] = len(label_to_id)
-
-    for entity_id_1, entity_id_2 in itertools.combinations(entity_ids, 2):
-        if entity_id_1 in relation_dict and entity_id_2 in relation_dict[entity_id_1]:
-            rel_name = relation_dict[entity_id_1][entity_id_2]
-            entity_1 = entities_dict[entity_id_1]
-            entity_2 = entities_dict[entity_id_2]
-            re_data.append({
-                'id': (entity_id_1, entity_id_2),
-                'subject': text[entity_1["span"]["begin"]:entity_1["span"]["end"]],
-                'object': text[entity_2["span"]["begin"]:entity_2["span"]["end"]],
-                'relation': rel_name,
-                'subject_tokens': tokenizer.tokenize(text[entity_1["span"]["begin"]:entity_1["span"]["end"]]),
-                'object_tokens': tokenizer.tokenize(text[entity_2["span"]["begin"]:entity_2["span"]["end"]])
-            })
-
-            if rel_name not in relation_to_id:
-                relation_to_id[rel_name] = len(relation_to_id)
-
-            subject_start_idx = [idx for token, label, idx in ner_data if label == f"B-{entity_1['entityType']}-{entity_1['entityName']}"][0]
-            object_start_idx = [idx for token, label, idx in ner_data if label == f"B-{entity_2['entityType']}-{entity_2['entityName']}"][0]
-            re_indices.append((subject_start_idx, object_start_idx))
-
-    while current_idx < len(text):
-        ner_data.append((text[current_idx], "O", len(ner_data)))
-        current_idx += 1
-
-    if "O" not in label_to_id:
-        label_to_id["O"] = len(label_to_id)
-
-    re_labels = [relation_to_id[relation['relation']] for relation in re_data]
-
-    preprocessed_data = [{
-        'ner_data': ner_data,
-        're_data': re_data,
-        're_indices': re_indices,
-        're_labels': re_labels
-    }] if len(re_data) > 0 else []
-
-    return preprocessed_data
-
-
-class NERRE_Dataset(Dataset):
-    def __init__(self, data, tokenizer, max_length, label_to_id, relation_to_id):
-        self.data = data
-        self.tokenizer = tokenizer
-        self.max_length = max_length
-        self.label_to_id = label_to_id
-        self.relation_to_id = relation_to_id
-
-    def __len__(self):
-        return len(self.data)
-
-    def __getitem__(self, idx):
-        item = self.data[idx]
-        
-        # If re_labels is empty, return None
-        if len(item['re_labels']) == 0:
-            return None
-        
-        # Tokenize the text and prepare inputs
-        tokens = [token for token, _, _ in item['ner_data']]
-        ner_labels = [label for _, label, _ in item['ner_data']]
-        ner_label_ids = [self.label_to_id[label] for label in ner_labels]
-
-        inputs = self.tokenizer(tokens, padding='max_length', truncation=True, max_length=512, return_tensors='pt')
-
-        input_ids = inputs['input_ids'].squeeze()
-        attention_mask = inputs['attention_mask'].squeeze()
-        token_type_ids = inputs['token_type_ids'].squeeze()
-
-        if len(item['re_indices']) == 0:
-            # Handle the case when re_indices is empty
-            # Return None for subject_indices and object_indices
-            subject_indices = None
-            object_indices = None
-        else:
-            # Split the re_indices tuples into separate lists of subject and object indices
-            subject_indices, object_indices = zip(*item['re_indices'])
-
-        return {
-            'input_ids': input_ids,
-            'attention_mask': attention_mask,
-            'token_type_ids': token_type_ids,
-            'ner_labels': torch.tensor(ner_label_ids, dtype=torch.long),
-            're_labels': torch.tensor(item['re_labels'], dtype=torch.long),
-            're_indices': torch.tensor(list(zip(subject_indices, object_indices)), dtype=torch.long) if subject_indices is not None and object_indices is not None else None
-        }
-
-def pad_relation_indices(re_indices_list, max_relations, padding_value=-1):
-    padded_re_indices = []
-    for re_indices in re_indices_list:
-        padding_tensor = torch.full((max_relations - len(re_indices), 2), padding_value, dtype=torch.long)
-        padded_indices = torch.cat([re_indices, padding_tensor], dim=0)
-        padded_re_indices.append(padded_indices)
-    return torch.stack(padded_re_indices, dim=0)
-
-
-def custom_collate_fn(batch):
-    # Remove None values from the batch
-    #batch = [item for item in batch if item is not None]
-
-    # Pad input_ids, attention_mask, and token_type_ids
-    input_ids = pad_sequence([item['input_ids'] for item in batch], batch_first=True)
-    attention_mask = pad_sequence([item['attention_mask'] for item in batch], batch_first=True)
-    token_type_ids = pad_sequence([item['token_type_ids'] for item in batch], batch_first=True)
-
-    # Pad ner_labels
-    ner_labels = pad_sequence([item['ner_labels'] for item in batch], batch_first=True, padding_value=-100)
-    
-    # Pad re_labels
-    re_labels = pad_sequence([item['re_labels'] for item in batch], batch_first=True, padding_value=-1)
-
-    # Pad re_indices
-    re_indices_list = [item['re_indices'] for item in batch if item['re_indices'] is not None]
-
-    if len(re_indices_list) > 0:
-        max_relations = max(len(re_indices) for re_indices in re_indices_list)
-        re_indices = pad_relation_indices(re_indices_list, max_relations)
-        re_indices = torch.stack(tuple(re_indices), dim=0)  # concatenate tensors along a new dimension
-    else:
-        re_indices = None
-
-    # Return the final dictionary
-    return {
-        "input_ids": input_ids,
-        "attention_mask": attention_mask,
-        "token_type_ids": token_type_ids,
-        "ner_labels": ner_labels,
-        "re_labels": re_labels,
-        "re_indices": re_indices,
-    }
-
 label_to_id = {}
 relation_to_id = {}
 
 json_directory = "test"
 preprocessed_data = []
 
-# Iterate through all JSON files in the directory
-def validate_json(json_data):
-    # Check if the necessary keys are present
-    if "entities" not in json_data or "relation_info" not in json_data or "text" not in json_data:
-        return False
-
-    # Check if there are entities and relations
-    if len(json_data["entities"]) == 0 or len(json_data["relation_info"]) == 0:
-        return False
-
-    # Additional validation criteria can be added here based on your data format
-
-    return True
-
-for file_name in os.listdir(json_directory):
-    if file_name.endswith(".json"):
-        json_path = os.path.join(json_directory, file_name)
-
-        try:
-            with open(json_path, "r") as json_file:
-                json_data = json.load(json_file)
+def document_windows(document):
+    """The training windows of one corpus document; runs in the DataLoader workers when streaming."""
+    if not validate_json(document):
+        return []
+    # The label maps are complete, so preprocess_data adds no ids in the workers
+    items = preprocess_data(document, tokenizer, label_to_id, relation_to_id, label_scheme)
+    if not items:
+        return []
+    windows = NERRE_Dataset(items, tokenizer, max_length, label_to_id, relation_to_id, stride=stride)
+    return [windows[i] for i in range(len(windows))]
+
+
+if args.shards:
+    # Streaming: the vocabulary comes from the index, documents are read during training
+    label_to_id, relation_to_id = label_maps_from_index(load_index(args.shards), label_scheme)
+    file_names = []
+else:
+    file_names = os.listdir(json_directory)
 
-            if validate_json(json_data):
-                preprocessed_file_data = preprocess_data(json_data, tokenizer, label_to_id, relation_to_id)
-                preprocessed_data.extend(preprocessed_file_data)
-            else:
-                print(f"Skipping {json_path} due to invalid JSON data")
-        except json.JSONDecodeError as e:
-            print(f"Error loading {json_path}: {e}")
-            continue
+# Malformed files are reported and skipped by iter_documents
+for json_path, document in iter_documents(json_directory, file_names):
+    if validate_json(document):
+        preprocessed_file_data = preprocess_data(document, tokenizer, label_to_id, relation_to_id, label_scheme)
+        preprocessed_data.extend(preprocessed_file_data)
+    else:
+        print(f"Skipping {json_path}: no entities or relations")
 
-max_length = 128
-if device.type == "cuda":
+max_length = 128  # window size, long documents are split into overlapping windows
+stride = 64
+if tuning["num_workers"] is not None:
+    num_workers = tuning["num_workers"]
+elif device.type == "cuda":
     num_workers = 6
 else:
     num_workers = 6
-dataset = NERRE_Dataset(preprocessed_data, tokenizer, max_length, label_to_id, relation_to_id)
-dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, num_workers=num_workers, shuffle=True)
+if args.shards:
+    # shards.py already held out the dev documents, on the same key as below; the dev split is small enough to load
+    if load_index(args.shards).get("split_key") != split_key_name:
+        raise ValueError(f"{args.shards} holds out other dev documents than BERT_train.py does; convert it again")
+    dev_data = []
+    for document in read_documents(args.shards, "dev"):
+        if validate_json(document):
+            dev_data.extend(preprocess_data(document, tokenizer, label_to_id, relation_to_id, label_scheme))
+    dataset = ShardedJSONLDataset(args.shards, document_windows, shuffle_buffer=args.shuffle_buffer, batch_size=batch_size)
+    # The dataset is its own resumable sampler
+    sampler = dataset
+    print(f"Streaming {dataset.num_documents} documents from {len(dataset.shards)} shards, "
+          f"~{dataset.estimate_items_per_document():.1f} windows per document")
+    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, num_workers=num_workers, pin_memory=device.type == "cuda")
+else:
+    # Hold out whole documents, keyed on their text, so no window of a dev document is trained on.
+    # shards.split_key builds the same key from a document, for the sharded mode
+    preprocessed_data, dev_data = split_dataset(preprocessed_data, document_key, args.dev_fraction)
+    dataset = NERRE_Dataset(preprocessed_data, tokenizer, max_length, label_to_id, relation_to_id, stride=stride)
+    # The sampler's order depends only on (seed, epoch), so a resumed run can skip
+    # exactly the batches it already trained on
+    sampler = ResumableSampler(len(dataset))
+    loader_generator = torch.Generator()
+    loader_generator.manual_seed(0)
+    # Batches are all tensors, so workers can hand them over in pinned memory for async copies
+    dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, num_workers=num_workers, sampler=sampler, generator=loader_generator, pin_memory=device.type == "cuda")
 
 # Print the first 5 batches from the DataLoader
 for i, batch in enumerate(dataloader):
@@ -262,78 +136,6 @@ for i, batch in enumerate(dataloader):
 # Check the length of the DataLoader
 print(f"Number of batches in DataLoader: {len(dataloader)}")
 
-class BertForNERAndRE(BertPreTrainedModel):
-    def __init__(self, config, num_ner_labels, num_re_labels):
-        super().__init__(config)
-
-        self.num_ner_labels = num_ner_labels
-        self.num_re_labels = num_re_labels
-
-        self.bert = BertModel(config)
-        self.dropout = nn.Dropout(config.hidden_dropout_prob)
-        
-        self.classifier = nn.Linear(config.hidden_size, self.num_ner_labels)
-
-        # Define the bilinear layer for RE classification
-        self.re_classifier = nn.Bilinear(config.hidden_size, config.hidden_size, self.num_re_labels)
-
-        self.init_weights()
-
-    def forward(
-        self,
-        input_ids=None,
-        attention_mask=None,
-        token_type_ids=None,
-        position_ids=None,
-        head_mask=None,
-        inputs_embeds=None,
-        ner_labels=None,
-        re_labels=None,
-        re_indices=None,
-    ):
-        outputs = self.bert(
-            input_ids,
-            attention_mask=attention_mask,
-            token_type_ids=token_type_ids,
-            position_ids=position_ids,
-            head_mask=head_mask,
-            inputs_embeds=inputs_embeds,
-        )
-
-        sequence_output = outputs[0]
-        sequence_output = self.dropout(sequence_output)
-        ner_logits = self.classifier(sequence_output)
-
-        if ner_labels is not None:
-            loss_fct = nn.CrossEntropyLoss(ignore_index=-1)
-            active_loss = attention_mask.view(-1) == 1
-            active_logits = ner_logits.view(-1, self.num_ner_labels)[active_loss]  # Use self.num_ner_labels instead of self.num_labels
-            active_labels = ner_labels.view(-1)[active_loss]
-            ner_loss = loss_fct(active_logits, active_labels)
-        else:
-            ner_loss = None
-
-        if re_indices is not None and re_indices.size(1) > 0:
-            # Initialize an empty tensor for storing RE logits
-            re_logits = torch.zeros(sequence_output.size(0), sequence_output.size(1), re_indices.size(1), self.num_re_labels).to(sequence_output.device)
-
-            # Iterate over the samples and sentences in the batch
-            for b in range(sequence_output.size(0)):
-                for s in range(sequence_output.size(1)):
-                    for i in range(re_indices.size(1)):
-                        if re_indices[b, i, 0] != -1 and re_indices[b, i, 1] != -1:
-                            # Extract subject and object hidden states from sequence_output using re_indices
-                            subject_hidden_states = sequence_output[b, s, re_indices[b, i, 0]]
-                            object_hidden_states = sequence_output[b, s, re_indices[b, i, 1]]
-
-                            # Compute RE logits using the bilinear layer and the extracted hidden states
-                            relation_logits = self.re_classifier(subject_hidden_states, object_hidden_states)
-                            re_logits[b, s, i, :] = relation_logits
-        else:
-            re_logits = None  # Set re_logits to None if re_indices is None or empty
-
-        return {'ner_logits': ner_logits, 're_logits': re_logits, 'ner_loss': ner_loss}
-
 # Set up the configuration, model, and tokenizer
 config = BertConfig.from_pretrained("bert-base-uncased")
 tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
@@ -342,6 +144,8 @@ tokenizer = BertTokenizerFast.from_pretrained("bert-base-uncased")
 num_ner_labels = len(label_to_id)
 num_re_labels = len(relation_to_id)
 model = BertForNERAndRE(config, num_ner_labels, num_re_labels)
+if args.activation_checkpointing:
+    model.set_activation_checkpointing(args.activation_checkpointing)
 model = model.to(device)
 
 # Mixed precision training
@@ -358,81 +162,170 @@ accumulation_counter = 0
 ner_loss_fn = CrossEntropyLoss(ignore_index=-100)
 re_loss_fn = CrossEntropyLoss(ignore_index=-1)
 
-def train(model, dataloader, device, num_epochs, learning_rate, accumulation_steps):
-    for epoch in range(num_epochs):
-        progress_bar = tqdm(dataloader, desc=f"Epoch {epoch + 1}/{num_epochs}")
-
-        for step, batch in enumerate(progress_bar):
+def train(model, dataloader, device, num_epochs, learning_rate, accumulation_steps, sampler=None, checkpoints=None, resume=False, timer=None, profiler=None, memory_tracker=None, memory_budget=None, evaluator=None, eval_steps=0):
+    timer = timer or profiling.StepTimer()
+    profiler = profiler or profiling.ProfilerWindow()
+    memory_tracker = memory_tracker or MemoryTracker(model, enabled=False)
+    accumulation_counter = 0
+    start_epoch, start_step, global_step = 0, 0, 0
+    if resume and checkpoints is not None:
+        state = checkpoints.load()
+        if state is not None:
+            counters = restore_training_state(state, model, optimizer, scheduler, scaler, sampler)
+            start_epoch, start_step, global_step = counters["epoch"], counters["step"], counters["global_step"]
+            accumulation_counter = counters["accumulation_counter"]
+
+    for epoch in range(start_epoch, num_epochs):
+        # When resuming mid-epoch, skip the batches that were already trained on
+        first_step = start_step if epoch == start_epoch else 0
+        if sampler is not None:
+            sampler.set_epoch(epoch, first_step * dataloader.batch_size)
+        progress_bar = tqdm(dataloader, desc=f"Epoch {epoch + 1}/{num_epochs}", initial=first_step, total=first_step + len(dataloader))
+        epoch_start = time.perf_counter()
+        eval_seconds = 0.0
+
+        for step, batch in enumerate(progress_bar, start=first_step):
+            timer.data_ready()
+            profiler.step(global_step)
             try:
                 model.train()
 
-                input_ids = batch['input_ids'].view(-1, batch['input_ids'].size(-1)).to(device)
-                attention_mask = batch['attention_mask'].view(-1, batch['attention_mask'].size(-1)).to(device)
-                token_type_ids = batch['token_type_ids'].view(-1, batch['token_type_ids'].size(-1)).to(device)
-                ner_labels = batch['ner_labels'].view(-1).to(device)
-                re_labels = batch['re_labels'].to(device)
-                re_indices = batch['re_indices']
-
-                if re_indices is not None:
-                    re_indices = re_indices.to(device)
+                # Over-budget batches run as micro-batches whose gradients add up to the full batch's
+                if memory_budget is not None:
+                    num_pairs = batch['re_indices'].size(1) if batch['re_indices'] is not None else 0
+                    pieces = memory_budget.split(batch, num_pairs=num_pairs)
+                    # The measured peak recalibrates the estimate for the next batches
+                    measure = memory_budget.measure(*pieces[0]['input_ids'].shape[:2], num_pairs=num_pairs, device=device, tracker=memory_tracker)
                 else:
-                    re_indices = None
-
-                with autocast():
-                    # Forward pass
-                    outputs = model(
-                        input_ids=input_ids,
-                        attention_mask=attention_mask,
-                        token_type_ids=token_type_ids,
-                        ner_labels=ner_labels,
-                        re_labels=re_labels,
-                        re_indices=re_indices if re_indices is not None else None,
-                    )
-
-                    # Get NER and RE logits from model output
-                    ner_logits = outputs["ner_logits"]
-                    re_logits = outputs["re_logits"]
-
-                    # Calculate NER loss
-                    ner_loss = ner_loss_fn(ner_logits.view(-1, ner_logits.size(-1)), ner_labels.view(-1))
-                    # Calculate RE loss
-                    re_loss = 0
-                    for b in range(re_logits.size(0)):
-                        for s in range(re_logits.size(1)):
-                            re_loss += re_loss_fn(re_logits[b, s].view(-1, re_logits.size(-1)), re_labels[b, s].view(-1))
-
-                    # Normalize RE loss by the number of sentences
-                    re_loss /= (re_logits.size(0) * re_logits.size(1))
-
-                    # Combine NER and RE losses using a weighted sum
-                    loss_weight = 0.5  # Adjust this value based on the importance of each task
-                    total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
-
-                scaler.scale(total_loss).backward()
+                    pieces = [batch]
+                    measure = nullcontext()
+
+                with memory_tracker.step(global_step), measure:
+                    for piece in pieces:
+                        weight = piece['input_ids'].size(0) / batch['input_ids'].size(0)
+                        with timer.section("h2d"):
+                            input_ids = piece['input_ids'].view(-1, piece['input_ids'].size(-1)).to(device, non_blocking=True)
+                            attention_mask = piece['attention_mask'].view(-1, piece['attention_mask'].size(-1)).to(device, non_blocking=True)
+                            token_type_ids = piece['token_type_ids'].view(-1, piece['token_type_ids'].size(-1)).to(device, non_blocking=True)
+                            ner_labels = piece['ner_labels'].view(-1).to(device, non_blocking=True)
+                            re_labels = piece['re_labels'].to(device, non_blocking=True)
+                            re_indices = piece['re_indices']
+
+                            if re_indices is not None:
+                                # Entities cut off by a shortened sequence cannot be scored
+                                cut = (re_indices >= input_ids.size(1)).any(dim=-1)
+                                re_indices = re_indices.masked_fill(cut.unsqueeze(-1), -1).to(device, non_blocking=True)
+                                re_labels = re_labels.masked_fill(cut.to(device), -1)
+
+                        with autocast():
+                            # Forward pass
+                            with timer.section("forward"):
+                                outputs = model(
+                                    input_ids=input_ids,
+                                    attention_mask=attention_mask,
+                                    token_type_ids=token_type_ids,
+                                    ner_labels=ner_labels,
+                                    re_labels=re_labels,
+                                    re_indices=re_indices if re_indices is not None else None,
+                                )
+
+                            with timer.section("loss"):
+                                # Get NER and RE logits from model output
+                                ner_logits = outputs["ner_logits"]
+                                re_logits = outputs["re_logits"]
+
+                                # Calculate NER loss
+                                ner_loss = ner_loss_fn(ner_logits.view(-1, ner_logits.size(-1)), ner_labels.view(-1))
+                                # Calculate RE loss over every relation of the batch at once
+                                if re_logits is not None and (re_labels != -1).any():
+                                    re_loss = re_loss_fn(re_logits.reshape(-1, re_logits.size(-1)).float(), re_labels.reshape(-1))
+                                else:
+                                    re_loss = ner_loss * 0.0
+
+                                # Combine NER and RE losses using a weighted sum
+                                loss_weight = 0.5  # Adjust this value based on the importance of each task
+                                total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
+
+                        with timer.section("backward"):
+                            scaler.scale(total_loss * weight).backward()
+
+                if memory_tracker.enabled and global_step % 100 == 0:
+                    tqdm.write(memory_tracker.format())
 
                 # Update counter
                 accumulation_counter += 1
 
                 # Perform optimization step and zero gradients if counter has reached accumulation steps
                 if accumulation_counter % accumulation_steps == 0:
-                    scaler.step(optimizer)
-                    scaler.update()
-                    scheduler.step()
-                    optimizer.zero_grad()
+                    with timer.section("optimizer"):
+                        scaler.step(optimizer)
+                        scaler.update()
+                        scheduler.step()
+                        optimizer.zero_grad()
 
                 # Update progress bar
-                progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item()})
+                progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item(), **timer.postfix()})
 
             except Exception as e:
                 print(f"Skipping batch due to error: {e}")
                 continue
+
+            finally:
+                if evaluator is not None and eval_steps and (global_step + 1) % eval_steps == 0:
+                    metrics = evaluator.evaluate(model)
+                    eval_seconds += metrics["seconds"]
+                    tqdm.write(f"Step {global_step + 1}: {format_metrics(metrics)}")
+                timer.end_step()
+                global_step += 1
+                if checkpoints is not None and checkpoints.should_save(global_step):
+                    checkpoints.save(global_step, training_state(
+                        model, optimizer, scheduler, scaler, sampler,
+                        epoch=epoch, step=step + 1, global_step=global_step, accumulation_counter=accumulation_counter,
+                    ))
+
+        if evaluator is not None:
+            metrics = evaluator.evaluate(model)
+            eval_seconds += metrics["seconds"]
+            print(f"Epoch {epoch + 1}: {format_metrics(metrics)}")
+            print(f"Evaluation took {eval_seconds / (time.perf_counter() - epoch_start):.1%} of the epoch")
+
+    profiler.stop()
+    if checkpoints is not None:
+        checkpoints.wait()
     return model
 
 
+checkpoints = CheckpointManager(args.checkpoint_dir, args.checkpoint_every_steps, args.checkpoint_every_minutes, args.keep_checkpoints)
+timer, profiler = profiling.from_args(args)
+memory_tracker = MemoryTracker(model, enabled=args.memory_report is not None)
+memory_budget = None
+if args.memory_budget_mb:
+    # Activations are fp16 under autocast
+    memory_budget = MemoryBudget(args.memory_budget_mb, config, num_ner_labels, num_re_labels, training=True, dtype_bytes=2 if device.type == "cuda" else 4, report_only=args.memory_report_only)
+evaluator = None
+if dev_data:
+    dev_dataset = NERRE_Dataset(dev_data, tokenizer, max_length, label_to_id, relation_to_id, stride=stride)
+    evaluator = Evaluator(
+        window_examples(dev_dataset),
+        {v: k for k, v in label_to_id.items()},
+        batch_size=args.eval_batch_size,
+        device=device,
+        pad_id=tokenizer.pad_token_id,
+        re_negative=relation_to_id.get("no_relation"),
+    )
+    print(f"Evaluating on {len(evaluator)} windows of {len(dev_data)} held-out documents")
+model = train(model, dataloader, device, num_epochs, learning_rate, accumulation_steps, sampler=sampler, checkpoints=checkpoints, resume=args.resume, timer=timer, profiler=profiler, memory_tracker=memory_tracker, memory_budget=memory_budget, evaluator=evaluator, eval_steps=args.eval_steps)
+if args.step_timings:
+    timer.export(args.step_timings)
+if args.memory_report:
+    memory_tracker.export(args.memory_report)
+
+
 # Save the fine-tuned custom BERT model and tokenizer
 output_dir = "models/combined"
 os.makedirs(output_dir, exist_ok=True)
-model.save_pretrained(output_dir)
+model.config.label_scheme = label_scheme
+model.save_pretrained(output_dir, safe_serialization=True)
 tokenizer.save_pretrained(output_dir)
 
 # Save the label_to_id and relation_to_id mappings
@@ -441,3 +334,12 @@ with open(os.path.join(output_dir, "label_to_id.json"), "w") as f:
 
 with open(os.path.join(output_dir, "relation_to_id.json"), "w") as f:
     json.dump(relation_to_id, f)
+
+# Type-level labels carry no entity names; ship the dictionary that resolves them
+if label_scheme == "type":
+    if not args.shards:
+        build_store(json_directory, os.path.join(output_dir, "entity_dict.sqlite"))
+    elif os.path.exists(os.path.join(args.shards, "entity_dict.sqlite")):
+        shutil.copy(os.path.join(args.shards, "entity_dict.sqlite"), output_dir)
+    else:
+        print(f"No entity_dict.sqlite in {args.shards}; convert with --entity-dict to ship one")
@@ -1,27 +1,58 @@
 import os
 import torch
 import json
-from torch.utils.data import DataLoader, Dataset
-from transformers import BertTokenizer, BertModel, BertPreTrainedModel, DistilBertPreTrainedModel, BertConfig, get_linear_schedule_with_warmup, AdamW, BertTokenizerFast, DistilBertConfig, DistilBertTokenizerFast, DistilBertModel
+from torch.utils.data import DataLoader
+from transformers import get_linear_schedule_with_warmup, AdamW, DistilBertConfig, DistilBertTokenizerFast
 from tqdm import tqdm
-from torch import nn
 from torch.nn import CrossEntropyLoss
-import warnings
 import logging
-import torch.nn as nn
 import pickle
 logging.getLogger("transformers").setLevel(logging.ERROR)
-from torch.nn.utils.rnn import pad_sequence
-from torch.cuda.amp import autocast, GradScaler
-import traceback
-import torch.nn.functional as F
-import random
+from autotune import apply_profile
+from models import DistilBertForNERAndRE
+import argparse
+from checkpoint import CheckpointManager, ResumableSampler, training_state, restore_training_state
+import profiling
+import functools
+import time
+from packing import record_relations, record_to_example, pad_examples, PackedDataset, packed_collate_fn
+from records import RecordStore, sentence_key
+from evaluate import Evaluator, split_dataset, format_metrics
+from memory import MemoryTracker, MemoryBudget
+from contextlib import nullcontext
+
+parser = argparse.ArgumentParser(description="Train DistilBertForNERAndRE")
+parser.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint in --checkpoint-dir")
+parser.add_argument("--checkpoint-dir", default="models/checkpoints/distilbert")
+parser.add_argument("--checkpoint-every-steps", type=int, default=500)
+parser.add_argument("--checkpoint-every-minutes", type=float, default=None)
+parser.add_argument("--keep-checkpoints", type=int, default=3)
+profiling.add_profiling_args(parser)
+parser.add_argument("--pack", action="store_true", help="Pack several relation sentences into each max_length row")
+parser.add_argument("--activation-checkpointing", type=int, default=0, metavar="STRIDE", help="Recompute every STRIDE-th encoder layer in backward (0: off)")
+parser.add_argument("--records", default="preprocessed_re_data.pkl", help="Preprocessed RE records: the pickle, or a compact .npz from records.py")
+parser.add_argument("--dev-fraction", type=float, default=0.1, help="Sentences held out for evaluation (0: none)")
+parser.add_argument("--eval-steps", type=int, default=500, help="Evaluate on the dev set every N steps, and after every epoch (0: epochs only)")
+parser.add_argument("--eval-batch-size", type=int, default=64)
+parser.add_argument("--memory-budget-mb", type=float, default=None, help="Split batches (then shorten sequences) whose estimated activations exceed this")
+parser.add_argument("--memory-report-only", action="store_true", help="Only warn about over-budget batches")
+parser.add_argument("--memory-report", default=None, help="Track per-step memory and write the report to this JSON file")
+parser.add_argument("--output-dir", default="models/distilbert", help="Where the trained model is saved (BERT_train.py writes models/combined)")
+args = parser.parse_args()
 
 with open("preprocessed_ner_data.pkl", "rb") as f:
     preprocessed_ner_data = pickle.load(f)
 
-with open("preprocessed_re_data.pkl", "rb") as f:
-    preprocessed_re_data = pickle.load(f)
+compact_records = args.records.endswith(".npz")
+if compact_records:
+    # Token ids and label ids in flat arrays; examples are built on access
+    record_store = RecordStore.load(args.records)
+    preprocessed_re_data, dev_re_data = [], []
+else:
+    with open(args.records, "rb") as f:
+        preprocessed_re_data = pickle.load(f)
+    # Hold out a dev split keyed on the sentence, so a sentence's relations stay on one side
+    preprocessed_re_data, dev_re_data = split_dataset(preprocessed_re_data, lambda record: sentence_key(record["sentence_tokens"]), args.dev_fraction)
     
 with open("label_to_id.pkl", "rb") as f:
     label_to_id = pickle.load(f)
@@ -37,7 +68,8 @@ for item in preprocessed_ner_data:
     unique_ner_labels.add(item["object_text"])
 
 for item in preprocessed_re_data:
-    unique_relation_labels.add(item["rel_name"])
+    for rel in record_relations(item):
+        unique_relation_labels.add(rel["rel_name"])
 
 
 # You can also save these mappings to pickle files if needed
@@ -48,112 +80,45 @@ with open("relation_to_id.pkl", "wb") as f:
     pickle.dump(relation_to_id, f)
 
 #os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'max_split_size_mb:64'
-os.environ["TOKENIZERS_PARALLELISM"] = "false"
+# Settings tuned by autotune.py override these defaults when a profile exists
+tuning = apply_profile("train.distilbert", {"tokenizers_parallelism": False, "intra_op_threads": None, "inter_op_threads": None, "batch_size": 8, "num_workers": None})
 tokenizer = DistilBertTokenizerFast.from_pretrained('distilbert-base-uncased')  #device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 device = torch.device("cpu")
-batch_size = 8
+batch_size = tuning["batch_size"]
 num_epochs = 4
 learning_rate = 5e-5
 
-class NERRE_Dataset(Dataset):
-    def __init__(self, ner_data, re_data, tokenizer, max_length, label_to_id, relation_to_id):
-        self.ner_data = ner_data
-        self.re_data = re_data
-        self.tokenizer = tokenizer
-        self.max_length = max_length
-        self.label_to_id = label_to_id
-        self.relation_to_id = relation_to_id
-        self.ignore_label_index = max(self.label_to_id.values())  # Define ignore_label_index here
-
-    def __len__(self):
-        return len(self.ner_data)
-
-
-    def __getitem__(self, idx):
-        re_item = self.re_data[idx]
-        #print(f"Item {idx} - Type: {type(re_item)}, Contents: {re_item}")  # Add this line
-
-        required_keys = ["sentence_tokens", "subject_start_idx", "subject_end_idx", "object_start_idx", "object_end_idx", "rel_name", "subject_text", "object_text"]
-
-        if not all(key in re_item for key in required_keys):
-            print(f"Skipping item {idx} due to missing keys in re_item: {re_item}")
-            tokens = ["[UNK]"]  # Return a default value
-        else:
-            tokens = re_item["sentence_tokens"]
-
-        if not tokens:
-            # You can either return a default value or skip this item
-            # Here's an example of returning a default value:
-            tokens = ["[UNK]"]
-
-        text = " ".join(tokens)
-        inputs = self.tokenizer(
-            text,
-            padding='max_length',
-            truncation=True,
-            max_length=self.max_length,
-            return_tensors='pt',
-            return_offsets_mapping=True
-        )
-        #print(f"Tokenized output: {inputs}")
-        input_ids = inputs['input_ids'].squeeze()
-        attention_mask = inputs['attention_mask'].squeeze()
-        offsets = inputs['offset_mapping'].squeeze()
-
-        # Create ner_label_ids tensor with the same length as input_ids and initialize with a valid label index
-        ner_label_ids = torch.full_like(input_ids, self.ignore_label_index, dtype=torch.long)
-        #print(f"Item {idx} - Input_ids shape: {input_ids.shape}, Attention_mask shape: {attention_mask.shape}, NER_label_ids shape: {ner_label_ids.shape}")
-
-        # Assign the indices of the subject and object tokens using the re_item values
-        subject_start_idx = re_item['subject_start_idx']
-        subject_end_idx = re_item['subject_end_idx']
-        object_start_idx = re_item['object_start_idx']
-        object_end_idx = re_item['object_end_idx']
-
-        # Get the actual subject and object texts from the re_data
-        subject_text = re_item['subject_text']
-        object_text = re_item['object_text']
-
-        # Assign appropriate labels for the subject and object tokens
-        ner_label_ids[subject_start_idx:subject_end_idx+1] = self.label_to_id[subject_text]
-        ner_label_ids[object_start_idx:object_end_idx+1] = self.label_to_id[object_text]
-
-        re_labels = [self.relation_to_id[re_item['rel_name']]]
-
-        return {
-            'input_ids': input_ids,
-            'attention_mask': attention_mask,
-            'ner_labels': ner_label_ids,
-            're_labels': torch.tensor(re_labels, dtype=torch.long),
-            're_data': re_item
-        }
-
-
-
-def custom_collate_fn(batch):
-    input_ids = torch.stack([item['input_ids'] for item in batch], dim=0)
-    attention_mask = torch.stack([item['attention_mask'] for item in batch], dim=0)
-    ner_labels = torch.stack([item['ner_labels'] for item in batch], dim=0)
-    re_labels = torch.stack([item['re_labels'] for item in batch], dim=0)
-    re_data = [item['re_data'] for item in batch]
-
-    return {
-        'input_ids': input_ids,
-        'attention_mask': attention_mask,
-        'ner_labels': ner_labels,
-        're_labels': re_labels,
-        're_data': re_data
-    }
-
-
-
 max_length = 128
-if device.type == "cuda":
+if tuning["num_workers"] is not None:
+    num_workers = tuning["num_workers"]
+elif device.type == "cuda":
     num_workers = 6
 else:
     num_workers = 10
-dataset = NERRE_Dataset(preprocessed_ner_data, preprocessed_re_data, tokenizer, max_length, label_to_id, relation_to_id)
-dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=custom_collate_fn, num_workers=num_workers, shuffle=True, drop_last=False)
+ignore_label_index = max(label_to_id.values())
+# Unpadded examples, padded per batch
+if compact_records:
+    if record_store.label_to_id != label_to_id or record_store.relation_to_id != relation_to_id:
+        raise ValueError(f"{args.records} was converted with different label ids; convert it again")
+    train_indices, dev_indices = split_dataset(range(len(record_store)), lambda i: record_store.sentence_key(i, tokenizer), args.dev_fraction)
+    dataset = record_store.examples(ignore_label_index, train_indices)
+    dev_examples = record_store.examples(ignore_label_index, dev_indices)
+else:
+    # The records' own word pieces, the same token ids the compact store and the evaluator use
+    dataset = [record_to_example(record, tokenizer, label_to_id, relation_to_id, ignore_label_index) for record in preprocessed_re_data]
+    dev_examples = [record_to_example(record, tokenizer, label_to_id, relation_to_id, ignore_label_index) for record in dev_re_data]
+collate_fn = functools.partial(pad_examples, pad_id=tokenizer.pad_token_id, ignore_index=ignore_label_index)
+if args.pack:
+    # Short sentences share rows instead of being padded to max_length one by one
+    dataset = PackedDataset(dataset, max_length)
+    collate_fn = functools.partial(packed_collate_fn, max_length=max_length, pad_id=tokenizer.pad_token_id, ignore_index=ignore_label_index)
+# The sampler's order depends only on (seed, epoch), so a resumed run can skip
+# exactly the batches it already trained on
+sampler = ResumableSampler(len(dataset))
+loader_generator = torch.Generator()
+loader_generator.manual_seed(0)
+# Batches are all tensors, so workers can hand them over in pinned memory for async copies
+dataloader = DataLoader(dataset, batch_size=batch_size, collate_fn=collate_fn, num_workers=num_workers, sampler=sampler, generator=loader_generator, drop_last=False, pin_memory=device.type == "cuda")
 
 
 # Print the first 5 batches from the DataLoader
@@ -167,121 +132,6 @@ for i, batch in enumerate(dataloader):
 # Check the length of the DataLoader
 print(f"Number of batches in DataLoader: {len(dataloader)}")
 
-class DistilBertForNERAndRE(DistilBertPreTrainedModel):
-    def __init__(self, config, num_ner_labels, num_re_labels):
-        super().__init__(config)
-
-        self.num_ner_labels = num_ner_labels
-        self.num_re_labels = num_re_labels
-
-        self.distilbert = DistilBertModel(config)
-        self.dropout = nn.Dropout(config.dropout)
-        
-        self.ner_classifier = nn.Linear(config.hidden_size, self.num_ner_labels)
-
-        self.subject_start_classifier = nn.Linear(config.hidden_size, 1)
-        self.subject_end_classifier = nn.Linear(config.hidden_size, 1)
-        self.object_start_classifier = nn.Linear(config.hidden_size, 1)
-        self.object_end_classifier = nn.Linear(config.hidden_size, 1)
-
-        self.re_classifier = nn.Bilinear(config.hidden_size, config.hidden_size, self.num_re_labels)
-
-        self.init_weights()
-
-    def forward(
-        self,
-        input_ids=None,
-        attention_mask=None,
-        head_mask=None,
-        inputs_embeds=None,
-        ner_labels=None,
-        re_labels=None,
-        re_data=None,  # Add re_data as an optional argument
-    ):
-        outputs = self.distilbert(
-            input_ids,
-            attention_mask=attention_mask,
-            head_mask=head_mask,
-            inputs_embeds=inputs_embeds,
-        )
-
-        sequence_output = outputs[0]
-        sequence_output = self.dropout(sequence_output)
-        ner_logits = self.ner_classifier(sequence_output)
-
-        if re_data is None:  # If re_data is not provided, predict subject and object indices
-            subject_start_logits = self.subject_start_classifier(sequence_output).squeeze(-1)
-            subject_end_logits = self.subject_end_classifier(sequence_output).squeeze(-1)
-            object_start_logits = self.object_start_classifier(sequence_output).squeeze(-1)
-            object_end_logits = self.object_end_classifier(sequence_output).squeeze(-1)
-
-            subject_start_idx = torch.argmax(subject_start_logits, dim=-1)
-            subject_end_idx = torch.argmax(subject_end_logits, dim=-1)
-            object_start_idx = torch.argmax(object_start_logits, dim=-1)
-            object_end_idx = torch.argmax(object_end_logits, dim=-1)
-        else:  # If re_data is provided, use the provided subject and object indices
-            subject_start_idx = re_data["subject_start_idx"]
-            subject_end_idx = re_data["subject_end_idx"]
-            object_start_idx = re_data["object_start_idx"]
-            object_end_idx = re_data["object_end_idx"]
-
-        subject_hidden_states = sequence_output[range(sequence_output.size(0)), subject_start_idx]
-        object_hidden_states = sequence_output[range(sequence_output.size(0)), object_start_idx]
-        re_logits = self.re_classifier(subject_hidden_states, object_hidden_states)
-
-        if ner_labels is not None:
-            
-            loss_fct = nn.CrossEntropyLoss(ignore_index=dataset.ignore_label_index)
-            #print("Attention mask shape:", attention_mask.shape)
-            #print("NER logits shape:", ner_logits.shape)
-            #print("NER labels shape:", ner_labels.shape)
-            active_loss = attention_mask.view(-1).bool()
-            active_logits = ner_logits.view(-1, self.num_ner_labels)[active_loss]
-            active_labels = ner_labels.view(-1)[active_loss]
-
-            # Check if there are any active logits and labels before calculating the loss
-            if active_logits.shape[0] > 0 and active_labels.shape[0] > 0:
-                ner_loss = loss_fct(active_logits, active_labels)
-            else:
-                ner_loss = None
-        else:
-            ner_loss = None
-
-        if re_data is not None and len(re_data) > 0:
-            re_logits = []
-            for b, batch_re_data in enumerate(re_data):
-                batch_re_logits = []
-                for rel in batch_re_data:
-                    subject_start_idx = rel["subject_start_idx"]
-                    subject_end_idx = rel["subject_end_idx"]
-                    object_start_idx = rel["object_start_idx"]
-                    object_end_idx = rel["object_end_idx"]
-
-                    # Use the average of the hidden states for the subject and object tokens
-                    subject_hidden_states = sequence_output[b, subject_start_idx:subject_end_idx+1].mean(dim=0)
-                    object_hidden_states = sequence_output[b, object_start_idx:object_end_idx+1].mean(dim=0)
-
-                    relation_logits = self.re_classifier(subject_hidden_states, object_hidden_states)
-                    batch_re_logits.append(relation_logits.unsqueeze(0))
-
-                batch_re_logits = torch.cat(batch_re_logits, dim=0)
-                re_logits.append(batch_re_logits.unsqueeze(0))
-
-            re_logits = torch.cat(re_logits, dim=0)
-        else:
-            re_logits = None
-
-
-        return {
-            'ner_logits': ner_logits,
-            'subject_start_logits': subject_start_logits if re_data is None else None,
-            'subject_end_logits': subject_end_logits if re_data is None else None,
-            'object_start_logits': object_start_logits if re_data is None else None,
-            'object_end_logits': object_end_logits if re_data is None else None,
-            're_logits': re_logits,
-            'ner_loss': ner_loss,
-        }
-
 # Set up the configuration, model, and tokenizer
 config = DistilBertConfig.from_pretrained("distilbert-base-uncased")
 tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased")
@@ -289,9 +139,24 @@ tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased")
 # Initialize the model with the given configuration
 num_ner_labels = len(label_to_id)
 num_re_labels = len(relation_to_id)
-model = DistilBertForNERAndRE(config, num_ner_labels, num_re_labels)
+model = DistilBertForNERAndRE(config, num_ner_labels, num_re_labels, ner_ignore_index=ignore_label_index)
+if args.activation_checkpointing:
+    model.set_activation_checkpointing(args.activation_checkpointing)
 model = model.to(device)
 
+evaluator = None
+if len(dev_examples):
+    evaluator = Evaluator(
+        dev_examples,
+        {v: k for k, v in label_to_id.items()},
+        batch_size=args.eval_batch_size,
+        device=device,
+        pad_id=tokenizer.pad_token_id,
+        ignore_index=ignore_label_index,
+        re_negative=relation_to_id.get("no_relation"),
+    )
+    print(f"Evaluating on {len(evaluator)} held-out sentences")
+
 # Mixed precision training
 #scaler = torch.cuda.amp.GradScaler()
 
@@ -312,78 +177,151 @@ if device.type == "cuda":
 else:
     scaler = None
 
-for epoch in range(num_epochs):
-    progress_bar = tqdm(dataloader, desc=f"Epoch {epoch + 1}/{num_epochs}")
-
-    for step, batch in enumerate(progress_bar):
-        
+checkpoints = CheckpointManager(args.checkpoint_dir, args.checkpoint_every_steps, args.checkpoint_every_minutes, args.keep_checkpoints)
+start_epoch, start_step, global_step = 0, 0, 0
+if args.resume:
+    state = checkpoints.load()
+    if state is not None:
+        counters = restore_training_state(state, model, optimizer, scheduler, scaler, sampler)
+        start_epoch, start_step, global_step = counters["epoch"], counters["step"], counters["global_step"]
+        accumulation_counter = counters["accumulation_counter"]
+
+timer, profiler = profiling.from_args(args)
+memory_tracker = MemoryTracker(model, enabled=args.memory_report is not None)
+memory_budget = None
+if args.memory_budget_mb:
+    # The forward pass runs without autocast, so activations are fp32 on CUDA too
+    memory_budget = MemoryBudget(args.memory_budget_mb, config, num_ner_labels, num_re_labels, training=True, dtype_bytes=4, report_only=args.memory_report_only)
+
+for epoch in range(start_epoch, num_epochs):
+    # When resuming mid-epoch, skip the batches that were already trained on
+    first_step = start_step if epoch == start_epoch else 0
+    sampler.set_epoch(epoch, first_step * batch_size)
+    progress_bar = tqdm(dataloader, desc=f"Epoch {epoch + 1}/{num_epochs}", initial=first_step, total=first_step + len(dataloader))
+    epoch_start = time.perf_counter()
+    eval_seconds = 0.0
+
+    for step, batch in enumerate(progress_bar, start=first_step):
+        timer.data_ready()
+        profiler.step(global_step)
         try:
             #print("rel_data structure:", batch["re_data"])
             model.train()
 
-            input_ids = batch['input_ids'].to(device)
-            attention_mask = batch['attention_mask'].to(device)
-            ner_labels = batch['ner_labels'].to(device)
-            re_labels = batch['re_labels'].to(device)
-            re_data = batch['re_data']
-
-            outputs = model(
-                input_ids=input_ids,
-                attention_mask=attention_mask,
-                ner_labels=ner_labels,
-                re_labels=re_labels if len(re_data) > 0 else None,  # Add this condition
-                re_data=re_data,
-            )
-
-            # Get NER and RE logits from model output
-            ner_logits = outputs["ner_logits"]
-            re_logits = outputs["re_logits"]
-
-            # Calculate NER loss
-            ner_loss = outputs["ner_loss"]
-
-            # Calculate RE loss
-            re_loss = 0
-            if re_logits is not None:  # Add this condition
-                for b, batch_re_labels in enumerate(re_labels):
-                    re_loss += re_loss_fn(re_logits[b].view(-1, re_logits.size(-1)), batch_re_labels.view(-1))
-
-                # Normalize RE loss by the number of samples
-                re_loss /= re_logits.size(0)
-
-            # Combine NER and RE losses using a weighted sum
-            loss_weight = 0.5  # Adjust this value based on the importance of each task
-            total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
+            # Over-budget batches run as micro-batches whose gradients add up to the full batch's
+            if memory_budget is not None:
+                num_pairs = batch['re_spans'].size(1)
+                pieces = memory_budget.split(batch, num_pairs=num_pairs)
+                # The measured peak recalibrates the estimate for the next batches
+                measure = memory_budget.measure(*pieces[0]['input_ids'].shape[:2], num_pairs=num_pairs, device=device, tracker=memory_tracker)
+            else:
+                pieces = [batch]
+                measure = nullcontext()
+
+            with memory_tracker.step(global_step), measure:
+                for piece in pieces:
+                    weight = piece['input_ids'].size(0) / batch['input_ids'].size(0)
+                    with timer.section("h2d"):
+                        input_ids = piece['input_ids'].to(device, non_blocking=True)
+                        attention_mask = piece['attention_mask'].to(device, non_blocking=True)
+                        ner_labels = piece['ner_labels'].to(device, non_blocking=True)
+                        re_labels = piece['re_labels'].to(device, non_blocking=True)
+                        re_spans = piece['re_spans'].to(device, non_blocking=True)
+                        position_ids = piece['position_ids'].to(device, non_blocking=True) if 'position_ids' in piece else None
+                        # Relations cut off by a shortened sequence cannot be scored
+                        re_labels = re_labels.masked_fill((re_spans >= input_ids.size(1)).any(dim=-1), -1)
+
+                    with timer.section("forward"):
+                        outputs = model(
+                            input_ids=input_ids,
+                            attention_mask=attention_mask,
+                            ner_labels=ner_labels,
+                            re_labels=re_labels,
+                            re_spans=re_spans,
+                            position_ids=position_ids,
+                        )
+
+                    with timer.section("loss"):
+                        # Get NER and RE logits from model output
+                        ner_logits = outputs["ner_logits"]
+                        re_logits = outputs["re_logits"]
+
+                        # Calculate NER loss
+                        ner_loss = outputs["ner_loss"]
+
+                        # Calculate RE loss over every real relation of the batch at once
+                        if (re_labels != -1).any():
+                            re_loss = re_loss_fn(re_logits.reshape(-1, re_logits.size(-1)), re_labels.reshape(-1))
+                        else:
+                            re_loss = re_logits.sum() * 0.0
+
+                        # Combine NER and RE losses using a weighted sum
+                        loss_weight = 0.5  # Adjust this value based on the importance of each task
+                        total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
+
+                    with timer.section("backward"):
+                        if scaler is not None:
+                            scaler.scale(total_loss * weight).backward()
+                        else:
+                            (total_loss * weight).backward()
+
+            if memory_tracker.enabled and global_step % 100 == 0:
+                tqdm.write(memory_tracker.format())
 
             # Update counter
             accumulation_counter += 1
 
             # Perform optimization step and zero gradients if counter has reached accumulation steps
             if accumulation_counter % accumulation_steps == 0:
-                if scaler is not None:
-                    scaler.step(optimizer)
-                    scaler.update()
-                else:
-                    optimizer.step()
-                scheduler.step()
-                optimizer.zero_grad()
+                with timer.section("optimizer"):
+                    if scaler is not None:
+                        scaler.step(optimizer)
+                        scaler.update()
+                    else:
+                        optimizer.step()
+                    scheduler.step()
+                    optimizer.zero_grad()
 
             # Update progress bar
-            progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item()})
+            progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item(), **timer.postfix()})
 
         except Exception as e:
             print(f"Error: {e}")
-            #print("Current re_data:", batch["re_data"])
-            for i, re_item in enumerate(batch["re_data"]):
-                print(f"Types of elements in re_item {i}:", {key: type(value) for key, value in re_item.items()})
+            print("Batch shapes:", {key: tuple(value.shape) for key, value in batch.items()})
             print("Skipping batch due to error.")
             continue
 
-
-# Save the fine-tuned custom BERT model and tokenizer
-output_dir = "models/combined"
+        finally:
+            if evaluator is not None and args.eval_steps and (global_step + 1) % args.eval_steps == 0:
+                metrics = evaluator.evaluate(model)
+                eval_seconds += metrics["seconds"]
+                tqdm.write(f"Step {global_step + 1}: {format_metrics(metrics)}")
+            timer.end_step()
+            global_step += 1
+            if checkpoints.should_save(global_step):
+                checkpoints.save(global_step, training_state(
+                    model, optimizer, scheduler, scaler, sampler,
+                    epoch=epoch, step=step + 1, global_step=global_step, accumulation_counter=accumulation_counter,
+                ))
+
+    if evaluator is not None:
+        metrics = evaluator.evaluate(model)
+        eval_seconds += metrics["seconds"]
+        print(f"Epoch {epoch + 1}: {format_metrics(metrics)}")
+        print(f"Evaluation took {eval_seconds / (time.perf_counter() - epoch_start):.1%} of the epoch")
+
+profiler.stop()
+checkpoints.wait()
+if args.step_timings:
+    timer.export(args.step_timings)
+if args.memory_report:
+    memory_tracker.export(args.memory_report)
+
+
+# Save the fine-tuned custom DistilBERT model and tokenizer
+output_dir = args.output_dir
 os.makedirs(output_dir, exist_ok=True)
-model.save_pretrained(output_dir)
+model.save_pretrained(output_dir, safe_serialization=True)
 tokenizer.save_pretrained(output_dir)
 
 # Save the label_to_id and relation_to_id mappings
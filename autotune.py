@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import pickle
+import argparse
+import resource
+import multiprocessing
+
+# Throughput autotuning. `python autotune.py` runs short measured trials over
+# DataLoader workers, intra-/inter-op threads, tokenizer parallelism and batch
+# size, keeps the fastest configuration that fits the memory budget and writes it
+# to a profile. The training and inference entry points call `apply_profile` at
+# start-up, which falls back to their hard-coded defaults when no profile exists
+# or it was tuned on a different machine. Training is tuned per architecture
+# ("train.bert" for BERT_train.py, "train.distilbert" for DistiliBERT_train.py),
+# since a BERT step costs about twice a DistilBERT one.
+
+profile_path = os.environ.get("RE_BERT_TUNING_PROFILE", "tuning_profile.json")
+
+
+def machine_fingerprint():
+    fingerprint = {"cpu_count": os.cpu_count()}
+    if hasattr(os, "sched_getaffinity"):
+        fingerprint["usable_cpus"] = len(os.sched_getaffinity(0))
+    try:
+        import torch
+        if torch.cuda.is_available():
+            fingerprint["cuda_device"] = torch.cuda.get_device_name(0)
+    except ImportError:
+        pass
+    return fingerprint
+
+
+def load_profile(section, defaults, path=None):
+    """Return `defaults` overridden by the tuned values of `section`, if any."""
+    path = path or profile_path
+    settings = dict(defaults)
+    if not os.path.exists(path):
+        return settings
+
+    with open(path, "r") as f:
+        profile = json.load(f)
+    if profile.get("machine") != machine_fingerprint():
+        print(f"Ignoring tuning profile {path}: it was tuned on a different machine")
+        return settings
+
+    settings.update({k: v for k, v in profile.get(section, {}).items() if k in defaults})
+    return settings
+
+
+def apply_profile(section, defaults, path=None):
+    """Load the profile and apply its process-wide settings (threads, tokenizer parallelism)."""
+    import torch
+
+    settings = load_profile(section, defaults, path)
+    if settings.get("tokenizers_parallelism") is not None:
+        os.environ["TOKENIZERS_PARALLELISM"] = "true" if settings["tokenizers_parallelism"] else "false"
+    if settings.get("intra_op_threads"):
+        torch.set_num_threads(settings["intra_op_threads"])
+    if settings.get("inter_op_threads"):
+        try:
+            torch.set_num_interop_threads(settings["inter_op_threads"])
+        except RuntimeError:
+            # Can only be set before the first parallel region
+            pass
+    return settings
+
+
+def _load_texts(data_path, limit):
+    if data_path and os.path.exists(data_path):
+        with open(data_path, "rb") as f:
+            records = pickle.load(f)
+        texts = [" ".join(t for t in record["sentence_tokens"] if t not in ("[CLS]", "[SEP]", "[PAD]")) for record in records[:limit]]
+        if texts:
+            return texts
+    # Synthetic sentences of typical biomedical length
+    base = "Heme oxygenase-1 (HO-1) is a stress-inducible enzyme with diverse cytoprotective effects in infarcted myocardium"
+    return [f"{base} sample {i}." for i in range(limit)]
+
+
+def _build_workload(model_name, num_labels, num_relations):
+    from transformers import AutoConfig, AutoTokenizer
+    from models import BertForNERAndRE, DistilBertForNERAndRE
+    from inference import tiny_tokenizer, tiny_bert_config
+
+    if model_name == "tiny":
+        tokenizer = tiny_tokenizer()
+        config = tiny_bert_config(len(tokenizer))
+        return tokenizer, BertForNERAndRE(config, num_labels, num_relations)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    config = AutoConfig.from_pretrained(model_name)
+    if config.model_type == "distilbert":
+        return tokenizer, DistilBertForNERAndRE(config, num_labels, num_relations)
+    return tokenizer, BertForNERAndRE(config, num_labels, num_relations)
+
+
+def profile_section(mode, model_name):
+    """The profile section a mode's tuned settings go to; training is keyed by model type."""
+    if mode != "train":
+        return mode
+    if model_name == "tiny":
+        return "train.bert"
+    from transformers import AutoConfig
+    return f"train.{AutoConfig.from_pretrained(model_name).model_type}"
+
+
+class _TextDataset:
+    # Tokenizes per item like the training datasets do, so worker count matters
+    def __init__(self, texts, tokenizer, max_length):
+        self.texts = texts
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+
+    def __len__(self):
+        return len(self.texts)
+
+    def __getitem__(self, idx):
+        inputs = self.tokenizer(self.texts[idx], padding="max_length", truncation=True, max_length=self.max_length, return_tensors="pt")
+        return inputs["input_ids"].squeeze(0), inputs["attention_mask"].squeeze(0)
+
+
+def _run_trial(trial, workload, result_queue):
+    # Runs in a fresh process: thread counts and TOKENIZERS_PARALLELISM only take
+    # effect before torch/tokenizers start their pools
+    os.environ["TOKENIZERS_PARALLELISM"] = "true" if trial["tokenizers_parallelism"] else "false"
+    import torch
+    from torch.utils.data import DataLoader
+
+    torch.set_num_threads(trial["intra_op_threads"])
+    torch.set_num_interop_threads(trial["inter_op_threads"])
+    torch.manual_seed(0)
+
+    try:
+        tokenizer, model = _build_workload(workload["model"], 8, 4)
+        device = torch.device(workload["device"])
+        model.to(device)
+        texts = _load_texts(workload["data"], workload["num_samples"])
+        dataset = _TextDataset(texts, tokenizer, workload["max_length"])
+        loader = DataLoader(
+            dataset,
+            batch_size=trial["batch_size"],
+            num_workers=trial["num_workers"],
+            shuffle=False,
+            drop_last=True,
+            persistent_workers=False,
+        )
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5) if workload["mode"] == "train" else None
+        if optimizer is None:
+            model.eval()
+        else:
+            model.train()
+
+        samples = 0
+        start = None
+        for step, (input_ids, attention_mask) in enumerate(loader):
+            if step == workload["warmup_steps"]:
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+                samples = 0
+            if step >= workload["warmup_steps"] + workload["steps"]:
+                break
+
+            input_ids = input_ids.to(device)
+            attention_mask = attention_mask.to(device)
+            if optimizer is None:
+                with torch.inference_mode():
+                    model(input_ids=input_ids, attention_mask=attention_mask)
+            else:
+                outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+                outputs["ner_logits"].float().mean().backward()
+                optimizer.step()
+                optimizer.zero_grad()
+            samples += input_ids.size(0)
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start if start is not None else float("inf")
+
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if device.type == "cuda":
+            peak_mb = max(peak_mb, torch.cuda.max_memory_allocated() / 2 ** 20)
+        result_queue.put({"samples_per_second": samples / elapsed, "peak_mb": peak_mb})
+    except Exception as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure(trial, workload, timeout=600):
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_run_trial, args=(trial, workload, result_queue))
+    process.start()
+    try:
+        result = result_queue.get(timeout=timeout)
+    except Exception:
+        result = {"error": "timed out"}
+    process.join(timeout=10)
+    if process.is_alive():
+        process.kill()
+    return result
+
+
+def candidate_values(cpus):
+    threads = sorted({1, 2, 4, max(1, cpus // 2), cpus} & set(range(1, cpus + 1)))
+    workers = sorted({0, 1, 2, 4, max(1, cpus // 2)} & set(range(0, cpus + 1)))
+    return {
+        "intra_op_threads": threads,
+        "inter_op_threads": sorted({1, 2} & set(range(1, cpus + 1))),
+        "num_workers": workers,
+        "tokenizers_parallelism": [False, True],
+        "batch_size": [4, 8, 16, 32, 64],
+    }
+
+
+def tune(workload, memory_budget_mb=None, cpus=None):
+    """Coordinate search: tune one setting at a time, keeping the best of the others."""
+    cpus = cpus or (len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count())
+    candidates = candidate_values(cpus)
+    best = {
+        "intra_op_threads": cpus,
+        "inter_op_threads": 1,
+        "num_workers": 0,
+        "tokenizers_parallelism": False,
+        "batch_size": 8,
+    }
+    cache = {}
+
+    def score(trial):
+        key = tuple(sorted(trial.items()))
+        if key not in cache:
+            result = measure(trial, workload)
+            if "error" not in result and memory_budget_mb and result["peak_mb"] > memory_budget_mb:
+                result = {"error": f"peak {result['peak_mb']:.0f} MB over budget"}
+            cache[key] = result
+            status = result.get("error") or f"{result['samples_per_second']:.1f} samples/s, peak {result['peak_mb']:.0f} MB"
+            print(f"  {trial} -> {status}")
+        return cache[key].get("samples_per_second", 0.0)
+
+    best_score = score(best)
+    for name in ("intra_op_threads", "batch_size", "num_workers", "inter_op_threads", "tokenizers_parallelism"):
+        print(f"Tuning {name}")
+        for value in candidates[name]:
+            trial = dict(best, **{name: value})
+            trial_score = score(trial)
+            if trial_score > best_score:
+                best, best_score = trial, trial_score
+
+    return best, best_score
+
+
+def save_profile(section, settings, samples_per_second, path=None):
+    path = path or profile_path
+    profile = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            profile = json.load(f)
+    if profile.get("machine") != machine_fingerprint():
+        profile = {}
+    profile["machine"] = machine_fingerprint()
+    profile[section] = dict(settings, samples_per_second=round(samples_per_second, 2))
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune DataLoader workers, threads and batch size for this machine")
+    parser.add_argument("--mode", choices=["train", "inference", "both"], default="both")
+    parser.add_argument("--model", default="distilbert-base-uncased", help="Model name or path, or \"tiny\"")
+    parser.add_argument("--data", default="preprocessed_re_data.pkl", help="Preprocessed RE data to sample sentences from")
+    parser.add_argument("--max-length", type=int, default=128)
+    parser.add_argument("--steps", type=int, default=10, help="Measured steps per trial")
+    parser.add_argument("--warmup-steps", type=int, default=2)
+    parser.add_argument("--memory-budget-mb", type=float, default=None)
+    parser.add_argument("--device", default="cuda" if os.environ.get("CUDA_VISIBLE_DEVICES") else "cpu")
+    parser.add_argument("--output", default=profile_path)
+    args = parser.parse_args()
+
+    modes = ["train", "inference"] if args.mode == "both" else [args.mode]
+    for mode in modes:
+        workload = {
+            "mode": mode,
+            "model": args.model,
+            "data": args.data,
+            "max_length": args.max_length,
+            "steps": args.steps,
+            "warmup_steps": args.warmup_steps,
+            "num_samples": 64 * (args.steps + args.warmup_steps),
+            "device": args.device,
+        }
+        print(f"Autotuning {mode}")
+        best, samples_per_second = tune(workload, args.memory_budget_mb)
+        section = profile_section(mode, args.model)
+        save_profile(section, best, samples_per_second, args.output)
+        print(f"Best {mode} configuration: {best} ({samples_per_second:.1f} samples/s), saved to {args.output} as {section}")
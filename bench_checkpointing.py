@@ -0,0 +1,158 @@
+import os
+import time
+import argparse
+import resource
+import multiprocessing
+from memory import rss_mb
+
+# Memory / throughput benchmark for activation checkpointing. Each (stride,
+# batch size) trial trains a randomly initialized model for a few steps in a
+# fresh process, so peak RSS is not inherited from earlier trials, and reports
+# the activation bytes autograd keeps for backward, the step memory above the
+# weights + optimizer state, and the samples/s. On CPU the allocator keeps freed
+# pages, so RSS understates the savings the saved-activation column shows.
+#
+#   python bench_checkpointing.py --model bert --max-length 512 --batch-sizes 4 8 16 --strides 0 1 2
+
+
+def _build_model(model_name, num_labels, num_relations):
+    from transformers import BertConfig, DistilBertConfig
+    from models import BertForNERAndRE, DistilBertForNERAndRE
+    from inference import tiny_bert_config
+
+    if model_name == "tiny":
+        return BertForNERAndRE(tiny_bert_config(128, 512), num_labels, num_relations)
+    if model_name == "small":
+        # Deep enough for checkpointing to matter, fast enough for a laptop CPU
+        config = BertConfig(vocab_size=1000, hidden_size=256, num_hidden_layers=6, num_attention_heads=4, intermediate_size=1024)
+        return BertForNERAndRE(config, num_labels, num_relations)
+    if model_name == "distilbert":
+        return DistilBertForNERAndRE(DistilBertConfig(), num_labels, num_relations)
+    # bert-base-uncased's architecture; the weights do not matter for timing
+    return BertForNERAndRE(BertConfig(), num_labels, num_relations)
+
+
+def _run_trial(trial, result_queue):
+    import torch
+
+    try:
+        torch.manual_seed(0)
+        device = torch.device(trial["device"])
+        model = _build_model(trial["model"], 9, 4).to(device)
+        model.set_activation_checkpointing(trial["stride"])
+        model.train()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+
+        # Create the optimizer state up front so the baseline includes it
+        for p in model.parameters():
+            p.grad = torch.zeros_like(p)
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+
+        vocab_size = model.config.vocab_size
+        shape = (trial["batch_size"], trial["max_length"])
+        input_ids = torch.randint(0, vocab_size, shape, device=device)
+        attention_mask = torch.ones(shape, dtype=torch.long, device=device)
+        ner_labels = torch.randint(0, 9, shape, device=device)
+
+        baseline_mb = rss_mb()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+            baseline_mb = torch.cuda.memory_allocated() / 2 ** 20
+
+        # Count each storage autograd saves for backward once
+        saved = {}
+
+        def pack(tensor):
+            storage = tensor.untyped_storage()
+            saved[storage.data_ptr()] = storage.nbytes()
+            return tensor
+
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask, ner_labels=ner_labels)
+        # Parameters are saved too but are not activations
+        parameter_ptrs = {p.untyped_storage().data_ptr() for p in model.parameters()}
+        saved_mb = sum(size for ptr, size in saved.items() if ptr not in parameter_ptrs) / 2 ** 20
+        outputs["ner_loss"].backward()
+        optimizer.zero_grad(set_to_none=True)
+
+        start = None
+        for step in range(trial["warmup_steps"] + trial["steps"]):
+            if step == trial["warmup_steps"]:
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask, ner_labels=ner_labels)
+            outputs["ner_loss"].backward()
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+            peak_mb = torch.cuda.max_memory_allocated() / 2 ** 20
+        else:
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        elapsed = time.perf_counter() - start
+        result_queue.put({
+            "samples_per_second": trial["steps"] * trial["batch_size"] / elapsed,
+            "peak_mb": peak_mb,
+            "step_mb": peak_mb - baseline_mb,
+            "saved_mb": saved_mb,
+        })
+    except Exception as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+
+
+def measure(trial, timeout=1800):
+    ctx = multiprocessing.get_context("spawn")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=_run_trial, args=(trial, result_queue))
+    process.start()
+    try:
+        result = result_queue.get(timeout=timeout)
+    except Exception:
+        result = {"error": "timed out"}
+    process.join(timeout=10)
+    if process.is_alive():
+        process.kill()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark activation checkpointing strides")
+    parser.add_argument("--model", choices=["bert", "distilbert", "small", "tiny"], default="bert")
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[2, 4, 8, 16])
+    parser.add_argument("--strides", type=int, nargs="+", default=[0, 1, 2, 4], help="0 is no checkpointing")
+    parser.add_argument("--steps", type=int, default=3)
+    parser.add_argument("--warmup-steps", type=int, default=1)
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="Also report the largest batch per stride that fits")
+    parser.add_argument("--device", default="cuda" if os.environ.get("CUDA_VISIBLE_DEVICES") else "cpu")
+    args = parser.parse_args()
+
+    print(f"{args.model}, {args.max_length} tokens, {args.device}")
+    print(f"{'stride':>6s} {'batch':>6s} {'saved MB':>10s} {'step MB':>10s} {'peak MB':>10s} {'samples/s':>10s}")
+    largest_batch = {}
+    for stride in args.strides:
+        for batch_size in args.batch_sizes:
+            result = measure({
+                "model": args.model,
+                "stride": stride,
+                "batch_size": batch_size,
+                "max_length": args.max_length,
+                "steps": args.steps,
+                "warmup_steps": args.warmup_steps,
+                "device": args.device,
+            })
+            if "error" in result:
+                print(f"{stride:6d} {batch_size:6d}  {result['error']}")
+                continue
+            print(f"{stride:6d} {batch_size:6d} {result['saved_mb']:10.0f} {result['step_mb']:10.0f} {result['peak_mb']:10.0f} {result['samples_per_second']:10.2f}")
+            if args.memory_budget_mb is None or result["peak_mb"] <= args.memory_budget_mb:
+                largest_batch[stride] = max(largest_batch.get(stride, 0), batch_size)
+
+    if args.memory_budget_mb is not None and 0 in largest_batch:
+        print(f"Largest batch within {args.memory_budget_mb:.0f} MB:")
+        for stride, batch_size in sorted(largest_batch.items()):
+            print(f"  stride {stride}: {batch_size} ({batch_size / largest_batch[0]:.1f}x no checkpointing)")
@@ -0,0 +1,311 @@
+import itertools
+import torch
+from torch.utils.data import Dataset
+from torch.nn.utils.rnn import pad_sequence
+from windowing import window_spans, build_windows
+from schema import iter_documents
+from evaluate import split_dataset
+
+# Document preprocessing for BertForNERAndRE, shared by BERT_train.py and the
+# scripts that score its checkpoints (prune.py). A schema.Document becomes an
+# item whose ner_data holds the characters outside entities and the word pieces
+# of every entity, each with its B-/I- label; NERRE_Dataset encodes those into
+# token ids and cuts them into overlapping max_length windows.
+
+
+def ner_label(prefix, entity_type, entity_name, label_scheme="entity"):
+    if label_scheme == "type":
+        return f"{prefix}-{entity_type}"
+    return f"{prefix}-{entity_type}-{entity_name}"
+
+
+# Existing preprocessing functions
+def preprocess_data(document, tokenizer, label_to_id, relation_to_id, label_scheme="entity"):
+    # document is a schema.Document
+    ner_data = []
+    re_data = []
+    re_indices = []
+    entity_start_idx = {}
+
+    # Entities without a span cannot be labelled in the text
+    spanned = [entity for entity in document.entities if entity.has_span]
+    entities_dict = {entity.entity_id: entity for entity in spanned}
+    entity_ids = set(entities_dict.keys())
+
+    relation_dict = {}
+    for relation in document.relations:
+        if relation.subject_id not in relation_dict:
+            relation_dict[relation.subject_id] = {}
+        relation_dict[relation.subject_id][relation.object_id] = relation.rel_name
+
+    text = document.text
+    current_idx = 0
+    for entity in sorted(spanned, key=lambda x: x.begin):
+        begin, end = entity.begin, entity.end
+        entity_type = entity.entity_type
+        entity_id = entity.entity_id
+        entity_name = entity.entity_name
+
+        entity_text = text[begin:end].strip()
+        entity_tokens = tokenizer.tokenize(entity_text)
+
+        while current_idx < begin:
+            ner_data.append((text[current_idx], "O", len(ner_data)))
+            current_idx += 1
+
+        if entity_tokens:
+            entity_start_idx[entity_id] = len(ner_data)
+
+        for i, token in enumerate(entity_tokens):
+            if i == 0:
+                label = ner_label("B", entity_type, entity_name, label_scheme)
+            else:
+                label = ner_label("I", entity_type, entity_name, label_scheme)
+
+            if label not in label_to_id:
+                label_to_id[label] = len(label_to_id)
+
+            ner_data.append((token, label, len(ner_data)))
+            current_idx += len(token)
+
+        current_idx = end
+
+        if label_scheme == "entity" and f"{entity_type}-{entity_name}" not in label_to_id:
+            label_to_id[f"{entity_type}-{entity_name}"] = len(label_to_id)
+
+    for entity_id_1, entity_id_2 in itertools.combinations(entity_ids, 2):
+        if entity_id_1 not in entity_start_idx or entity_id_2 not in entity_start_idx:
+            continue
+        if entity_id_1 in relation_dict and entity_id_2 in relation_dict[entity_id_1]:
+            rel_name = relation_dict[entity_id_1][entity_id_2]
+            entity_1 = entities_dict[entity_id_1]
+            entity_2 = entities_dict[entity_id_2]
+            re_data.append({
+                'id': (entity_id_1, entity_id_2),
+                'subject': text[entity_1.begin:entity_1.end],
+                'object': text[entity_2.begin:entity_2.end],
+                'relation': rel_name,
+                'subject_tokens': tokenizer.tokenize(text[entity_1.begin:entity_1.end]),
+                'object_tokens': tokenizer.tokenize(text[entity_2.begin:entity_2.end])
+            })
+
+            if rel_name not in relation_to_id:
+                relation_to_id[rel_name] = len(relation_to_id)
+
+            # Under the type scheme many entities share a label, so point at each entity's own first token
+            re_indices.append((entity_start_idx[entity_id_1], entity_start_idx[entity_id_2]))
+
+    while current_idx < len(text):
+        ner_data.append((text[current_idx], "O", len(ner_data)))
+        current_idx += 1
+
+    if "O" not in label_to_id:
+        label_to_id["O"] = len(label_to_id)
+
+    re_labels = [relation_to_id[relation['relation']] for relation in re_data]
+
+    preprocessed_data = [{
+        'ner_data': ner_data,
+        're_data': re_data,
+        're_indices': re_indices,
+        're_labels': re_labels
+    }] if len(re_data) > 0 else []
+
+    return preprocessed_data
+
+
+class NERRE_Dataset(Dataset):
+    def __init__(self, data, tokenizer, max_length, label_to_id, relation_to_id, stride=None):
+        self.data = data
+        self.tokenizer = tokenizer
+        self.max_length = max_length
+        self.stride = stride if stride is not None else max_length // 2
+        self.label_to_id = label_to_id
+        self.relation_to_id = relation_to_id
+
+        # Split every document into overlapping windows of max_length tokens instead
+        # of truncating, so labels and relations past the first window are kept
+        self.documents = []
+        self.windows = []
+        for doc_idx, item in enumerate(self.data):
+            document = self.encode_document(item)
+            self.documents.append(document)
+            for start, end in window_spans(len(document['input_ids']), self.max_length, self.stride):
+                self.windows.append((doc_idx, start, end))
+
+    def encode_document(self, item):
+        # ner_data mixes single characters and wordpieces. Encode the words in one
+        # call and look up "##" pieces directly, since tokenizing them as text would
+        # start a new word; label only the first piece of each entry so the labels
+        # line up with the ids
+        words = [token for token, _, _ in item['ner_data'] if not token.startswith("##")]
+        encoded = iter(self.tokenizer(words, add_special_tokens=False)['input_ids'] if words else [])
+
+        input_ids = []
+        ner_label_ids = []
+        positions = []
+        for token, label, _ in item['ner_data']:
+            if token.startswith("##"):
+                piece_ids = self.tokenizer.convert_tokens_to_ids([token])
+            else:
+                piece_ids = next(encoded)
+            positions.append(len(input_ids))
+            if not piece_ids:
+                # Whitespace encodes to nothing, so it gets no label either
+                continue
+            input_ids.extend(piece_ids)
+            ner_label_ids.extend([self.label_to_id[label]] + [-100] * (len(piece_ids) - 1))
+
+        # Relations point into ner_data; move them to token positions
+        re_indices = [(positions[s], positions[o]) for s, o in item['re_indices']]
+
+        return {
+            'input_ids': input_ids,
+            'ner_labels': ner_label_ids,
+            're_indices': re_indices,
+            're_labels': item['re_labels'],
+        }
+
+    def __len__(self):
+        return len(self.windows)
+
+    def __getitem__(self, idx):
+        doc_idx, start, end = self.windows[idx]
+        document = self.documents[doc_idx]
+
+        input_ids, attention_mask = build_windows(
+            document['input_ids'],
+            [(start, end)],
+            self.tokenizer.cls_token_id,
+            self.tokenizer.sep_token_id,
+            self.tokenizer.pad_token_id,
+            self.max_length,
+        )
+        input_ids = input_ids.squeeze(0)
+        attention_mask = attention_mask.squeeze(0)
+        token_type_ids = torch.zeros_like(input_ids)
+
+        # [CLS], [SEP] and padding are ignored by the loss
+        ner_label_ids = torch.full((self.max_length,), -100, dtype=torch.long)
+        ner_label_ids[1:end - start + 1] = torch.tensor(document['ner_labels'][start:end], dtype=torch.long)
+
+        # Keep the relations whose subject and object both fall inside this window
+        re_indices = []
+        re_labels = []
+        for (subject_idx, object_idx), re_label in zip(document['re_indices'], document['re_labels']):
+            if start <= subject_idx < end and start <= object_idx < end:
+                re_indices.append((subject_idx - start + 1, object_idx - start + 1))
+                re_labels.append(re_label)
+
+        return {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'token_type_ids': token_type_ids,
+            'ner_labels': ner_label_ids,
+            're_labels': torch.tensor(re_labels, dtype=torch.long),
+            're_indices': torch.tensor(re_indices, dtype=torch.long).view(-1, 2)
+        }
+
+def window_examples(dataset):
+    """The dataset's windows as evaluate.Evaluator examples, without their padding."""
+    examples = []
+    for idx in range(len(dataset)):
+        item = dataset[idx]
+        length = int(item['attention_mask'].sum())
+        relations = [
+            {"subject_start_idx": s, "subject_end_idx": s, "object_start_idx": o, "object_end_idx": o, "label": label}
+            for (s, o), label in zip(item['re_indices'].tolist(), item['re_labels'].tolist())
+        ]
+        examples.append({
+            "input_ids": item['input_ids'][:length].tolist(),
+            "ner_labels": item['ner_labels'][:length].tolist(),
+            "relations": relations,
+        })
+    return examples
+
+
+def pad_relation_indices(re_indices_list, max_relations, padding_value=-1):
+    # One preallocated [B, max_relations, 2] tensor, filled row by row
+    padded_re_indices = torch.full((len(re_indices_list), max_relations, 2), padding_value, dtype=torch.long)
+    for b, re_indices in enumerate(re_indices_list):
+        padded_re_indices[b, :len(re_indices)] = re_indices
+    return padded_re_indices
+
+
+def custom_collate_fn(batch):
+    # Remove None values from the batch
+    #batch = [item for item in batch if item is not None]
+
+    # Pad input_ids, attention_mask, and token_type_ids
+    input_ids = pad_sequence([item['input_ids'] for item in batch], batch_first=True)
+    attention_mask = pad_sequence([item['attention_mask'] for item in batch], batch_first=True)
+    token_type_ids = pad_sequence([item['token_type_ids'] for item in batch], batch_first=True)
+
+    # Pad ner_labels
+    ner_labels = pad_sequence([item['ner_labels'] for item in batch], batch_first=True, padding_value=-100)
+    
+    # Pad re_labels
+    re_labels = pad_sequence([item['re_labels'] for item in batch], batch_first=True, padding_value=-1)
+
+    # Pad re_indices
+    re_indices_list = [item['re_indices'] for item in batch if item['re_indices'] is not None]
+
+    if len(re_indices_list) > 0:
+        max_relations = max(len(re_indices) for re_indices in re_indices_list)
+        re_indices = pad_relation_indices(re_indices_list, max_relations)
+    else:
+        re_indices = None
+
+    # Return the final dictionary
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "token_type_ids": token_type_ids,
+        "ner_labels": ner_labels,
+        "re_labels": re_labels,
+        "re_indices": re_indices,
+    }
+
+
+def validate_json(document):
+    # Keys and types are checked by schema.decode_document; a document is only
+    # useful if it has entities and relations
+    if len(document.entities) == 0 or len(document.relations) == 0:
+        return False
+
+    # Additional validation criteria can be added here based on your data format
+
+    return True
+
+def label_maps_from_index(index, label_scheme="entity"):
+    """label_to_id / relation_to_id covering every entity and relation of a shards.py corpus."""
+    label_to_id = {}
+    for entity_type, entity_name in index["entities"]:
+        labels = [ner_label("B", entity_type, entity_name, label_scheme), ner_label("I", entity_type, entity_name, label_scheme)]
+        if label_scheme == "entity":
+            labels.append(f"{entity_type}-{entity_name}")
+        for label in labels:
+            label_to_id.setdefault(label, len(label_to_id))
+    label_to_id.setdefault("O", len(label_to_id))
+    relation_to_id = {rel_name: i for i, rel_name in enumerate(index["relations"])}
+    return label_to_id, relation_to_id
+
+
+def document_key(item):
+    """The key BERT_train.py splits dev documents on (shards.split_key rebuilds it from a document)."""
+    return "".join(token for token, _, _ in item['ner_data'])
+
+
+def dev_window_examples(json_directory, tokenizer, label_to_id, relation_to_id, label_scheme="entity", dev_fraction=0.1,
+                        max_length=128, stride=64):
+    """Evaluator examples for the windows of the documents BERT_train.py held out, in a checkpoint's label ids."""
+    known_labels, known_relations = dict(label_to_id), dict(relation_to_id)
+    items = []
+    for json_path, document in iter_documents(json_directory):
+        if validate_json(document):
+            items.extend(preprocess_data(document, tokenizer, known_labels, known_relations, label_scheme))
+    # preprocess_data adds the labels it has not seen, which the checkpoint has no logits for
+    if len(known_labels) != len(label_to_id) or len(known_relations) != len(relation_to_id):
+        raise ValueError(f"{json_directory} has labels or relations the checkpoint was not trained on")
+    _, dev_data = split_dataset(items, document_key, dev_fraction)
+    return window_examples(NERRE_Dataset(dev_data, tokenizer, max_length, label_to_id, relation_to_id, stride=stride))
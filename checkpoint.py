@@ -0,0 +1,181 @@
+import os
+import re
+import time
+import random
+import threading
+import torch
+from torch.utils.data import Sampler
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Step-based resumable checkpoints. The training loop snapshots its state to CPU
+# memory (cheap) and a background thread serializes it to disk (slow), so saving
+# does not stall training. Only the newest `keep` checkpoints are kept.
+
+
+class ResumableSampler(Sampler):
+    """Shuffles with a permutation derived from (seed, epoch) and can start mid-epoch."""
+
+    def __init__(self, num_samples, seed=0, shuffle=True):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.shuffle = shuffle
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(self.num_samples, generator=generator).tolist()
+        else:
+            order = list(range(self.num_samples))
+        return iter(order[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "start_index": self.start_index}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.set_epoch(state["epoch"], state["start_index"])
+
+
+def rng_state():
+    state = {"python": random.getstate(), "torch": torch.get_rng_state()}
+    if np is not None:
+        state["numpy"] = np.random.get_state()
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    torch.set_rng_state(state["torch"])
+    if np is not None and "numpy" in state:
+        np.random.set_state(state["numpy"])
+    if torch.cuda.is_available() and "cuda" in state:
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _to_cpu(obj):
+    # Copy, so the training loop can keep updating its tensors while we write
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def training_state(model, optimizer, scheduler=None, scaler=None, sampler=None, **counters):
+    """Everything needed to continue training exactly where it stopped.
+
+    `counters` holds the loop position (epoch, step in epoch, global step, ...).
+    Gradients accumulated since the last optimizer step are saved too, so a
+    checkpoint taken mid-accumulation resumes with those micro-batches intact.
+    """
+    return {
+        "model": model.state_dict(),
+        "grads": {name: p.grad for name, p in model.named_parameters() if p.grad is not None},
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict() if scheduler is not None else None,
+        "scaler": scaler.state_dict() if scaler is not None else None,
+        "sampler": sampler.state_dict() if sampler is not None else None,
+        "rng": rng_state(),
+        "counters": counters,
+    }
+
+
+def restore_training_state(state, model, optimizer, scheduler=None, scaler=None, sampler=None):
+    """Load a checkpoint into the training objects and return its counters."""
+    model.load_state_dict(state["model"])
+    grads = state.get("grads") or {}
+    for name, p in model.named_parameters():
+        p.grad = grads[name].to(p.device) if name in grads else None
+    optimizer.load_state_dict(state["optimizer"])
+    if scheduler is not None and state["scheduler"] is not None:
+        scheduler.load_state_dict(state["scheduler"])
+    if scaler is not None and state["scaler"] is not None:
+        scaler.load_state_dict(state["scaler"])
+    if sampler is not None and state["sampler"] is not None:
+        sampler.load_state_dict(state["sampler"])
+    set_rng_state(state["rng"])
+    return state["counters"]
+
+
+class CheckpointManager:
+    def __init__(self, directory, every_steps=None, every_minutes=None, keep=3):
+        self.directory = directory
+        self.every_steps = every_steps
+        self.every_seconds = every_minutes * 60 if every_minutes else None
+        self.keep = keep
+        self.last_save_time = time.monotonic()
+        self.writer = None
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+    def should_save(self, step):
+        if self.every_steps and step % self.every_steps == 0:
+            return True
+        if self.every_seconds and time.monotonic() - self.last_save_time >= self.every_seconds:
+            return True
+        return False
+
+    def save(self, step, state):
+        """Snapshot `state` now and write it on a background thread."""
+        # At most one write in flight, so snapshots cannot pile up in memory
+        self.wait()
+        snapshot = _to_cpu(state)
+        self.last_save_time = time.monotonic()
+        self.writer = threading.Thread(target=self._write, args=(step, snapshot), daemon=True)
+        self.writer.start()
+
+    def _write(self, step, snapshot):
+        path = os.path.join(self.directory, f"checkpoint-{step:09d}.pt")
+        tmp_path = path + ".tmp"
+        try:
+            torch.save(snapshot, tmp_path)
+            # A crash mid-write never leaves a truncated checkpoint behind
+            os.replace(tmp_path, path)
+            self._rotate()
+        except Exception as e:
+            self.error = e
+
+    def _rotate(self):
+        for path in self.checkpoints()[:-self.keep] if self.keep else []:
+            os.remove(path)
+
+    def wait(self):
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            print(f"Checkpoint write failed: {error}")
+
+    def checkpoints(self):
+        names = sorted(n for n in os.listdir(self.directory) if re.fullmatch(r"checkpoint-\d+\.pt", n))
+        return [os.path.join(self.directory, n) for n in names]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def load(self, path=None, map_location="cpu"):
+        path = path or self.latest()
+        if path is None:
+            return None
+        print(f"Resuming from {path}")
+        return torch.load(path, map_location=map_location, weights_only=False)
@@ -0,0 +1,140 @@
+import torch
+
+# Batched entity span decoding. Predicted label ids for a whole [B, S] batch are
+# turned into spans with tensor ops: label ids map to entity types and begin
+# flags through small lookup tables, span starts and ends are found by comparing
+# each position with its neighbours, and character offsets come straight from
+# the tokenizer's offset_mapping. Only the final conversion to dicts is Python.
+#
+#   types, begins, names = label_maps(id_to_label)
+#   spans = decode_spans(labels, scores, offsets, types, begins, carry=continuation_mask(tokenizer)[input_ids])
+#   entities = spans_to_entities(spans, names, texts)
+
+
+def label_maps(id_to_label, outside="O"):
+    """Per-label entity type ids and begin flags, plus the type names.
+
+    With an "O" label (BERT_train.py's B-/I- scheme) "B-X" and "I-X" share the
+    type X and only B- starts a new span. Without one (preprocess.py labels
+    tokens with the entity text) every label is its own type, and a span is a
+    run of tokens with that label.
+    """
+    bio = outside in id_to_label.values()
+    types, begins, type_ids = [], [], {}
+    for i in range(max(id_to_label) + 1):
+        label = id_to_label.get(i)
+        if label is None or label == outside:
+            types.append(-1)
+            begins.append(False)
+            continue
+        prefix, _, name = label.partition("-")
+        if not bio or prefix not in ("B", "I") or not name:
+            prefix, name = None, label
+        types.append(type_ids.setdefault(name, len(type_ids)))
+        begins.append(prefix == "B")
+    return torch.tensor(types, dtype=torch.long), torch.tensor(begins, dtype=torch.bool), list(type_ids)
+
+
+def continuation_mask(tokenizer):
+    """[vocab_size] bool tensor, True for WordPiece continuation pieces ("##...")."""
+    vocab = tokenizer.get_vocab()
+    mask = torch.zeros(max(len(tokenizer), max(vocab.values()) + 1), dtype=torch.bool)
+    mask[[i for token, i in vocab.items() if token.startswith("##")]] = True
+    return mask
+
+
+def span_boundaries(labels, types, begins, outside, carry):
+    """(rows, starts, ends, span types, token types) of the entity spans in a [B, S] label tensor.
+
+    Ends are inclusive. Positions in `outside` end a span; positions in `carry`
+    (subword pieces, special tokens) take the type of the previous position
+    without starting a span. A span starts at a begin label or where the type
+    changes, so an I- label after O or another type opens a span too.
+    """
+    batch_size, seq_len = labels.shape
+    token_types = types[labels.clamp(min=0, max=len(types) - 1)]
+    token_types = token_types.masked_fill(outside, -1)
+    starts = begins[labels.clamp(min=0, max=len(begins) - 1)] & ~carry
+
+    # Forward-fill carried positions from the last position that is not carried
+    positions = torch.arange(seq_len, device=labels.device).expand(batch_size, -1)
+    source = torch.where(carry, torch.full_like(positions, -1), positions).cummax(dim=1).values
+    token_types = torch.where(source >= 0, token_types.gather(1, source.clamp(min=0)), torch.full_like(token_types, -1))
+    token_types = token_types.masked_fill(outside, -1)
+
+    previous = torch.cat([token_types.new_full((batch_size, 1), -1), token_types[:, :-1]], dim=1)
+    starts = (token_types >= 0) & (starts | (token_types != previous))
+    following = torch.cat([token_types[:, 1:], token_types.new_full((batch_size, 1), -1)], dim=1)
+    following_starts = torch.cat([starts[:, 1:], starts.new_ones((batch_size, 1))], dim=1)
+    ends = (token_types >= 0) & ((following != token_types) | following_starts)
+
+    # Spans do not overlap, so the k-th start of a row pairs with its k-th end
+    rows, start_cols = starts.nonzero(as_tuple=True)
+    _, end_cols = ends.nonzero(as_tuple=True)
+    return rows, start_cols, end_cols, token_types[rows, start_cols], token_types
+
+
+def decode_spans(labels, scores, offsets, types, begins, outside=None, carry=None, threshold=0.0):
+    """Entity spans of a batch of predictions, as 1D tensors with one entry per span.
+
+    labels / scores are [B, S] predicted label ids and their probabilities,
+    offsets the [B, S, 2] offset_mapping. Special tokens and padding (empty
+    offsets) and the positions in `outside` are never part of an entity;
+    positions in `carry` follow the token before them. Tokens scoring below
+    `threshold` end a span. Returns row, token_start, token_end (inclusive),
+    type, score (the lowest score of the span) and char_start / char_end,
+    ordered by row and position.
+    """
+    empty = offsets[..., 0] == offsets[..., 1]
+    carry = torch.zeros_like(empty) if carry is None else carry.to(empty.device) & ~empty
+    outside = empty if outside is None else outside | empty
+    outside = outside | ((scores < threshold) & ~carry)
+
+    rows, starts, ends, span_types, token_types = span_boundaries(labels, types, begins, outside, carry)
+
+    # Every token inside a span belongs to the latest span started before it;
+    # carried pieces do not lower the span's score
+    in_span = (token_types >= 0).flatten()
+    is_start = torch.zeros_like(labels, dtype=torch.bool)
+    is_start[rows, starts] = True
+    span_ids = is_start.flatten().cumsum(0) - 1
+    token_scores = scores.float().masked_fill(carry, float("inf")).flatten()
+    span_scores = torch.full((len(rows),), float("inf"), device=scores.device)
+    span_scores.scatter_reduce_(0, span_ids[in_span], token_scores[in_span], reduce="amin")
+
+    return {
+        "row": rows,
+        "token_start": starts,
+        "token_end": ends,
+        "type": span_types,
+        "score": span_scores,
+        "char_start": offsets[rows, starts, 0],
+        "char_end": offsets[rows, ends, 1],
+    }
+
+
+def spans_to_entities(spans, type_names, texts, label_scheme=None):
+    """decode_spans output as one list of entity dicts per text.
+
+    With label_scheme="entity" (BERT_train.py's "B-{type}-{name}" labels) a type
+    name is "{type}-{name}"; it is split into entityType and resolvedName, the
+    fields gazetteer matches and the entity store report.
+    """
+    entities = [[] for _ in texts]
+    columns = zip(*(spans[key].tolist() for key in ("row", "token_start", "type", "score", "char_start", "char_end")))
+    for row, token, span_type, score, start, end in columns:
+        entity = {
+            "entityId": f"T{token}",
+            "entityType": type_names[span_type],
+            "entityName": texts[row][start:end],
+            "start": start,
+            "end": end,
+            "score": score,
+            "token": token,
+        }
+        if label_scheme == "entity":
+            entity_type, _, resolved_name = type_names[span_type].partition("-")
+            entity["entityType"] = entity_type
+            entity["resolvedName"] = resolved_name
+        entities[row].append(entity)
+    return entities
@@ -1,47 +1,42 @@
-import os
 import json
+import argparse
+import itertools
+from dict_store import EntityStore, build_store
 
-entity_dict = {}
-relation_dict = {}
 
-# Directory containing JSON files
-json_dir = "test"
+def export_json(store, entity_path, relation_path):
+    # Stream the store into the legacy entity_dict.json / relation_dict.json layout
+    with open(entity_path, "w") as f:
+        f.write("{")
+        for i, entity in enumerate(store.iter_entities()):
+            if i > 0:
+                f.write(", ")
+            f.write(f'{json.dumps(entity["entityId"])}: {json.dumps({"name": entity["name"], "type": entity["type"]})}')
+        f.write("}")
 
-# Loop over each JSON file in directory
-for filename in os.listdir(json_dir):
-    if filename.endswith(".json"):
-        # Load JSON file
-        with open(os.path.join(json_dir, filename), "r") as f:
-            data = json.load(f)
-        
-        # Extract entities
-        entities = data["entities"]
-        for entity in entities:
-            entity_id = entity["entityId"]
-            entity_dict[entity_id] = {
-                "name": entity["entityName"],
-                "type": entity["entityType"]
-            }
-        
-        # Extract relations
-        relations = data.get("relation_info", [])
-        for relation in relations:
-            subject_id = relation["subjectID"]
-            object_id = relation["objectId"]
-            relation_name = relation["rel_name"]
-            if subject_id in entity_dict and object_id in entity_dict:
-                if subject_id not in relation_dict:
-                    relation_dict[subject_id] = {}
-                if object_id not in relation_dict[subject_id]:
-                    relation_dict[subject_id][object_id] = []
-                relation_dict[subject_id][object_id].append(relation_name)
-                
-# Print entity and relation dictionaries
-print("Entity dictionary:\n", entity_dict)
-print("\nRelation dictionary:\n", relation_dict)
+    with open(relation_path, "w") as f:
+        f.write("{")
+        for i, (subject_id, rows) in enumerate(itertools.groupby(store.iter_relations(), key=lambda r: r[0])):
+            objects = {}
+            for _, object_id, rel_name in rows:
+                objects.setdefault(object_id, []).append(rel_name)
+            if i > 0:
+                f.write(", ")
+            f.write(f"{json.dumps(subject_id)}: {json.dumps(objects)}")
+        f.write("}")
 
-with open('entity_dict.json', 'w') as f:
-    json.dump(entity_dict, f)
 
-with open('relation_dict.json', 'w') as f:
-    json.dump(relation_dict, f)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the entity/relation dictionary store")
+    parser.add_argument("json_dir", nargs="?", default="test", help="Directory containing JSON files")
+    parser.add_argument("--db", default="entity_dict.sqlite", help="Path of the SQLite store to write")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--json", action="store_true", help="Also write entity_dict.json and relation_dict.json")
+    args = parser.parse_args()
+
+    num_files, num_entities, num_relations = build_store(args.json_dir, args.db, processes=args.processes)
+    print(f"Indexed {num_entities} entities and {num_relations} relations from {num_files} files into {args.db}")
+
+    if args.json:
+        with EntityStore(args.db) as store:
+            export_json(store, "entity_dict.json", "relation_dict.json")
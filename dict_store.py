@@ -0,0 +1,208 @@
+import os
+import sqlite3
+from multiprocessing import Pool
+from schema import SchemaError, load_document
+
+# Indexed on-disk entity/relation dictionary. Per-file partial dictionaries are
+# computed in parallel and merged in sorted file order into SQLite, so the result
+# is deterministic and neither building nor querying holds the corpus in memory.
+
+schema = """
+CREATE TABLE IF NOT EXISTS entities (
+    entity_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mentions (
+    mention_key TEXT NOT NULL,
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (mention_key, type, name)
+);
+CREATE TABLE IF NOT EXISTS relations (
+    subject_id TEXT NOT NULL,
+    object_id TEXT NOT NULL,
+    rel_name TEXT NOT NULL,
+    UNIQUE (subject_id, object_id, rel_name)
+);
+"""
+
+indexes = """
+CREATE INDEX IF NOT EXISTS entities_name_key ON entities (name_key, type);
+CREATE INDEX IF NOT EXISTS relations_object ON relations (object_id);
+"""
+
+
+def normalize_name(name):
+    """Lowercase and collapse whitespace so lookups ignore case and spacing."""
+    return " ".join(name.lower().split())
+
+
+def partial_dictionary(json_path):
+    """Extract the entity, mention and relation rows of one JSON document."""
+    document = load_document(json_path)
+
+    entities = [
+        (entity.entity_id, entity.entity_name, normalize_name(entity.entity_name), entity.entity_type)
+        for entity in document.entities
+    ]
+    # Surface forms seen in the text, used to resolve type-level NER spans to names
+    mentions = [
+        (normalize_name(document.text[entity.begin:entity.end]), entity.entity_type, entity.entity_name)
+        for entity in document.entities
+        if entity.has_span
+    ]
+    # Relations are kept even when their entities live in another file; the
+    # store resolves them at query time
+    relations = [(relation.subject_id, relation.object_id, relation.rel_name) for relation in document.relations]
+    return entities, mentions, relations
+
+
+def _safe_partial_dictionary(json_path):
+    try:
+        return json_path, partial_dictionary(json_path), None
+    except (SchemaError, OSError) as e:
+        return json_path, None, e
+
+
+def build_store(json_dir, db_path, processes=None, chunksize=64, commit_every=1000):
+    """Build the SQLite store at `db_path` from every .json file in `json_dir`.
+
+    Files are processed in sorted order; when an entity id appears in several
+    files, the first file wins. Returns (num_files, num_entities, num_relations).
+    """
+    file_paths = sorted(
+        os.path.join(json_dir, file_name) for file_name in os.listdir(json_dir) if file_name.endswith(".json")
+    )
+
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executescript(schema)
+
+    num_files = 0
+    with Pool(processes) as pool:
+        # imap keeps the input order, which makes the merge deterministic
+        for json_path, partial, error in pool.imap(_safe_partial_dictionary, file_paths, chunksize=chunksize):
+            if error is not None:
+                print(f"Skipping {json_path}: {error}")
+                continue
+            entities, mentions, relations = partial
+            conn.executemany("INSERT OR IGNORE INTO entities VALUES (?, ?, ?, ?)", entities)
+            conn.executemany(
+                "INSERT INTO mentions VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (mention_key, type, name) DO UPDATE SET count = count + 1",
+                mentions,
+            )
+            conn.executemany("INSERT OR IGNORE INTO relations VALUES (?, ?, ?)", relations)
+            num_files += 1
+            if num_files % commit_every == 0:
+                conn.commit()
+
+    # Building the indexes once after the bulk load is much faster than
+    # maintaining them row by row
+    conn.executescript(indexes)
+    conn.commit()
+    num_entities = conn.execute("SELECT COUNT(*) FROM entities").fetchone()[0]
+    num_relations = conn.execute("SELECT COUNT(*) FROM relations").fetchone()[0]
+    conn.close()
+
+    os.replace(tmp_path, db_path)
+    return num_files, num_entities, num_relations
+
+
+class EntityStore:
+    """Read-only lookups against a store built by `build_store`."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_entity(self, entity_id):
+        row = self.conn.execute(
+            "SELECT entity_id, name, type FROM entities WHERE entity_id = ?", (entity_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"entityId": row[0], "name": row[1], "type": row[2]}
+
+    def find_by_name(self, name, entity_type=None):
+        query = "SELECT entity_id, name, type FROM entities WHERE name_key = ?"
+        params = [normalize_name(name)]
+        if entity_type is not None:
+            query += " AND type = ?"
+            params.append(entity_type)
+        return [{"entityId": r[0], "name": r[1], "type": r[2]} for r in self.conn.execute(query, params)]
+
+    def resolve_mention(self, mention, entity_type=None):
+        """Return the entity name most often annotated for this surface form, or None."""
+        key = normalize_name(mention)
+        query = "SELECT name FROM mentions WHERE mention_key = ?"
+        params = [key]
+        if entity_type is not None:
+            query += " AND type = ?"
+            params.append(entity_type)
+        row = self.conn.execute(query + " ORDER BY count DESC, name LIMIT 1", params).fetchone()
+        if row is not None:
+            return row[0]
+
+        # Fall back to the canonical entity names
+        matches = self.find_by_name(mention, entity_type)
+        return matches[0]["name"] if matches else None
+
+    def relations(self, subject_id, object_id):
+        rows = self.conn.execute(
+            "SELECT rel_name FROM relations WHERE subject_id = ? AND object_id = ? ORDER BY rel_name",
+            (subject_id, object_id),
+        )
+        return [r[0] for r in rows]
+
+    def relations_from(self, subject_id):
+        rows = self.conn.execute(
+            "SELECT object_id, rel_name FROM relations WHERE subject_id = ? ORDER BY object_id, rel_name",
+            (subject_id,),
+        )
+        return [(r[0], r[1]) for r in rows]
+
+    def iter_entities(self, batch_size=10000):
+        cursor = self.conn.execute("SELECT entity_id, name, type FROM entities ORDER BY entity_id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield {"entityId": row[0], "name": row[1], "type": row[2]}
+
+    def iter_mentions(self, batch_size=10000):
+        """(normalized surface form, type, entity name, count) of every annotated mention."""
+        cursor = self.conn.execute("SELECT mention_key, type, name, count FROM mentions ORDER BY mention_key, type, name")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def iter_relations(self, batch_size=10000):
+        cursor = self.conn.execute(
+            "SELECT subject_id, object_id, rel_name FROM relations ORDER BY subject_id, object_id, rel_name"
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
@@ -8,6 +8,7 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from torch.utils.data import DataLoader
 from torch.utils.data.distributed import DistributedSampler
 from BERT_train import train, BertForNERAndRE, config, num_ner_labels, num_re_labels, dataset, custom_collate_fn, num_workers, num_epochs, learning_rate, tokenizer, label_to_id, relation_to_id, NERRE_Dataset, preprocess_data, validate_json
+from schema import iter_documents
 
 def get_unused_port():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -39,12 +40,9 @@ def main():
 
     json_directory = "test"
 
-    for filename in os.listdir(json_directory):
-        if filename.endswith(".json"):
-            with open(os.path.join(json_directory, filename), "r") as f:
-                json_data = json.load(f)
-                if validate_json(json_data):
-                    preprocessed_data.extend(preprocess_data(json_data, tokenizer, label_to_id, relation_to_id))
+    for json_path, document in iter_documents(json_directory):
+        if validate_json(document):
+            preprocessed_data.extend(preprocess_data(document, tokenizer, label_to_id, relation_to_id))
 
     # Create the dataset
     dataset = NERRE_Dataset(preprocessed_data, tokenizer, max_length=512, label_to_id=label_to_id, relation_to_id=relation_to_id)
@@ -77,7 +75,7 @@ def main():
     if dist.get_rank() == 0:
         output_dir = "models/combined"
         os.makedirs(output_dir, exist_ok=True)
-        model.module.save_pretrained(output_dir)  # Use model.module to access the underlying model
+        model.module.save_pretrained(output_dir, safe_serialization=True)  # Use model.module to access the underlying model
         tokenizer.save_pretrained(output_dir)
 
         # Save the label_to_id and relation_to_id mappings
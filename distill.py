@@ -0,0 +1,392 @@
+import os
+import json
+import pickle
+import random
+import hashlib
+import argparse
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+from transformers import AdamW, DistilBertConfig, DistilBertTokenizerFast, get_linear_schedule_with_warmup
+from models import BertForNERAndRE, DistilBertForNERAndRE, span_re_logits
+from packing import pad_examples
+from records import load_examples
+from inference import tiny_tokenizer, tiny_bert_config, tiny_distilbert_config
+from weights import load_model, load_label_maps
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+
+# Teacher-student distillation from BertForNERAndRE to DistilBertForNERAndRE.
+#
+# Stage 1 (cache) runs the teacher once over the RE examples and writes its NER
+# logits (one row per token) and RE logits (one row per relation) as fp16
+# memmaps, with offsets to find each example's rows. Stage 2 (train) trains the
+# student against those cached soft targets plus the hard labels; the teacher is
+# never loaded. bert-base-uncased and distilbert-base-uncased share a vocabulary,
+# so both models read the same token ids.
+#
+# The student is trained on preprocess.py's label_to_id.pkl / relation_to_id.pkl,
+# so --teacher must be a BertForNERAndRE trained on those same labels: its
+# label_to_id.json and relation_to_id.json must name the same labels (in any
+# order; the cached logit columns are put in the student's order). BERT_train.py's
+# models/combined uses B-/I- labels from the JSON corpus and is refused. Stage 0
+# (teacher) fine-tunes such a teacher from --teacher-init on the same examples;
+# --stage all runs it when --teacher does not hold a model yet.
+#
+#   python distill.py --stage teacher --teacher models/teacher
+#   python distill.py --stage cache --teacher models/teacher
+#   python distill.py --stage train --output models/distilled
+#   python distill.py --tiny            # every stage, tiny random-init models
+
+
+def examples_fingerprint(examples):
+    digest = hashlib.sha1()
+    for example in examples:
+        digest.update(np.asarray(example["input_ids"], dtype=np.int32).tobytes())
+    return digest.hexdigest()
+
+
+class TeacherCache:
+    """fp16 memmapped teacher logits, indexed by example."""
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.ner_offsets = np.load(os.path.join(cache_dir, "ner_offsets.npy"))
+        self.re_offsets = np.load(os.path.join(cache_dir, "re_offsets.npy"))
+        self.ner_logits = np.memmap(os.path.join(cache_dir, "ner_logits.f16"), dtype=np.float16, mode="r",
+                                    shape=(int(self.ner_offsets[-1]), self.meta["num_ner_labels"]))
+        self.re_logits = np.memmap(os.path.join(cache_dir, "re_logits.f16"), dtype=np.float16, mode="r",
+                                   shape=(int(self.re_offsets[-1]), self.meta["num_re_labels"]))
+
+    def __len__(self):
+        return len(self.ner_offsets) - 1
+
+    def __getitem__(self, idx):
+        ner = self.ner_logits[self.ner_offsets[idx]:self.ner_offsets[idx + 1]]
+        re = self.re_logits[self.re_offsets[idx]:self.re_offsets[idx + 1]]
+        return torch.from_numpy(np.array(ner)), torch.from_numpy(np.array(re))
+
+
+def label_columns(student_to_id, teacher_to_id, kind):
+    """The teacher logit column of every student label id, matched by label name."""
+    if set(student_to_id) != set(teacher_to_id):
+        missing = sorted(set(student_to_id) - set(teacher_to_id))[:5]
+        extra = sorted(set(teacher_to_id) - set(student_to_id))[:5]
+        raise ValueError(f"The teacher's {kind} labels differ from the student's (missing {missing}, extra {extra}); "
+                         f"--teacher must be trained on the same labels")
+    columns = [0] * len(student_to_id)
+    for name, i in student_to_id.items():
+        columns[i] = teacher_to_id[name]
+    return columns
+
+
+def build_teacher_cache(teacher, examples, cache_dir, batch_size=32, device=None, pad_id=0, ner_columns=None, re_columns=None):
+    """ner_columns / re_columns reorder the teacher's logits into the student's label ids (default: same order)."""
+    ner_columns = list(range(teacher.num_ner_labels)) if ner_columns is None else ner_columns
+    re_columns = list(range(teacher.num_re_labels)) if re_columns is None else re_columns
+    device = device or next(teacher.parameters()).device
+    teacher.to(device)
+    teacher.eval()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    ner_offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+    ner_offsets[1:] = np.cumsum([len(example["input_ids"]) for example in examples])
+    re_offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+    re_offsets[1:] = np.cumsum([len(example["relations"]) for example in examples])
+
+    ner_path = os.path.join(cache_dir, "ner_logits.f16")
+    re_path = os.path.join(cache_dir, "re_logits.f16")
+    ner_logits = np.memmap(ner_path + ".tmp", dtype=np.float16, mode="w+", shape=(max(1, int(ner_offsets[-1])), len(ner_columns)))
+    re_logits = np.memmap(re_path + ".tmp", dtype=np.float16, mode="w+", shape=(max(1, int(re_offsets[-1])), len(re_columns)))
+
+    with torch.inference_mode():
+        for start in tqdm(range(0, len(examples), batch_size), desc="Teacher"):
+            chunk = examples[start:start + batch_size]
+            batch = pad_examples(chunk, pad_id)
+            outputs = teacher(input_ids=batch["input_ids"].to(device), attention_mask=batch["attention_mask"].to(device))
+            batch_ner = outputs["ner_logits"][..., ner_columns].float().cpu().numpy()
+            batch_re = span_re_logits(teacher.re_classifier, outputs["sequence_output"], batch["re_spans"])[..., re_columns].float().cpu().numpy()
+            for b, example in enumerate(chunk):
+                i = start + b
+                ner_logits[ner_offsets[i]:ner_offsets[i + 1]] = batch_ner[b, :len(example["input_ids"])]
+                re_logits[re_offsets[i]:re_offsets[i + 1]] = batch_re[b, :len(example["relations"])]
+
+    ner_logits.flush()
+    re_logits.flush()
+    del ner_logits, re_logits
+    os.replace(ner_path + ".tmp", ner_path)
+    os.replace(re_path + ".tmp", re_path)
+    np.save(os.path.join(cache_dir, "ner_offsets.npy"), ner_offsets)
+    np.save(os.path.join(cache_dir, "re_offsets.npy"), re_offsets)
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump({
+            "num_examples": len(examples),
+            "num_ner_labels": len(ner_columns),
+            "num_re_labels": len(re_columns),
+            "fingerprint": examples_fingerprint(examples),
+        }, f)
+    size_mb = (os.path.getsize(ner_path) + os.path.getsize(re_path)) / 2 ** 20
+    print(f"Cached teacher logits for {len(examples)} examples in {cache_dir} ({size_mb:.1f} MB)")
+
+
+class DistillationDataset(Dataset):
+    def __init__(self, examples, cache):
+        if len(cache) != len(examples) or cache.meta["fingerprint"] != examples_fingerprint(examples):
+            raise ValueError("The teacher cache was built from different examples; rebuild it with --stage cache")
+        self.examples = examples
+        self.cache = cache
+
+    def __len__(self):
+        return len(self.examples)
+
+    def __getitem__(self, idx):
+        teacher_ner, teacher_re = self.cache[idx]
+        return self.examples[idx], teacher_ner, teacher_re
+
+
+def distillation_collate_fn(batch, pad_id=0, ignore_index=-100):
+    examples = [example for example, _, _ in batch]
+    padded = pad_examples(examples, pad_id, ignore_index)
+    batch_size, seq_len = padded["input_ids"].shape
+    teacher_ner = torch.zeros(batch_size, seq_len, batch[0][1].size(-1))
+    teacher_re = torch.zeros(batch_size, padded["re_labels"].size(1), batch[0][2].size(-1))
+    for b, (_, ner, re) in enumerate(batch):
+        teacher_ner[b, :ner.size(0)] = ner.float()
+        teacher_re[b, :re.size(0)] = re.float()
+    padded["teacher_ner_logits"] = teacher_ner
+    padded["teacher_re_logits"] = teacher_re
+    return padded
+
+
+def distillation_loss(student_logits, teacher_logits, labels, mask, temperature=2.0, alpha=0.5, ignore_index=-100):
+    """alpha * T^2 * KL(teacher || student) on soft targets + (1 - alpha) * cross-entropy on hard labels."""
+    mask = mask.reshape(-1).bool()
+    student = student_logits.reshape(-1, student_logits.size(-1))[mask]
+    teacher = teacher_logits.reshape(-1, teacher_logits.size(-1))[mask]
+    if student.size(0) == 0:
+        return student_logits.sum() * 0.0
+    soft = F.kl_div(
+        F.log_softmax(student / temperature, dim=-1),
+        F.log_softmax(teacher / temperature, dim=-1),
+        log_target=True,
+        reduction="batchmean",
+    ) * temperature ** 2
+    hard_labels = labels.reshape(-1)[mask]
+    if (hard_labels != ignore_index).any():
+        hard = F.cross_entropy(student, hard_labels, ignore_index=ignore_index)
+    else:
+        hard = soft * 0.0
+    return alpha * soft + (1 - alpha) * hard
+
+
+def train_teacher(teacher, examples, num_epochs=3, batch_size=16, learning_rate=5e-5, ignore_index=-100, pad_id=0,
+                  device=None, seed=0):
+    """Fine-tune a BertForNERAndRE on the hard labels of record_to_example examples."""
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher.to(device)
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    dataloader = DataLoader(
+        examples,
+        batch_size=batch_size,
+        shuffle=True,
+        generator=generator,
+        collate_fn=lambda batch: pad_examples(batch, pad_id, ignore_index),
+    )
+    optimizer = AdamW(teacher.parameters(), lr=learning_rate)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=len(dataloader) * num_epochs)
+    # BertForNERAndRE's own NER loss ignores -100 only, so the loss is computed here
+    ner_loss_fn = torch.nn.CrossEntropyLoss(ignore_index=ignore_index)
+    re_loss_fn = torch.nn.CrossEntropyLoss(ignore_index=-1)
+
+    for epoch in range(num_epochs):
+        teacher.train()
+        progress_bar = tqdm(dataloader, desc=f"Teacher epoch {epoch + 1}/{num_epochs}")
+        for batch in progress_bar:
+            attention_mask = batch["attention_mask"].to(device)
+            ner_labels = batch["ner_labels"].to(device)
+            re_labels = batch["re_labels"].to(device)
+
+            outputs = teacher(input_ids=batch["input_ids"].to(device), attention_mask=attention_mask)
+            ner_logits = outputs["ner_logits"]
+            re_logits = span_re_logits(teacher.re_classifier, outputs["sequence_output"], batch["re_spans"].to(device))
+
+            active = attention_mask.reshape(-1).bool()
+            ner_loss = ner_loss_fn(ner_logits.reshape(-1, ner_logits.size(-1))[active], ner_labels.reshape(-1)[active])
+            if (re_labels != -1).any():
+                re_loss = re_loss_fn(re_logits.reshape(-1, re_logits.size(-1)), re_labels.reshape(-1))
+            else:
+                re_loss = re_logits.sum() * 0.0
+            # Same task weighting as the training scripts
+            loss_weight = 0.5
+            total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
+
+            total_loss.backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item()})
+    return teacher
+
+
+def train_student(student, dataset, num_epochs=3, batch_size=16, learning_rate=5e-5, temperature=2.0, alpha=0.5,
+                  ignore_index=-100, pad_id=0, device=None, seed=0):
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    student.to(device)
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=True,
+        generator=generator,
+        collate_fn=lambda batch: distillation_collate_fn(batch, pad_id, ignore_index),
+    )
+    optimizer = AdamW(student.parameters(), lr=learning_rate)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=len(dataloader) * num_epochs)
+
+    for epoch in range(num_epochs):
+        student.train()
+        progress_bar = tqdm(dataloader, desc=f"Epoch {epoch + 1}/{num_epochs}")
+        for batch in progress_bar:
+            input_ids = batch["input_ids"].to(device)
+            attention_mask = batch["attention_mask"].to(device)
+            ner_labels = batch["ner_labels"].to(device)
+            re_labels = batch["re_labels"].to(device)
+
+            outputs = student(input_ids=input_ids, attention_mask=attention_mask, re_spans=batch["re_spans"].to(device))
+
+            ner_loss = distillation_loss(
+                outputs["ner_logits"], batch["teacher_ner_logits"].to(device), ner_labels, attention_mask,
+                temperature, alpha, ignore_index,
+            )
+            re_loss = distillation_loss(
+                outputs["re_logits"], batch["teacher_re_logits"].to(device), re_labels, re_labels != -1,
+                temperature, alpha, ignore_index=-1,
+            )
+            # Same task weighting as the training scripts
+            loss_weight = 0.5
+            total_loss = loss_weight * ner_loss + (1 - loss_weight) * re_loss
+
+            total_loss.backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            progress_bar.set_postfix({"NER Loss": ner_loss.item(), "RE Loss": re_loss.item(), "Total Loss": total_loss.item()})
+    return student
+
+
+def tiny_examples(vocab_size, num_labels, num_relations, count=64, seed=0):
+    """Random examples in record_to_example's format, for offline runs."""
+    rng = random.Random(seed)
+    examples = []
+    for _ in range(count):
+        length = rng.randint(8, 40)
+        relations = []
+        for _ in range(rng.randint(1, 3)):
+            s, o = sorted(rng.sample(range(1, length - 2), 2))
+            relations.append({"subject_start_idx": s, "subject_end_idx": s, "object_start_idx": o, "object_end_idx": o + 1,
+                              "label": rng.randrange(num_relations)})
+        examples.append({
+            "input_ids": [2] + [rng.randrange(5, vocab_size) for _ in range(length - 2)] + [3],
+            "ner_labels": [rng.randrange(num_labels) for _ in range(length)],
+            "relations": relations,
+        })
+    return examples
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill BertForNERAndRE into DistilBertForNERAndRE")
+    parser.add_argument("--stage", choices=["teacher", "cache", "train", "all"], default="all")
+    parser.add_argument("--teacher", default="models/teacher", help="Teacher BertForNERAndRE directory, trained on the student's labels")
+    parser.add_argument("--teacher-init", default="bert-base-uncased", help="Pretrained BERT the teacher stage starts from")
+    parser.add_argument("--teacher-epochs", type=int, default=3)
+    parser.add_argument("--student-init", default="distilbert-base-uncased")
+    parser.add_argument("--data", default="preprocessed_re_data.pkl", help="The preprocessed pickle or a records.py .npz")
+    parser.add_argument("--cache-dir", default="teacher_cache")
+    parser.add_argument("--output", default="models/distilled")
+    parser.add_argument("--epochs", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--learning-rate", type=float, default=5e-5)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the soft-target loss")
+    parser.add_argument("--tiny", action="store_true", help="Tiny random-init teacher and student on synthetic data")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    if args.tiny:
+        tokenizer = tiny_tokenizer()
+        label_to_id = {f"L{i}": i for i in range(5)}
+        relation_to_id = {f"R{i}": i for i in range(3)}
+        examples = tiny_examples(len(tokenizer), len(label_to_id), len(relation_to_id))
+        ignore_index = -100
+    else:
+        tokenizer = DistilBertTokenizerFast.from_pretrained(args.student_init)
+        with open("label_to_id.pkl", "rb") as f:
+            label_to_id = pickle.load(f)
+        with open("relation_to_id.pkl", "rb") as f:
+            relation_to_id = pickle.load(f)
+        # Same ignore index as DistiliBERT_train.py
+        ignore_index = max(label_to_id.values())
+        # A preprocessed pickle or a compact records.py store
+        examples, _ = load_examples(args.data, tokenizer, label_to_id, relation_to_id, ignore_index)
+
+    teacher = None
+    if args.stage == "teacher" or (args.stage == "all" and not os.path.exists(os.path.join(args.teacher, "config.json"))):
+        if args.tiny:
+            teacher = BertForNERAndRE(tiny_bert_config(len(tokenizer)), len(label_to_id), len(relation_to_id))
+        else:
+            teacher = BertForNERAndRE.from_pretrained(args.teacher_init, len(label_to_id), len(relation_to_id))
+        teacher = train_teacher(
+            teacher, examples, args.teacher_epochs, args.batch_size, args.learning_rate,
+            ignore_index=ignore_index, pad_id=tokenizer.pad_token_id,
+        )
+        # Saved with the student's label maps, so the cache stage can check them
+        os.makedirs(args.teacher, exist_ok=True)
+        teacher.save_pretrained(args.teacher, safe_serialization=True)
+        tokenizer.save_pretrained(args.teacher)
+        with open(os.path.join(args.teacher, "label_to_id.json"), "w") as f:
+            json.dump(label_to_id, f)
+        with open(os.path.join(args.teacher, "relation_to_id.json"), "w") as f:
+            json.dump(relation_to_id, f)
+        print(f"Saved the teacher to {args.teacher}")
+
+    if args.stage in ("cache", "all"):
+        if teacher is not None:
+            teacher_label_to_id, teacher_relation_to_id = label_to_id, relation_to_id
+        elif args.tiny:
+            teacher = BertForNERAndRE(tiny_bert_config(len(tokenizer)), len(label_to_id), len(relation_to_id))
+            teacher_label_to_id, teacher_relation_to_id = label_to_id, relation_to_id
+        else:
+            # The teacher's own maps, not the student's: the label ids must mean the same labels
+            teacher_label_to_id, teacher_relation_to_id = load_label_maps(args.teacher)
+            teacher = load_model(args.teacher, len(teacher_label_to_id), len(teacher_relation_to_id))
+        ner_columns = label_columns(label_to_id, teacher_label_to_id, "NER")
+        re_columns = label_columns(relation_to_id, teacher_relation_to_id, "relation")
+        build_teacher_cache(teacher, examples, args.cache_dir, args.batch_size, pad_id=tokenizer.pad_token_id,
+                            ner_columns=ner_columns, re_columns=re_columns)
+        del teacher
+
+    if args.stage in ("train", "all"):
+        dataset = DistillationDataset(examples, TeacherCache(args.cache_dir))
+        if args.tiny:
+            config = tiny_distilbert_config(len(tokenizer))
+        else:
+            config = DistilBertConfig.from_pretrained(args.student_init)
+        student = DistilBertForNERAndRE(config, len(label_to_id), len(relation_to_id), ner_ignore_index=ignore_index)
+        student = train_student(
+            student, dataset, args.epochs, args.batch_size, args.learning_rate, args.temperature, args.alpha,
+            ignore_index=ignore_index, pad_id=tokenizer.pad_token_id,
+        )
+
+        os.makedirs(args.output, exist_ok=True)
+        student.save_pretrained(args.output, safe_serialization=True)
+        tokenizer.save_pretrained(args.output)
+        with open(os.path.join(args.output, "label_to_id.json"), "w") as f:
+            json.dump(label_to_id, f)
+        with open(os.path.join(args.output, "relation_to_id.json"), "w") as f:
+            json.dump(relation_to_id, f)
@@ -0,0 +1,133 @@
+import time
+import hashlib
+import torch
+from models import span_re_logits
+from packing import pad_examples
+from decoding import label_maps, span_boundaries
+
+# Batched dev-set evaluation for the NER + RE models. The dev split is chosen by
+# hashing each item's key, so it does not depend on file order or on how the
+# records were grouped, and stays the same from run to run. Examples are sorted
+# by length and padded per batch, the forward runs under torch.inference_mode,
+# and the span / relation counts are computed with tensor ops and only copied to
+# the host once at the end.
+
+
+def in_dev_split(key, dev_fraction=0.1, seed=0):
+    """Whether the item identified by the string key belongs to the dev split."""
+    digest = hashlib.sha1(f"{seed}:{key}".encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 2 ** 32 < dev_fraction
+
+
+def split_dataset(items, key, dev_fraction=0.1, seed=0):
+    """Deterministic (train, dev) split; key(item) returns a string identifying the item."""
+    if dev_fraction <= 0:
+        return list(items), []
+    train, dev = [], []
+    for item in items:
+        (dev if in_dev_split(key(item), dev_fraction, seed) else train).append(item)
+    return train, dev
+
+
+def span_label_maps(id_to_label, outside="O"):
+    """Per-label entity type ids and begin flags for span extraction (see decoding.label_maps)."""
+    types, begins, _ = label_maps(id_to_label, outside)
+    return types, begins
+
+
+def extract_spans(labels, types, begins, outside, carry):
+    """Integer keys (row, start, end, type) of the entity spans in a [B, S] label tensor."""
+    seq_len = labels.size(1)
+    rows, starts, ends, span_types, _ = span_boundaries(labels, types, begins, outside, carry)
+    return ((rows * seq_len + starts) * seq_len + ends) * (len(types) + 1) + span_types
+
+
+def precision_recall_f1(tp, predicted, gold):
+    precision = tp / predicted if predicted else 0.0
+    recall = tp / gold if gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+class Evaluator:
+    """Span-level NER and relation-level RE precision / recall / F1 on a fixed dev set.
+
+    examples are in packing.record_to_example's format. Negative ner_labels
+    (subword pieces, special tokens) continue the previous token. A non-negative
+    ignore_index is DistiliBERT_train.py's label for tokens outside any entity.
+    """
+
+    def __init__(self, examples, id_to_label, batch_size=32, device=None, pad_id=0, ignore_index=-100, re_negative=None):
+        self.device = device or torch.device("cpu")
+        self.ignore_index = ignore_index
+        self.re_negative = re_negative
+        self.types, self.begins = span_label_maps(id_to_label)
+        self.types, self.begins = self.types.to(self.device), self.begins.to(self.device)
+        self.num_examples = len(examples)
+
+        # Longest first, so similar lengths share a batch and padding stays small
+        examples = sorted(examples, key=lambda example: -len(example["input_ids"]))
+        self.batches = [pad_examples(examples[i:i + batch_size], pad_id, ignore_index) for i in range(0, len(examples), batch_size)]
+
+    def __len__(self):
+        return self.num_examples
+
+    def ner_masks(self, labels, attention_mask):
+        outside = attention_mask == 0
+        if self.ignore_index >= 0:
+            outside = outside | (labels == self.ignore_index)
+        carry = (labels < 0) & ~outside
+        return outside, carry
+
+    def evaluate(self, model):
+        was_training = model.training
+        model.eval()
+        counts = torch.zeros(6, dtype=torch.long, device=self.device)
+        start = time.perf_counter()
+        with torch.inference_mode():
+            for batch in self.batches:
+                input_ids = batch["input_ids"].to(self.device, non_blocking=True)
+                attention_mask = batch["attention_mask"].to(self.device, non_blocking=True)
+                ner_labels = batch["ner_labels"].to(self.device, non_blocking=True)
+                re_labels = batch["re_labels"].to(self.device, non_blocking=True)
+                outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+
+                # Gold and predicted spans share the gold outside / carry masks
+                outside, carry = self.ner_masks(ner_labels, attention_mask)
+                predictions = outputs["ner_logits"].argmax(dim=-1)
+                predicted_outside = (attention_mask == 0) | ((predictions == self.ignore_index) & ~carry)
+                gold_spans = extract_spans(ner_labels, self.types, self.begins, outside, carry)
+                predicted_spans = extract_spans(predictions, self.types, self.begins, predicted_outside, carry)
+                counts[0] += torch.isin(predicted_spans, gold_spans).sum()
+                counts[1] += predicted_spans.numel()
+                counts[2] += gold_spans.numel()
+
+                re_logits = span_re_logits(model.re_classifier, outputs["sequence_output"], batch["re_spans"].to(self.device))
+                re_predictions = re_logits.argmax(dim=-1)
+                active = re_labels != -1
+                gold_positive = active if self.re_negative is None else active & (re_labels != self.re_negative)
+                predicted_positive = active if self.re_negative is None else active & (re_predictions != self.re_negative)
+                counts[3] += (gold_positive & (re_predictions == re_labels)).sum()
+                counts[4] += predicted_positive.sum()
+                counts[5] += gold_positive.sum()
+        if was_training:
+            model.train()
+
+        ner_tp, ner_predicted, ner_gold, re_tp, re_predicted, re_gold = counts.tolist()
+        ner_precision, ner_recall, ner_f1 = precision_recall_f1(ner_tp, ner_predicted, ner_gold)
+        re_precision, re_recall, re_f1 = precision_recall_f1(re_tp, re_predicted, re_gold)
+        return {
+            "ner_precision": ner_precision,
+            "ner_recall": ner_recall,
+            "ner_f1": ner_f1,
+            "re_precision": re_precision,
+            "re_recall": re_recall,
+            "re_f1": re_f1,
+            "seconds": time.perf_counter() - start,
+        }
+
+
+def format_metrics(metrics):
+    return (f"NER P/R/F1 {metrics['ner_precision']:.3f}/{metrics['ner_recall']:.3f}/{metrics['ner_f1']:.3f}  "
+            f"RE P/R/F1 {metrics['re_precision']:.3f}/{metrics['re_recall']:.3f}/{metrics['re_f1']:.3f}  "
+            f"({metrics['seconds']:.1f}s)")
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from transformers import get_linear_schedule_with_warmup
+from models import BertForNERAndRE, DistilBertForNERAndRE, pool_spans
+from packing import pad_examples
+from records import load_examples
+from evaluate import Evaluator, split_dataset, format_metrics
+from distill import examples_fingerprint, tiny_examples
+from weights import load_model, load_label_maps, load_tokenizer
+from inference import tiny_tokenizer, tiny_bert_config, tiny_distilbert_config
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+
+# Head-only training from cached encoder features.
+#
+# Experiments that only change the NER classifier or the re_classifier bilinear
+# head do not need to run the encoder every epoch. Stage 1 (cache) runs the
+# frozen encoder once over the training examples and keeps only the rows the
+# heads read, as fp16 memmaps:
+#
+#   ner_features.f16   [NER rows, hidden]   hidden state of every labelled token
+#   ner_labels.npy     [NER rows]           its label
+#   span_features.f16  [spans, hidden]      mean hidden state of every entity span used by a relation
+#   relations.npy      [relations, 3]       subject span row, object span row, relation label
+#
+# Stage 2 (train) trains the heads on those rows, with the model's dropout on
+# the features, then puts them back into the model and saves it; the encoder is
+# unchanged. The encoder runs in eval mode for the cache, so its internal
+# dropout is off, unlike in full fine-tuning.
+#
+#   python feature_cache.py --stage cache --model-dir models/distilbert
+#   python feature_cache.py --stage train --model-dir models/distilbert --output models/heads
+#   python feature_cache.py --tiny bert       # both stages, tiny random-init model
+
+
+def encoder_outputs(model, input_ids, attention_mask):
+    encoder = model.bert if isinstance(model, BertForNERAndRE) else model.distilbert
+    return encoder(input_ids, attention_mask=attention_mask)[0]
+
+
+def ner_head(model):
+    return model.classifier if isinstance(model, BertForNERAndRE) else model.ner_classifier
+
+
+def encoder_fingerprint(model):
+    # The first values of every encoder tensor: cheap, and different for any other checkpoint
+    encoder = model.bert if isinstance(model, BertForNERAndRE) else model.distilbert
+    digest = hashlib.sha1()
+    for name, tensor in encoder.state_dict().items():
+        digest.update(name.encode("utf-8"))
+        digest.update(tensor.detach().flatten()[:64].float().cpu().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def labelled_positions(example, ignore_index):
+    return [i for i, label in enumerate(example["ner_labels"]) if label >= 0 and label != ignore_index]
+
+
+def example_spans(example):
+    """The distinct (start, end) spans of an example's relations, and each relation's (subject, object) span index."""
+    spans, pairs = {}, []
+    for relation in example["relations"]:
+        subject = spans.setdefault((relation["subject_start_idx"], relation["subject_end_idx"]), len(spans))
+        obj = spans.setdefault((relation["object_start_idx"], relation["object_end_idx"]), len(spans))
+        pairs.append((subject, obj))
+    return list(spans), pairs
+
+
+class FeatureCache:
+    """fp16 memmapped encoder features for head-only training."""
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        hidden_size = self.meta["hidden_size"]
+        self.ner_labels = np.load(os.path.join(cache_dir, "ner_labels.npy"))
+        self.relations = np.load(os.path.join(cache_dir, "relations.npy"))
+        self.ner_features = np.memmap(os.path.join(cache_dir, "ner_features.f16"), dtype=np.float16, mode="r",
+                                      shape=(max(1, len(self.ner_labels)), hidden_size))
+        self.span_features = np.memmap(os.path.join(cache_dir, "span_features.f16"), dtype=np.float16, mode="r",
+                                       shape=(max(1, self.meta["num_spans"]), hidden_size))
+
+    def check(self, model, examples):
+        if self.meta["fingerprint"] != examples_fingerprint(examples):
+            raise ValueError("The feature cache was built from different examples; rebuild it with --stage cache")
+        if self.meta["encoder"] != encoder_fingerprint(model):
+            raise ValueError("The feature cache was built with a different encoder; rebuild it with --stage cache")
+
+    def ner_rows(self, rows):
+        return (torch.from_numpy(self.ner_features[rows].astype(np.float32)),), torch.from_numpy(self.ner_labels[rows].astype(np.int64))
+
+    def re_rows(self, rows):
+        relations = self.relations[rows]
+        subject = torch.from_numpy(self.span_features[relations[:, 0]].astype(np.float32))
+        obj = torch.from_numpy(self.span_features[relations[:, 1]].astype(np.float32))
+        return (subject, obj), torch.from_numpy(relations[:, 2].astype(np.int64))
+
+
+def build_feature_cache(model, examples, cache_dir, batch_size=32, device=None, pad_id=0, ignore_index=-100):
+    device = device or next(model.parameters()).device
+    model.to(device)
+    model.eval()
+    os.makedirs(cache_dir, exist_ok=True)
+    hidden_size = model.config.hidden_size
+
+    # Row counts are known up front, so the memmaps are written in place
+    positions = [labelled_positions(example, ignore_index) for example in examples]
+    spans = [example_spans(example) for example in examples]
+    ner_offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+    ner_offsets[1:] = np.cumsum([len(p) for p in positions])
+    span_offsets = np.zeros(len(examples) + 1, dtype=np.int64)
+    span_offsets[1:] = np.cumsum([len(example_span_list) for example_span_list, _ in spans])
+
+    ner_labels = np.array([example["ner_labels"][i] for example, p in zip(examples, positions) for i in p], dtype=np.int32)
+    relations = np.array([
+        (span_offsets[e] + subject, span_offsets[e] + obj, relation["label"])
+        for e, (example, (_, pairs)) in enumerate(zip(examples, spans))
+        for (subject, obj), relation in zip(pairs, example["relations"])
+    ], dtype=np.int64).reshape(-1, 3)
+
+    ner_path = os.path.join(cache_dir, "ner_features.f16")
+    span_path = os.path.join(cache_dir, "span_features.f16")
+    ner_features = np.memmap(ner_path + ".tmp", dtype=np.float16, mode="w+", shape=(max(1, int(ner_offsets[-1])), hidden_size))
+    span_features = np.memmap(span_path + ".tmp", dtype=np.float16, mode="w+", shape=(max(1, int(span_offsets[-1])), hidden_size))
+
+    # Longest first, so similar lengths share a batch and padding stays small
+    order = sorted(range(len(examples)), key=lambda i: -len(examples[i]["input_ids"]))
+    with torch.inference_mode():
+        for start in tqdm(range(0, len(order), batch_size), desc="Encoding"):
+            chunk = order[start:start + batch_size]
+            batch = pad_examples([examples[i] for i in chunk], pad_id, ignore_index)
+            sequence_output = encoder_outputs(model, batch["input_ids"].to(device), batch["attention_mask"].to(device)).float()
+            # Every span of the batch pooled in one call, padded to the example with the most spans
+            max_spans = max(1, max(len(spans[i][0]) for i in chunk))
+            bounds = torch.zeros((len(chunk), max_spans, 2), dtype=torch.long)
+            for b, i in enumerate(chunk):
+                if spans[i][0]:
+                    bounds[b, :len(spans[i][0])] = torch.tensor(spans[i][0], dtype=torch.long)
+            pooled = pool_spans(sequence_output, bounds[..., 0], bounds[..., 1]).cpu().numpy()
+            sequence_output = sequence_output.cpu().numpy()
+            for b, i in enumerate(chunk):
+                ner_features[ner_offsets[i]:ner_offsets[i + 1]] = sequence_output[b, positions[i]]
+                span_features[span_offsets[i]:span_offsets[i + 1]] = pooled[b, :len(spans[i][0])]
+
+    ner_features.flush()
+    span_features.flush()
+    del ner_features, span_features
+    os.replace(ner_path + ".tmp", ner_path)
+    os.replace(span_path + ".tmp", span_path)
+    np.save(os.path.join(cache_dir, "ner_labels.npy"), ner_labels)
+    np.save(os.path.join(cache_dir, "relations.npy"), relations)
+    with open(os.path.join(cache_dir, "meta.json"), "w") as f:
+        json.dump({
+            "num_examples": len(examples),
+            "num_spans": int(span_offsets[-1]),
+            "hidden_size": hidden_size,
+            "num_ner_labels": model.num_ner_labels,
+            "num_re_labels": model.num_re_labels,
+            "fingerprint": examples_fingerprint(examples),
+            "encoder": encoder_fingerprint(model),
+        }, f)
+    size_mb = (os.path.getsize(ner_path) + os.path.getsize(span_path)) / 2 ** 20
+    print(f"Cached {len(ner_labels)} token rows, {int(span_offsets[-1])} span rows and {len(relations)} relations "
+          f"for {len(examples)} examples in {cache_dir} ({size_mb:.1f} MB)")
+
+
+def train_head(head, dropout, rows, num_rows, num_epochs=10, batch_size=1024, learning_rate=1e-3, device=None, seed=0, desc="Head"):
+    """Train one head on cached features; rows(indices) returns (inputs, labels) for sorted row indices."""
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    head.to(device)
+    head.train()
+    dropout.train()
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+    num_batches = -(-num_rows // batch_size)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=learning_rate)
+    scheduler = get_linear_schedule_with_warmup(optimizer, num_warmup_steps=0, num_training_steps=num_batches * num_epochs)
+
+    for epoch in range(num_epochs):
+        order = torch.randperm(num_rows, generator=generator).numpy()
+        total_loss = 0.0
+        for start in range(0, num_rows, batch_size):
+            # Sorted, so each batch reads the memmaps front to back
+            inputs, labels = rows(np.sort(order[start:start + batch_size]))
+            logits = head(*(dropout(x.to(device)) for x in inputs))
+            loss = F.cross_entropy(logits, labels.to(device))
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+            total_loss += loss.item()
+        print(f"{desc} epoch {epoch + 1}/{num_epochs}: loss {total_loss / max(num_batches, 1):.4f}")
+    return head
+
+
+def train_heads(model, cache, heads=("ner", "re"), **kwargs):
+    if "ner" in heads and len(cache.ner_labels):
+        train_head(ner_head(model), model.dropout, cache.ner_rows, len(cache.ner_labels), desc="NER head", **kwargs)
+    if "re" in heads and len(cache.relations):
+        train_head(model.re_classifier, model.dropout, cache.re_rows, len(cache.relations), desc="RE head", **kwargs)
+    return model
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the NER / RE heads from a cache of frozen encoder features")
+    parser.add_argument("--stage", choices=["cache", "train", "all"], default="all")
+    parser.add_argument("--model-dir", default="models/distilbert", help="Trained model whose encoder is frozen")
+    parser.add_argument("--data", default="preprocessed_re_data.pkl", help="The preprocessed pickle or a records.py .npz")
+    parser.add_argument("--cache-dir", default="feature_cache")
+    parser.add_argument("--output", default=None, help="Save the model with the trained heads here")
+    parser.add_argument("--heads", nargs="+", choices=["ner", "re"], default=["ner", "re"])
+    parser.add_argument("--dev-fraction", type=float, default=0.1)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=1024, help="Feature rows per head update")
+    parser.add_argument("--encode-batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--tiny", choices=["bert", "distilbert"], default=None, help="Tiny random-init model on synthetic data")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.tiny:
+        tokenizer = tiny_tokenizer()
+        label_to_id = {f"L{i}": i for i in range(5)}
+        relation_to_id = {f"R{i}": i for i in range(3)}
+        if args.tiny == "distilbert":
+            model = DistilBertForNERAndRE(tiny_distilbert_config(len(tokenizer)), len(label_to_id), len(relation_to_id))
+        else:
+            model = BertForNERAndRE(tiny_bert_config(len(tokenizer)), len(label_to_id), len(relation_to_id))
+        examples = tiny_examples(len(tokenizer), len(label_to_id), len(relation_to_id), count=256)
+        keys = [str(i) for i in range(len(examples))]
+        ignore_index = -100
+    else:
+        label_to_id, relation_to_id = load_label_maps(args.model_dir)
+        model = load_model(args.model_dir, len(label_to_id), len(relation_to_id), trainable=True)
+        tokenizer = load_tokenizer(args.model_dir)
+        # Same ignore index as DistiliBERT_train.py
+        ignore_index = max(label_to_id.values())
+        examples, keys = load_examples(args.data, tokenizer, label_to_id, relation_to_id, ignore_index)
+    # Only training examples are cached; the dev split is the one the training scripts hold out
+    train_indices, dev_indices = split_dataset(range(len(keys)), lambda i: keys[i], args.dev_fraction)
+    train_examples = [examples[i] for i in train_indices]
+    dev_examples = [examples[i] for i in dev_indices]
+
+    if args.stage in ("cache", "all"):
+        start = time.perf_counter()
+        build_feature_cache(model, train_examples, args.cache_dir, args.encode_batch_size, device, tokenizer.pad_token_id, ignore_index)
+        # A fine-tuning epoch runs this encoder pass plus a backward pass, every epoch
+        print(f"Encoder pass over {len(train_examples)} examples: {time.perf_counter() - start:.1f}s")
+
+    if args.stage in ("train", "all"):
+        cache = FeatureCache(args.cache_dir)
+        cache.check(model, train_examples)
+        start = time.perf_counter()
+        train_heads(model, cache, args.heads, num_epochs=args.epochs, batch_size=args.batch_size, learning_rate=args.learning_rate, device=device)
+        seconds = time.perf_counter() - start
+        print(f"Trained {', '.join(args.heads)} heads for {args.epochs} epochs in {seconds:.1f}s ({seconds / args.epochs:.2f}s per epoch)")
+
+        if dev_examples:
+            evaluator = Evaluator(
+                dev_examples,
+                {v: k for k, v in label_to_id.items()},
+                device=device,
+                pad_id=tokenizer.pad_token_id,
+                ignore_index=ignore_index,
+                re_negative=relation_to_id.get("no_relation"),
+            )
+            print(format_metrics(evaluator.evaluate(model)))
+
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            model.save_pretrained(args.output, safe_serialization=True)
+            tokenizer.save_pretrained(args.output)
+            with open(os.path.join(args.output, "label_to_id.json"), "w") as f:
+                json.dump(label_to_id, f)
+            with open(os.path.join(args.output, "relation_to_id.json"), "w") as f:
+                json.dump(relation_to_id, f)
+            print(f"Saved {args.output}")
@@ -0,0 +1,249 @@
+import os
+import re
+import time
+import bisect
+import tempfile
+import pickle
+import random
+import argparse
+from dict_store import EntityStore
+from schema import iter_documents
+
+# Dictionary NER. Many entities we run the encoder for are already in the
+# entity dictionary; the gazetteer finds them with a word trie compiled from the
+# store's entity names and annotated surface forms:
+#
+#   python gazetteer.py build --db entity_dict.sqlite --corpus test --output models/combined/gazetteer.pkl
+#   python gazetteer.py bench --gazetteer models/combined/gazetteer.pkl --corpus test
+#
+# Text and patterns are lowercased and split into words and punctuation, with
+# hyphens counted as spacing, so matching ignores case, spacing and hyphenation
+# ("IL-2 receptor", "il 2  receptor"). Matches never start or
+# end inside a word; overlapping candidates resolve to the leftmost, then
+# longest. Every match carries the share of the corpus annotations that agree
+# with it (1.0 unless the surface form is ambiguous).
+#
+# With --corpus the build also records the "plain" words: words seen outside
+# entity spans that are (almost) never part of one. A document whose matches
+# are all unambiguous and whose other words are all plain has no place left for
+# an entity the dictionary does not know, so callers can skip the model for it
+# (scan returns confident=True). inference.Predictor and predict.py load
+# gazetteer.pkl from the model directory and use it that way, falling back to
+# the model otherwise and adding the dictionary matches it missed.
+
+word_pattern = re.compile(r"\w+|[^\w\s-]")
+# Trie nodes are dicts keyed by word; words are never empty, so "" marks a match
+terminal = ""
+version = 1
+
+
+def words(text):
+    """(lowercased words, their (start, end) character spans) of a text."""
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        # A few characters change length when lowercased; keep offsets exact
+        matches = list(word_pattern.finditer(text))
+        return [m.group().lower() for m in matches], [m.span() for m in matches]
+    matches = list(word_pattern.finditer(lowered))
+    return [m.group() for m in matches], [m.span() for m in matches]
+
+
+def word_stats(json_dir, file_names=None):
+    """{word: [outside entity spans, inside entity spans]} counts over a corpus."""
+    counts = {}
+    for _, document in iter_documents(json_dir, file_names):
+        inside = bytearray(len(document.text))
+        for entity in document.entities:
+            if entity.has_span:
+                inside[entity.begin:entity.end] = b"\x01" * (entity.end - entity.begin)
+        for word, (start, _) in zip(*words(document.text)):
+            counts.setdefault(word, [0, 0])[inside[start]] += 1
+    return counts
+
+
+def plain_words(counts, max_entity_rate=0.01, min_count=2):
+    return frozenset(
+        word for word, (outside, inside) in counts.items()
+        if outside + inside >= min_count and inside <= max_entity_rate * (outside + inside)
+    )
+
+
+class Gazetteer:
+    def __init__(self, trie, plain=frozenset(), num_patterns=0):
+        self.trie = trie
+        self.plain = plain
+        self.num_patterns = num_patterns
+
+    @classmethod
+    def build(cls, patterns, plain=frozenset()):
+        """Compile (surface form, entity type, entity name, count) rows into a gazetteer.
+
+        Counts of the same normalized surface form are pooled, and the form
+        matches its most frequent (type, name). Single words that are plain
+        are left out: they are far more often not an entity.
+        """
+        candidates = {}
+        for surface, entity_type, entity_name, count in patterns:
+            key = tuple(words(surface)[0])
+            if not key or (len(key) == 1 and key[0] in plain):
+                continue
+            entry = candidates.setdefault(key, {})
+            entry[entity_type, entity_name] = entry.get((entity_type, entity_name), 0) + count
+
+        trie = {}
+        for key, entry in candidates.items():
+            node = trie
+            for word in key:
+                node = node.setdefault(word, {})
+            (entity_type, entity_name), count = max(entry.items(), key=lambda item: (item[1], item[0]))
+            node[terminal] = (entity_type, entity_name, count / sum(entry.values()))
+        return cls(trie, plain, len(candidates))
+
+    @classmethod
+    def from_store(cls, store, plain=frozenset()):
+        """Patterns from an EntityStore: annotated surface forms and canonical entity names."""
+        patterns = list(store.iter_mentions())
+        patterns += [(entity["name"], entity["type"], entity["name"], 1) for entity in store.iter_entities()]
+        return cls.build(patterns, plain)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"version": version, "trie": self.trie, "plain": self.plain, "num_patterns": self.num_patterns}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state.get("version") != version:
+            raise ValueError(f"{path} was written by another gazetteer version; rebuild it")
+        return cls(state["trie"], state["plain"], state["num_patterns"])
+
+    def scan(self, text, min_share=0.9):
+        """(entities, confident) for one text.
+
+        Entities are dicts like the model's (entityId, entityType, entityName,
+        start, end, score) plus resolvedName, with the annotation share as
+        score. confident is True when every match has a share of at least
+        min_share and every other word is plain.
+        """
+        tokens, spans = words(text)
+        trie, plain = self.trie, self.plain
+        confident = bool(plain)
+        entities = []
+        i, n = 0, len(tokens)
+        while i < n:
+            node = trie.get(tokens[i])
+            best = None
+            j = i
+            while node is not None:
+                j += 1
+                match = node.get(terminal)
+                if match is not None:
+                    best = (j, match)
+                node = node.get(tokens[j]) if j < n else None
+            if best is None:
+                if confident and tokens[i] not in plain:
+                    confident = False
+                i += 1
+                continue
+            j, (entity_type, entity_name, share) = best
+            start, end = spans[i][0], spans[j - 1][1]
+            entities.append({
+                "entityId": f"G{start}",
+                "entityType": entity_type,
+                "entityName": text[start:end],
+                "start": start,
+                "end": end,
+                "score": share,
+                "resolvedName": entity_name,
+            })
+            confident = confident and share >= min_share
+            i = j
+        return entities, confident
+
+
+def merge(entities, matches):
+    """Model entities plus the dictionary matches that overlap none of them, in text order."""
+    spans = sorted((entity["start"], entity["end"]) for entity in entities)
+    starts = [start for start, _ in spans]
+    merged = list(entities)
+    for match in matches:
+        # Model entities do not overlap each other, so only the last one
+        # starting before this match ends can overlap it
+        k = bisect.bisect_left(starts, match["end"]) - 1
+        overlaps = k >= 0 and spans[k][1] > match["start"]
+        if not overlaps:
+            merged.append(match)
+    merged.sort(key=lambda entity: entity["start"])
+    return merged
+
+
+def synthetic(num_entities=50000, num_texts=100, words_per_text=2000, seed=0):
+    """A gazetteer and long texts made of plain words and its entities, for benchmarking without a store."""
+    rng = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "su", "ta", "ri", "vo", "ex", "on", "al", "in"]
+    vocabulary = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(5000)]
+    names = {" ".join(rng.choice(vocabulary) + str(rng.randrange(100)) for _ in range(rng.randint(1, 3))): rng.choice(["Gene", "Chemical", "Disease"])
+             for _ in range(num_entities)}
+    gazetteer = Gazetteer.build(((name, entity_type, name, 1) for name, entity_type in names.items()), frozenset(vocabulary))
+    names = list(names)
+    texts = [" ".join(rng.choice(names) if rng.random() < 0.05 else rng.choice(vocabulary) for _ in range(words_per_text)) for _ in range(num_texts)]
+    # Every 10th text mentions something the dictionary does not know
+    for i in range(0, num_texts, 10):
+        texts[i] += " unknownase7"
+    return gazetteer, texts
+
+
+def throughput(gazetteer, texts, repeat=3):
+    best, num_matches = float("inf"), 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_matches = sum(len(gazetteer.scan(text)[0]) for text in texts)
+        best = min(best, time.perf_counter() - start)
+    return best, num_matches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or benchmark the dictionary NER gazetteer")
+    parser.add_argument("command", choices=["build", "bench"])
+    parser.add_argument("--db", default="entity_dict.sqlite", help="Entity store built by dict_gen.py")
+    parser.add_argument("--corpus", default=None, help="JSON documents for the plain word list (build) or to scan (bench)")
+    parser.add_argument("--output", default="gazetteer.pkl")
+    parser.add_argument("--gazetteer", default=None, help="Serialized gazetteer to benchmark (default: synthetic)")
+    parser.add_argument("--max-entity-rate", type=float, default=0.01, help="Plain words are inside entity spans at most this often")
+    parser.add_argument("--min-share", type=float, default=0.9)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        plain = plain_words(word_stats(args.corpus), args.max_entity_rate) if args.corpus else frozenset()
+        with EntityStore(args.db) as store:
+            gazetteer = Gazetteer.from_store(store, plain)
+        gazetteer.save(args.output)
+        print(f"{gazetteer.num_patterns} patterns, {len(plain)} plain words -> {args.output} ({time.perf_counter() - start:.1f}s)")
+    else:
+        if args.gazetteer:
+            start = time.perf_counter()
+            gazetteer = Gazetteer.load(args.gazetteer)
+            print(f"Loaded {gazetteer.num_patterns} patterns in {time.perf_counter() - start:.2f}s")
+            texts = [document.text for _, document in iter_documents(args.corpus)] if args.corpus else []
+        else:
+            start = time.perf_counter()
+            gazetteer, texts = synthetic()
+            print(f"Built synthetic gazetteer: {gazetteer.num_patterns} patterns in {time.perf_counter() - start:.2f}s")
+            path = os.path.join(tempfile.mkdtemp(), "gazetteer.pkl")
+            gazetteer.save(path)
+            start = time.perf_counter()
+            gazetteer = Gazetteer.load(path)
+            print(f"Loaded it back in {time.perf_counter() - start:.2f}s ({os.path.getsize(path) / 2 ** 20:.1f} MB)")
+            os.remove(path)
+
+        if texts:
+            seconds, num_matches = throughput(gazetteer, texts)
+            megabytes = sum(len(text) for text in texts) / 2 ** 20
+            print(f"{num_matches} matches in {megabytes:.1f} MB: {num_matches / seconds:.0f} matches/s, "
+                  f"{megabytes / seconds:.1f} MB/s over {len(texts)} texts")
+            confident = sum(gazetteer.scan(text, args.min_share)[1] for text in texts)
+            print(f"Confident (model skipped) for {confident}/{len(texts)} texts")
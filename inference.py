@@ -0,0 +1,272 @@
+import os
+import json
+import string
+import tempfile
+from contextlib import nullcontext
+import torch
+from transformers import BertConfig, BertTokenizerFast, DistilBertConfig
+from models import BertForNERAndRE
+from dict_store import EntityStore
+from gazetteer import Gazetteer, merge
+from weights import load_model
+from decoding import label_maps, continuation_mask, decode_spans, spans_to_entities
+
+# Batched NER + RE inference around BertForNERAndRE, shared by the HTTP server
+# and the other serving entry points. predict.py keeps the one-text-at-a-time API.
+
+
+def tiny_tokenizer():
+    """A character-level WordPiece tokenizer that needs no download."""
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    chars = string.ascii_lowercase + string.digits + string.punctuation
+    vocab += list(chars) + [f"##{c}" for c in chars]
+    vocab_dir = tempfile.mkdtemp(prefix="tiny_tokenizer_")
+    with open(os.path.join(vocab_dir, "vocab.txt"), "w") as f:
+        f.write("\n".join(vocab))
+    return BertTokenizerFast(os.path.join(vocab_dir, "vocab.txt"))
+
+
+def tiny_bert_config(vocab_size, max_length=128):
+    return BertConfig(
+        vocab_size=vocab_size,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=max_length,
+    )
+
+
+def tiny_distilbert_config(vocab_size, max_length=128):
+    return DistilBertConfig(
+        vocab_size=vocab_size,
+        dim=32,
+        n_layers=1,
+        n_heads=2,
+        hidden_dim=64,
+        max_position_embeddings=max_length,
+    )
+
+
+class Predictor:
+    def __init__(self, model, tokenizer, id_to_label, id_to_relation, max_length=512, device=None, entity_store=None, memory_budget=None, gazetteer=None, min_share=0.9):
+        self.device = device if device is not None else next(model.parameters()).device
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.tokenizer = tokenizer
+        self.id_to_label = id_to_label
+        self.id_to_relation = id_to_relation
+        self.max_length = max_length
+        self.entity_store = entity_store
+        # Optional memory.MemoryBudget: over-budget batches are split or truncated
+        self.memory_budget = memory_budget
+        # Optional gazetteer.Gazetteer: texts it is confident about skip the model,
+        # and its matches fill in entities the model misses elsewhere
+        self.gazetteer = gazetteer
+        self.min_share = min_share
+        self.types, self.begins, self.type_names = label_maps(id_to_label)
+        # Only B-/I- labels (with "O") carry an entity scheme; preprocess.py's labels are entity texts
+        self.label_scheme = getattr(model.config, "label_scheme", "entity") if "O" in id_to_label.values() else None
+        self.types, self.begins = self.types.to(self.device), self.begins.to(self.device)
+        self.continuation = continuation_mask(tokenizer)
+
+    @classmethod
+    def from_pretrained(cls, model_dir="models/combined", device=None, max_length=512):
+        with open(os.path.join(model_dir, "label_to_id.json"), "r") as f:
+            label_to_id = json.load(f)
+        with open(os.path.join(model_dir, "relation_to_id.json"), "r") as f:
+            relation_to_id = json.load(f)
+
+        # Weights are memory-mapped, so processes serving the same model share them
+        model = load_model(model_dir, len(label_to_id), len(relation_to_id))
+        tokenizer = BertTokenizerFast.from_pretrained(model_dir)
+
+        entity_store = None
+        store_path = os.path.join(model_dir, "entity_dict.sqlite")
+        if getattr(model.config, "label_scheme", "entity") == "type" and os.path.exists(store_path):
+            entity_store = EntityStore(store_path)
+        gazetteer_path = os.path.join(model_dir, "gazetteer.pkl")
+        gazetteer = Gazetteer.load(gazetteer_path) if os.path.exists(gazetteer_path) else None
+
+        return cls(
+            model,
+            tokenizer,
+            {v: k for k, v in label_to_id.items()},
+            {v: k for k, v in relation_to_id.items()},
+            max_length=max_length,
+            device=device,
+            entity_store=entity_store,
+            gazetteer=gazetteer,
+        )
+
+    @classmethod
+    def tiny(cls, entity_types=("Gene", "Chemical", "Disease"), relations=("no_relation", "binds", "inhibits"), seed=0, max_length=128):
+        """A small random-init predictor with a character vocabulary, for local testing without downloads."""
+        torch.manual_seed(seed)
+        tokenizer = tiny_tokenizer()
+
+        labels = ["O"] + [f"{prefix}-{t}" for t in entity_types for prefix in ("B", "I")]
+        config = tiny_bert_config(len(tokenizer), max_length)
+        config.label_scheme = "type"
+        model = BertForNERAndRE(config, len(labels), len(relations))
+
+        return cls(
+            model,
+            tokenizer,
+            dict(enumerate(labels)),
+            dict(enumerate(relations)),
+            max_length=max_length,
+            device=torch.device("cpu"),
+        )
+
+    def encode(self, texts, max_length=None):
+        # Pad to the longest text in the batch, not to max_length
+        return self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=max_length or self.max_length,
+            return_offsets_mapping=True,
+            return_tensors="pt",
+        )
+
+    def decode_entities(self, texts, input_ids, labels, scores, offsets, confidence_threshold=0.0):
+        """Entities of a whole batch; subword pieces take the label of their word's first piece."""
+        carry = self.continuation[input_ids.clamp(max=len(self.continuation) - 1)].to(labels.device)
+        spans = decode_spans(labels, scores, offsets.to(labels.device), self.types, self.begins, carry=carry, threshold=confidence_threshold)
+        entities = spans_to_entities(spans, self.type_names, texts, self.label_scheme)
+        if self.entity_store is not None:
+            for entity in (entity for row in entities for entity in row):
+                entity["resolvedName"] = self.entity_store.resolve_mention(entity["entityName"], entity["entityType"])
+        return entities
+
+    def add_matches(self, entities, matches, offsets):
+        """Merge dictionary matches into one row's entities; matches get the token RE scores them at."""
+        if not matches:
+            return entities
+        # The first token that ends after the match starts; matches past the
+        # truncated encoding are left out
+        starts = torch.tensor([match["start"] for match in matches], dtype=torch.long)
+        real = offsets[:, 0] != offsets[:, 1]
+        hits = real[None, :] & (offsets[None, :, 1] > starts[:, None])
+        tokens = hits.float().argmax(dim=1).tolist()
+        kept = [dict(match, token=token) for match, token, hit in zip(matches, tokens, hits.any(dim=1).tolist()) if hit]
+        return merge(entities, kept)
+
+    def dictionary_relations(self, entities):
+        """Relations the entity store records between the resolved entities of a text."""
+        ids = [
+            [row["entityId"] for row in self.entity_store.find_by_name(entity["resolvedName"], entity["entityType"])]
+            for entity in entities
+        ]
+        relations = []
+        for i, subject in enumerate(entities):
+            for j, obj in enumerate(entities):
+                if i == j:
+                    continue
+                rel_names = {rel_name for s in ids[i] for o in ids[j] for rel_name in self.entity_store.relations(s, o)}
+                for rel_name in sorted(rel_names):
+                    relations.append({
+                        "subjectId": subject["entityId"],
+                        "objectId": obj["entityId"],
+                        "subjectName": subject["entityName"],
+                        "objectName": obj["entityName"],
+                        "relationName": rel_name,
+                        "score": min(subject["score"], obj["score"]),
+                    })
+        return relations
+
+    def predict_batch(self, texts, confidence_threshold=0.0):
+        """Run NER and RE for a list of texts with a single encoder pass.
+
+        With a gazetteer, texts it is confident about are answered from the
+        dictionary alone: its matches, and the relations the entity store
+        records between them (without a store, only texts with fewer than two
+        matches). The other texts go through the model, with the dictionary
+        matches it missed added before RE.
+        """
+        if self.gazetteer is None:
+            return self.predict_model(texts, confidence_threshold)
+
+        results, remaining, remaining_matches = [None] * len(texts), [], []
+        for i, text in enumerate(texts):
+            matches, confident = self.gazetteer.scan(text, self.min_share)
+            if confident and (len(matches) < 2 or self.entity_store is not None):
+                relations = self.dictionary_relations(matches) if len(matches) > 1 else []
+                results[i] = {"entities": matches, "relations": relations}
+            else:
+                remaining.append(i)
+                remaining_matches.append(matches)
+        model_results = self.predict_model([texts[i] for i in remaining], confidence_threshold, remaining_matches)
+        for i, result in zip(remaining, model_results):
+            results[i] = result
+        return results
+
+    def predict_model(self, texts, confidence_threshold=0.0, matches=None):
+        """predict_batch through the model; matches are per-text dictionary matches to merge in."""
+        if not texts:
+            return []
+
+        encoding = self.encode(texts)
+        if self.memory_budget is not None:
+            micro_batch, max_length = self.memory_budget.plan(*encoding["input_ids"].shape)
+            if micro_batch < len(texts):
+                return [
+                    result
+                    for start in range(0, len(texts), micro_batch)
+                    for result in self.predict_model(
+                        texts[start:start + micro_batch], confidence_threshold,
+                        None if matches is None else matches[start:start + micro_batch],
+                    )
+                ]
+            if max_length < encoding["input_ids"].size(1):
+                encoding = self.encode(texts, max_length)
+        offsets = encoding.pop("offset_mapping")
+        inputs = {k: v.to(self.device) for k, v in encoding.items()}
+
+        measure = self.memory_budget.measure(*inputs["input_ids"].shape, device=self.device) if self.memory_budget is not None else nullcontext()
+        with torch.inference_mode():
+            with measure:
+                outputs = self.model(**inputs)
+            probs = torch.softmax(outputs["ner_logits"].float(), dim=-1)
+            scores, labels = probs.max(dim=-1)
+            batch_entities = self.decode_entities(texts, encoding["input_ids"], labels, scores, offsets, confidence_threshold)
+            if matches is not None:
+                batch_entities = [self.add_matches(entities, row_matches, offsets[b]) for b, (entities, row_matches) in enumerate(zip(batch_entities, matches))]
+
+            results = []
+            pair_batch, pair_subject, pair_object = [], [], []
+            for b, entities in enumerate(batch_entities):
+                results.append({"entities": entities, "relations": []})
+                for subject in entities:
+                    for obj in entities:
+                        if subject is not obj:
+                            pair_batch.append(b)
+                            pair_subject.append(subject)
+                            pair_object.append(obj)
+
+            # Score every candidate pair of the batch in one bilinear call
+            if pair_batch:
+                sequence_output = outputs["sequence_output"]
+                batch_idx = torch.tensor(pair_batch, device=self.device)
+                subject_idx = torch.tensor([e["token"] for e in pair_subject], device=self.device)
+                object_idx = torch.tensor([e["token"] for e in pair_object], device=self.device)
+                re_logits = self.model.re_classifier(
+                    sequence_output[batch_idx, subject_idx], sequence_output[batch_idx, object_idx]
+                )
+                re_scores, re_labels = torch.softmax(re_logits.float(), dim=-1).max(dim=-1)
+
+                for b, subject, obj, label_id, score in zip(pair_batch, pair_subject, pair_object, re_labels.tolist(), re_scores.tolist()):
+                    results[b]["relations"].append({
+                        "subjectId": subject["entityId"],
+                        "objectId": obj["entityId"],
+                        "subjectName": subject["entityName"],
+                        "objectName": obj["entityName"],
+                        "relationName": self.id_to_relation.get(label_id, "UNKNOWN"),
+                        "score": score,
+                    })
+
+        for result in results:
+            for entity in result["entities"]:
+                del entity["token"]
+        return results
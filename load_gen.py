@@ -0,0 +1,115 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# Load generator for serve.py: keeps `concurrency` keep-alive connections busy
+# with POST /predict requests and reports throughput and latency percentiles.
+
+sample_texts = [
+    "Over-expression of HO-1 on mesenchymal stem cells promotes angiogenesis and improves myocardial function in infarcted myocardium.",
+    "Heme oxygenase-1 (HO-1) is a stress-inducible enzyme with diverse cytoprotective effects.",
+    "Aspirin inhibits cyclooxygenase and reduces the risk of myocardial infarction.",
+    "TNF-alpha induces IL-6 expression in fibroblasts.",
+]
+
+
+async def request(reader, writer, host, body):
+    writer.write(
+        (
+            f"POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n"
+        ).encode("latin-1")
+        + body
+    )
+    await writer.drain()
+
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value.strip())
+    await reader.readexactly(length)
+    return status
+
+
+async def client(host, port, texts, num_requests, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for _ in range(num_requests):
+            body = json.dumps({"text": random.choice(texts)}).encode("utf-8")
+            start = time.perf_counter()
+            status = await request(reader, writer, host, body)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def wait_ready(host, port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET /readyz HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            if status_line and int(status_line.split()[1]) == 200:
+                return True
+        except (ConnectionError, OSError):
+            pass
+        await asyncio.sleep(0.2)
+    return False
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100.0 * len(values)))]
+
+
+async def main(args):
+    texts = sample_texts
+    if args.texts:
+        with open(args.texts, "r") as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    if not await wait_ready(args.host, args.port, args.ready_timeout):
+        raise SystemExit(f"Server at {args.host}:{args.port} did not become ready")
+
+    latencies, errors = [], []
+    per_client = [args.requests // args.concurrency] * args.concurrency
+    for i in range(args.requests % args.concurrency):
+        per_client[i] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args.host, args.port, texts, n, latencies, errors) for n in per_client if n > 0))
+    elapsed = time.perf_counter() - start
+
+    print(f"Requests: {len(latencies)}  errors: {len(errors)}  concurrency: {args.concurrency}")
+    print(f"Throughput: {len(latencies) / elapsed:.1f} req/s over {elapsed:.2f}s")
+    print(
+        "Latency ms: "
+        f"p50 {percentile(latencies, 50) * 1000:.1f}  "
+        f"p95 {percentile(latencies, 95) * 1000:.1f}  "
+        f"p99 {percentile(latencies, 99) * 1000:.1f}  "
+        f"max {max(latencies) * 1000:.1f}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate load against serve.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--texts", help="File with one text per line (default: built-in samples)")
+    parser.add_argument("--ready-timeout", type=float, default=60.0)
+    asyncio.run(main(parser.parse_args()))
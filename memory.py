@@ -0,0 +1,265 @@
+import json
+import heapq
+import resource
+from contextlib import contextmanager
+import torch
+
+# Memory accounting for training and inference.
+#
+# MemoryTracker hooks the top-level modules of a model and reports, per step,
+# peak RSS, the tensor bytes each stage produced (on CUDA: the allocator peak
+# while the stage ran) and the largest tensors allocated, including the model
+# outputs such as the NER logits.
+#
+# MemoryBudget estimates the activation memory of a batch before it runs and
+# plans around the budget: first split the batch into smaller micro-batches, then
+# shrink the sequence length. With report_only=True it only warns, which is the
+# useful mode on CPU where an over-budget batch swaps instead of failing. On
+# CUDA, wrapping each step in measure() feeds the allocator peak back through
+# observe(), so an estimate that turns out low is scaled up to what was measured.
+
+
+# Batch keys holding one value per token, cut when the sequence length is shrunk
+token_keys = ("input_ids", "attention_mask", "token_type_ids", "ner_labels", "position_ids")
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _tensors(obj, prefix):
+    if torch.is_tensor(obj):
+        yield prefix, obj
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            yield from _tensors(value, f"{prefix}.{key}")
+    elif isinstance(obj, (list, tuple)):
+        for i, value in enumerate(obj):
+            yield from _tensors(value, f"{prefix}.{i}")
+
+
+def tensor_bytes(tensor):
+    return tensor.numel() * tensor.element_size()
+
+
+class MemoryTracker:
+    def __init__(self, model, enabled=True, top_k=5):
+        self.enabled = enabled
+        self.top_k = top_k
+        self.cuda = torch.cuda.is_available() and next(model.parameters()).is_cuda
+        self.rows = []
+        self.stage_bytes = {}
+        self.largest = []
+        self.stage_base = {}
+        # The step's CUDA peak, folded in before every per-stage reset of the allocator's peak
+        self.peak = 0
+        self.handles = []
+        if not enabled:
+            return
+
+        for name, module in model.named_children():
+            self.handles.append(module.register_forward_pre_hook(self._pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self._hook(name)))
+        # The outputs of the model itself: logits allocated in forward() outside any submodule
+        self.handles.append(model.register_forward_hook(self._hook("output", stage=False)))
+
+    def _pre_hook(self, name):
+        def hook(module, inputs):
+            if self.cuda:
+                self._reset_peak()
+                self.stage_base[name] = torch.cuda.memory_allocated()
+        return hook
+
+    def _reset_peak(self):
+        self.peak = max(self.peak, torch.cuda.max_memory_allocated())
+        torch.cuda.reset_peak_memory_stats()
+
+    def max_memory_allocated(self):
+        """The CUDA peak since the step began, which the per-stage resets would otherwise hide."""
+        return max(self.peak, torch.cuda.max_memory_allocated())
+
+    def _hook(self, name, stage=True):
+        def hook(module, inputs, outputs):
+            produced = 0
+            for tensor_name, tensor in _tensors(outputs, name):
+                size = tensor_bytes(tensor)
+                produced += size
+                self._keep_largest(size, tensor_name, tuple(tensor.shape))
+            if not stage:
+                return
+            if self.cuda:
+                produced = torch.cuda.max_memory_allocated() - self.stage_base.get(name, 0)
+            self.stage_bytes[name] = max(self.stage_bytes.get(name, 0), produced)
+        return hook
+
+    def _keep_largest(self, size, name, shape):
+        entry = (size, name, shape)
+        if len(self.largest) < self.top_k:
+            heapq.heappush(self.largest, entry)
+        elif size > self.largest[0][0]:
+            heapq.heapreplace(self.largest, entry)
+
+    @contextmanager
+    def step(self, step=None):
+        if not self.enabled:
+            yield
+            return
+        self.stage_bytes = {}
+        self.largest = []
+        if self.cuda:
+            torch.cuda.reset_peak_memory_stats()
+            self.peak = 0
+        try:
+            yield
+        finally:
+            row = {
+                "step": len(self.rows) if step is None else step,
+                "rss_mb": rss_mb(),
+                "peak_rss_mb": peak_rss_mb(),
+                "stage_mb": {name: size / 2 ** 20 for name, size in self.stage_bytes.items()},
+                "largest": [{"name": name, "shape": list(shape), "mb": size / 2 ** 20} for size, name, shape in sorted(self.largest, reverse=True)],
+            }
+            if self.cuda:
+                row["cuda_peak_mb"] = self.max_memory_allocated() / 2 ** 20
+            self.rows.append(row)
+
+    def last(self):
+        return self.rows[-1] if self.rows else None
+
+    def format(self, row=None):
+        row = row or self.last()
+        if row is None:
+            return ""
+        lines = [f"step {row['step']}: rss {row['rss_mb']:.0f} MB, peak rss {row['peak_rss_mb']:.0f} MB"
+                 + (f", cuda peak {row['cuda_peak_mb']:.0f} MB" if "cuda_peak_mb" in row else "")]
+        for name, mb in sorted(row["stage_mb"].items(), key=lambda item: -item[1]):
+            lines.append(f"  stage {name:20s} {mb:10.2f} MB")
+        for entry in row["largest"]:
+            lines.append(f"  tensor {entry['name']:30s} {str(entry['shape']):24s} {entry['mb']:10.2f} MB")
+        return "\n".join(lines)
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.rows, f, indent=2)
+        print(f"Wrote memory report for {len(self.rows)} steps to {path}")
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+class MemoryBudget:
+    def __init__(self, budget_mb, config, num_ner_labels, num_re_labels=0, training=True, dtype_bytes=4, report_only=False, min_length=32):
+        self.budget_bytes = budget_mb * 2 ** 20
+        self.hidden_size = config.hidden_size
+        self.num_heads = getattr(config, "num_attention_heads", None) or config.n_heads
+        self.num_layers = getattr(config, "num_hidden_layers", None) or config.n_layers
+        self.intermediate_size = getattr(config, "intermediate_size", None) or config.hidden_dim
+        self.num_ner_labels = num_ner_labels
+        self.num_re_labels = num_re_labels
+        self.training = training
+        self.dtype_bytes = dtype_bytes
+        self.report_only = report_only
+        self.min_length = min_length
+        # Corrected from measured peaks by observe()
+        self.scale = 1.0
+        self.warned = set()
+
+    def estimate(self, batch_size, seq_len, num_pairs=0):
+        """Approximate activation bytes of one forward (and backward when training) pass."""
+        tokens = batch_size * seq_len
+        # Per layer: q/k/v/context/output projections, the FFN's intermediate
+        # activations and the attention score and probability matrices
+        per_layer = tokens * (6 * self.hidden_size + 2 * self.intermediate_size) + 2 * batch_size * self.num_heads * seq_len * seq_len
+        # Training keeps every layer's activations for backward; inference only a couple at a time
+        layers = self.num_layers if self.training else min(2, self.num_layers)
+        elements = layers * per_layer + tokens * (self.hidden_size + self.num_ner_labels)
+        # Pooled subject / object states and the relation logits of every pair
+        elements += batch_size * num_pairs * (2 * self.hidden_size + self.num_re_labels)
+        return int(elements * self.dtype_bytes * self.scale)
+
+    def observe(self, batch_size, seq_len, peak_bytes, num_pairs=0):
+        """Calibrate the estimate against a measured peak (e.g. CUDA max_memory_allocated)."""
+        estimate = self.estimate(batch_size, seq_len, num_pairs) / self.scale
+        if estimate > 0:
+            self.scale = max(self.scale, peak_bytes / estimate)
+
+    @contextmanager
+    def measure(self, batch_size, seq_len, num_pairs=0, device=None, tracker=None):
+        """observe() the CUDA allocator peak of the wrapped step; does nothing on CPU or when the step fails.
+
+        Pass the MemoryTracker when one is enabled: its hooks reset the allocator's
+        peak before every stage, so the step's peak is read from the tracker.
+        """
+        device = torch.device(device) if device is not None else None
+        if device is None or device.type != "cuda":
+            yield
+            return
+        base = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        if tracker is not None and tracker.enabled:
+            tracker.peak = 0
+        yield
+        if tracker is not None and tracker.enabled:
+            peak = tracker.max_memory_allocated()
+        else:
+            peak = torch.cuda.max_memory_allocated(device)
+        self.observe(batch_size, seq_len, peak - base, num_pairs)
+
+    def plan(self, batch_size, seq_len, num_pairs=0):
+        """Return (micro_batch_size, max_length) that fit the budget."""
+        if self.estimate(batch_size, seq_len, num_pairs) <= self.budget_bytes:
+            return batch_size, seq_len
+        if self.report_only:
+            key = (batch_size, seq_len, num_pairs)
+            if key not in self.warned:
+                self.warned.add(key)
+                print(f"Memory budget: batch {batch_size}x{seq_len} needs ~{self.estimate(batch_size, seq_len, num_pairs) / 2 ** 20:.0f} MB, "
+                      f"over the {self.budget_bytes / 2 ** 20:.0f} MB budget")
+            return batch_size, seq_len
+
+        micro_batch = batch_size
+        while micro_batch > 1 and self.estimate(micro_batch, seq_len, num_pairs) > self.budget_bytes:
+            micro_batch = (micro_batch + 1) // 2
+        max_length = seq_len
+        while max_length > self.min_length and self.estimate(micro_batch, max_length, num_pairs) > self.budget_bytes:
+            max_length = max(self.min_length, max_length * 3 // 4)
+        if max_length < seq_len and (seq_len, max_length) not in self.warned:
+            self.warned.add((seq_len, max_length))
+            print(f"Memory budget: truncating sequences from {seq_len} to {max_length} tokens")
+        return micro_batch, max_length
+
+    def split(self, batch, seq_keys=token_keys, num_pairs=0):
+        """Split a collated batch dict into micro-batches (and truncate) to fit the budget."""
+        batch_size, seq_len = batch[seq_keys[0]].shape[:2]
+        micro_batch, max_length = self.plan(batch_size, seq_len, num_pairs)
+        if max_length < seq_len:
+            batch = truncate_batch(batch, max_length, seq_keys)
+        if micro_batch >= batch_size:
+            return [batch]
+        return [slice_batch(batch, start, start + micro_batch) for start in range(0, batch_size, micro_batch)]
+
+
+def slice_batch(batch, start, end):
+    return {key: value[start:end] if value is not None else None for key, value in batch.items()}
+
+
+def truncate_batch(batch, max_length, seq_keys=token_keys):
+    """Cut the per-token tensors of a batch to max_length tokens ([B, S, S] block masks in both dimensions)."""
+    cut = {}
+    for key, value in batch.items():
+        if key in seq_keys and value is not None:
+            value = value[:, :max_length, :max_length] if value.dim() == 3 else value[:, :max_length]
+        cut[key] = value
+    return cut
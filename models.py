@@ -0,0 +1,282 @@
+import functools
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
+from transformers import BertModel, BertPreTrainedModel, DistilBertModel, DistilBertPreTrainedModel
+
+
+def _checkpointed_forward(layer, *args, **kwargs):
+    # Only recompute when there is a backward pass to recompute for
+    if layer.training and torch.is_grad_enabled():
+        return checkpoint(layer._plain_forward, *args, use_reentrant=False, **kwargs)
+    return layer._plain_forward(*args, **kwargs)
+
+
+def set_activation_checkpointing(layers, every=1):
+    """Recompute the activations of every `every`-th layer during backward instead of storing them.
+
+    every=1 checkpoints all layers, 2 every other layer, ...; 0 turns it off.
+    Storing fewer layers trades one extra forward per checkpointed layer for
+    activation memory that no longer grows with the number of layers.
+    """
+    for i, layer in enumerate(layers):
+        if "_plain_forward" in layer.__dict__:
+            # Back to the class's forward
+            del layer.forward
+            del layer._plain_forward
+        if every and i % every == 0:
+            layer._plain_forward = layer.forward
+            layer.forward = functools.partial(_checkpointed_forward, layer)
+
+
+def pool_spans(sequence_output, starts, ends):
+    """Mean of sequence_output[b, starts[b, r]:ends[b, r] + 1] for every (b, r), as one batched matmul."""
+    positions = torch.arange(sequence_output.size(1), device=sequence_output.device)
+    starts, ends = starts.to(positions.device), ends.to(positions.device)
+    weights = ((positions >= starts.unsqueeze(-1)) & (positions <= ends.unsqueeze(-1))).to(sequence_output.dtype)
+    weights = weights / weights.sum(dim=-1, keepdim=True).clamp(min=1)
+    return torch.bmm(weights, sequence_output)
+
+
+def span_re_logits(re_classifier, sequence_output, re_spans):
+    """[B, R, num_re_labels] relation logits from mean-pooled subject / object spans.
+
+    re_spans is [B, R, 4]: subject start, subject end, object start, object end.
+    """
+    subject = pool_spans(sequence_output, re_spans[..., 0], re_spans[..., 1])
+    obj = pool_spans(sequence_output, re_spans[..., 2], re_spans[..., 3])
+    return re_classifier(subject.contiguous(), obj.contiguous())
+
+
+def _re_data_to_spans(re_data, device=None):
+    # Lists of relation dicts, one list per row, as a zero-padded [B, R, 4] tensor
+    max_relations = max((len(relations) for relations in re_data), default=0)
+    re_spans = torch.zeros((len(re_data), max_relations, 4), dtype=torch.long)
+    for b, relations in enumerate(re_data):
+        for r, rel in enumerate(relations):
+            re_spans[b, r] = torch.tensor([rel["subject_start_idx"], rel["subject_end_idx"], rel["object_start_idx"], rel["object_end_idx"]])
+    return re_spans.to(device)
+
+
+def _packed_distilbert_layer(layer, x, attention_mask):
+    # TransformerBlock.forward with a [B, 1, S, S] boolean attention mask, which
+    # DistilBERT's own attention (key padding masks only) cannot take
+    attention = layer.attention
+    batch_size, seq_len, _ = x.shape
+    heads, head_size = attention.n_heads, attention.attention_head_size
+
+    def split_heads(t):
+        return t.view(batch_size, seq_len, heads, head_size).transpose(1, 2)
+
+    context = F.scaled_dot_product_attention(
+        split_heads(attention.q_lin(x)),
+        split_heads(attention.k_lin(x)),
+        split_heads(attention.v_lin(x)),
+        attn_mask=attention_mask,
+        dropout_p=attention.dropout.p if layer.training else 0.0,
+    )
+    context = context.transpose(1, 2).reshape(batch_size, seq_len, heads * head_size)
+    sa_output = layer.sa_layer_norm(attention.out_lin(context) + x)
+    return layer.output_layer_norm(layer.ffn(sa_output) + sa_output)
+
+
+class BertForNERAndRE(BertPreTrainedModel):
+    def __init__(self, config, num_ner_labels, num_re_labels):
+        super().__init__(config)
+
+        self.num_ner_labels = num_ner_labels
+        self.num_re_labels = num_re_labels
+
+        self.bert = BertModel(config)
+        self.dropout = nn.Dropout(config.hidden_dropout_prob)
+        
+        self.classifier = nn.Linear(config.hidden_size, self.num_ner_labels)
+
+        # Define the bilinear layer for RE classification
+        self.re_classifier = nn.Bilinear(config.hidden_size, config.hidden_size, self.num_re_labels)
+
+        self.init_weights()
+        self.set_activation_checkpointing(getattr(config, "activation_checkpointing", 0))
+
+    def set_activation_checkpointing(self, every=1):
+        self.config.activation_checkpointing = every
+        set_activation_checkpointing(self.bert.encoder.layer, every)
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        token_type_ids=None,
+        position_ids=None,
+        head_mask=None,
+        inputs_embeds=None,
+        ner_labels=None,
+        re_labels=None,
+        re_indices=None,
+    ):
+        outputs = self.bert(
+            input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+            position_ids=position_ids,
+            head_mask=head_mask,
+            inputs_embeds=inputs_embeds,
+        )
+
+        sequence_output = outputs[0]
+        sequence_output = self.dropout(sequence_output)
+        ner_logits = self.classifier(sequence_output)
+
+        if ner_labels is not None:
+            # [CLS], [SEP], padding and subword pieces are labelled -100
+            loss_fct = nn.CrossEntropyLoss(ignore_index=-100)
+            active_loss = attention_mask.view(-1) == 1
+            active_logits = ner_logits.view(-1, self.num_ner_labels)[active_loss]  # Use self.num_ner_labels instead of self.num_labels
+            active_labels = ner_labels.view(-1)[active_loss]
+            ner_loss = loss_fct(active_logits, active_labels)
+        else:
+            ner_loss = None
+
+        if re_indices is not None and re_indices.size(1) > 0:
+            # re_indices is [B, R, 2] subject / object token positions, -1 for padding;
+            # [B, R, num_re_labels] logits, the padding masked by re_labels == -1
+            re_logits = span_re_logits(self.re_classifier, sequence_output, re_indices[..., [0, 0, 1, 1]].clamp(min=0))
+        else:
+            re_logits = None  # Set re_logits to None if re_indices is None or empty
+
+        return {'ner_logits': ner_logits, 're_logits': re_logits, 'ner_loss': ner_loss, 'sequence_output': sequence_output}
+
+
+class DistilBertForNERAndRE(DistilBertPreTrainedModel):
+    def __init__(self, config, num_ner_labels, num_re_labels, ner_ignore_index=-100):
+        super().__init__(config)
+
+        self.num_ner_labels = num_ner_labels
+        self.num_re_labels = num_re_labels
+        self.ner_ignore_index = ner_ignore_index
+
+        self.distilbert = DistilBertModel(config)
+        self.dropout = nn.Dropout(config.dropout)
+        
+        self.ner_classifier = nn.Linear(config.hidden_size, self.num_ner_labels)
+
+        self.subject_start_classifier = nn.Linear(config.hidden_size, 1)
+        self.subject_end_classifier = nn.Linear(config.hidden_size, 1)
+        self.object_start_classifier = nn.Linear(config.hidden_size, 1)
+        self.object_end_classifier = nn.Linear(config.hidden_size, 1)
+
+        self.re_classifier = nn.Bilinear(config.hidden_size, config.hidden_size, self.num_re_labels)
+
+        self.init_weights()
+        self.set_activation_checkpointing(getattr(config, "activation_checkpointing", 0))
+
+    def set_activation_checkpointing(self, every=1):
+        self.config.activation_checkpointing = every
+        set_activation_checkpointing(self.distilbert.transformer.layer, every)
+
+    def packed_encoder(self, input_ids, attention_mask, position_ids=None):
+        """Encode packed sequences: attention_mask is [B, S, S] and position_ids restart per example."""
+        embeddings = self.distilbert.embeddings
+        if position_ids is None:
+            position_ids = torch.arange(input_ids.size(1), device=input_ids.device).unsqueeze(0).expand_as(input_ids)
+        x = embeddings.word_embeddings(input_ids) + embeddings.position_embeddings(position_ids)
+        x = embeddings.dropout(embeddings.LayerNorm(x))
+
+        if attention_mask.dim() == 2:
+            attention_mask = attention_mask[:, None, :].expand(-1, attention_mask.size(1), -1)
+        # Padding rows attend to themselves so no softmax row is empty
+        eye = torch.eye(attention_mask.size(1), dtype=torch.bool, device=attention_mask.device)
+        attention_mask = (attention_mask.bool() | eye).unsqueeze(1)
+
+        for layer in self.distilbert.transformer.layer:
+            if "_plain_forward" in layer.__dict__ and self.training and torch.is_grad_enabled():
+                x = checkpoint(_packed_distilbert_layer, layer, x, attention_mask, use_reentrant=False)
+            else:
+                x = _packed_distilbert_layer(layer, x, attention_mask)
+        return x
+
+    def forward(
+        self,
+        input_ids=None,
+        attention_mask=None,
+        head_mask=None,
+        inputs_embeds=None,
+        ner_labels=None,
+        re_labels=None,
+        re_data=None,  # Relation dicts, one list per row (or one flat list for a single sequence)
+        position_ids=None,
+        re_spans=None,  # [B, R, 4] subject start/end, object start/end; padding is masked by re_labels == -1
+    ):
+        if position_ids is not None or (attention_mask is not None and attention_mask.dim() == 3):
+            # Several examples packed into each row (see packing.py)
+            sequence_output = self.packed_encoder(input_ids, attention_mask, position_ids)
+            token_mask = attention_mask.diagonal(dim1=1, dim2=2) if attention_mask.dim() == 3 else attention_mask
+        else:
+            outputs = self.distilbert(
+                input_ids,
+                attention_mask=attention_mask,
+                head_mask=head_mask,
+                inputs_embeds=inputs_embeds,
+            )
+            sequence_output = outputs[0]
+            token_mask = attention_mask
+
+        sequence_output = self.dropout(sequence_output)
+        ner_logits = self.ner_classifier(sequence_output)
+
+        if re_spans is None and re_data is not None:
+            if len(re_data) == 0:
+                re_data = [[] for _ in range(sequence_output.size(0))]
+            elif isinstance(re_data[0], dict):
+                # A flat list of relations belongs to a single sequence
+                re_data = [re_data]
+            re_spans = _re_data_to_spans(re_data, sequence_output.device)
+
+        if re_spans is None:  # Without relations, predict subject and object indices
+            subject_start_logits = self.subject_start_classifier(sequence_output).squeeze(-1)
+            subject_end_logits = self.subject_end_classifier(sequence_output).squeeze(-1)
+            object_start_logits = self.object_start_classifier(sequence_output).squeeze(-1)
+            object_end_logits = self.object_end_classifier(sequence_output).squeeze(-1)
+
+            subject_start_idx = torch.argmax(subject_start_logits, dim=-1)
+            subject_end_idx = torch.argmax(subject_end_logits, dim=-1)
+            object_start_idx = torch.argmax(object_start_logits, dim=-1)
+            object_end_idx = torch.argmax(object_end_logits, dim=-1)
+
+            subject_hidden_states = sequence_output[range(sequence_output.size(0)), subject_start_idx]
+            object_hidden_states = sequence_output[range(sequence_output.size(0)), object_start_idx]
+            re_logits = self.re_classifier(subject_hidden_states, object_hidden_states)
+
+        if ner_labels is not None:
+            
+            loss_fct = nn.CrossEntropyLoss(ignore_index=self.ner_ignore_index)
+            #print("Attention mask shape:", attention_mask.shape)
+            #print("NER logits shape:", ner_logits.shape)
+            #print("NER labels shape:", ner_labels.shape)
+            active_loss = token_mask.reshape(-1).bool()
+            active_logits = ner_logits.view(-1, self.num_ner_labels)[active_loss]
+            active_labels = ner_labels.view(-1)[active_loss]
+
+            # Check if there are any active logits and labels before calculating the loss
+            if active_logits.shape[0] > 0 and active_labels.shape[0] > 0:
+                ner_loss = loss_fct(active_logits, active_labels)
+            else:
+                ner_loss = None
+        else:
+            ner_loss = None
+
+        if re_spans is not None:
+            # Mean of the hidden states over the subject and object spans, for all relations at once
+            re_logits = span_re_logits(self.re_classifier, sequence_output, re_spans)
+
+        return {
+            'ner_logits': ner_logits,
+            'subject_start_logits': subject_start_logits if re_spans is None else None,
+            'subject_end_logits': subject_end_logits if re_spans is None else None,
+            'object_start_logits': object_start_logits if re_spans is None else None,
+            'object_end_logits': object_end_logits if re_spans is None else None,
+            're_logits': re_logits,
+            'ner_loss': ner_loss,
+            'sequence_output': sequence_output,
+        }
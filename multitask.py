@@ -0,0 +1,82 @@
+import torch
+from torch.utils.data import Dataset, Sampler
+
+# Multi-task batches. Instead of stepping through one loader per task in
+# lockstep (two forward passes, two backward passes and two optimizer steps per
+# iteration, stopping at the shorter loader), every batch mixes examples of all
+# tasks, so one forward pass and one summed loss update the model per step.
+#
+#   dataset = MultiTaskDataset([ner_dataset, re_dataset])
+#   sampler = TemperatureBatchSampler([len(ner_dataset), len(re_dataset)], batch_size, temperature=2.0)
+#   loader = DataLoader(dataset, batch_sampler=sampler, collate_fn=...)   # items are (task, example)
+#
+# Each example slot picks task t with probability proportional to n_t ** (1 / T).
+# T = 1 samples in proportion to dataset size, larger T moves towards uniform,
+# so a small task is seen more often than its size alone would give it.
+
+
+def task_probabilities(sizes, temperature=1.0):
+    weights = [size ** (1.0 / temperature) if size > 0 else 0.0 for size in sizes]
+    total = sum(weights)
+    return [weight / total for weight in weights]
+
+
+class MultiTaskDataset(Dataset):
+    """Several datasets addressed by (task, index); items are (task, example)."""
+
+    def __init__(self, datasets):
+        self.datasets = list(datasets)
+
+    def __len__(self):
+        return sum(len(dataset) for dataset in self.datasets)
+
+    def __getitem__(self, key):
+        task, index = key
+        return task, self.datasets[task][index]
+
+
+class TemperatureBatchSampler(Sampler):
+    """Batches of (task, index) keys with tasks drawn by temperature-scaled size.
+
+    Every task is walked through in its own shuffled order, reshuffled when it
+    runs out, so a small task repeats instead of a large one being cut short.
+    An epoch has sum(sizes) / batch_size batches; at temperature 1 that sees
+    every example about once. The order depends only on (seed, epoch).
+    """
+
+    def __init__(self, sizes, batch_size, temperature=1.0, seed=0, drop_last=False):
+        self.sizes = list(sizes)
+        self.batch_size = batch_size
+        self.temperature = temperature
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        total = sum(self.sizes)
+        return total // self.batch_size if self.drop_last else -(-total // self.batch_size)
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        probabilities = torch.tensor(task_probabilities(self.sizes, self.temperature))
+        num_items = len(self) * self.batch_size if self.drop_last else sum(self.sizes)
+        tasks = torch.multinomial(probabilities, num_items, replacement=True, generator=generator).tolist()
+
+        orders = [[] for _ in self.sizes]
+        positions = [0 for _ in self.sizes]
+        batch = []
+        for task in tasks:
+            if positions[task] == len(orders[task]):
+                orders[task] = torch.randperm(self.sizes[task], generator=generator).tolist()
+                positions[task] = 0
+            batch.append((task, orders[task][positions[task]]))
+            positions[task] += 1
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
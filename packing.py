@@ -0,0 +1,170 @@
+import torch
+from torch.utils.data import Dataset
+
+# Sequence packing for the DistilBERT RE path. preprocess.py pads every relation
+# sentence to max_seq_length, but most are 30-50 tokens, so most of each forward
+# pass is padding. Packing concatenates several examples into one row:
+#
+#   [CLS] sent 1 [SEP] [CLS] sent 2 [SEP] [CLS] sent 3 [SEP] [PAD] ...
+#
+# The attention mask is block diagonal, so an example only attends to its own
+# tokens, and position ids restart at 0 for every example, so each one is
+# encoded exactly as it would be alone. Relation spans are shifted by the
+# example's offset in the row.
+
+
+def record_relations(record):
+    """The relations of a preprocessed RE record: one per record, or all of a sentence's when grouped."""
+    return record["relations"] if "relations" in record else [record]
+
+
+def record_to_example(record, tokenizer, label_to_id, relation_to_id, ignore_index):
+    """Token ids, NER labels and relations of one preprocessed RE record, without padding."""
+    tokens = [t for t in record["sentence_tokens"] if t != tokenizer.pad_token]
+    input_ids = tokenizer.convert_tokens_to_ids(tokens)
+
+    ner_labels = [ignore_index] * len(input_ids)
+    relations = []
+    for rel in record_relations(record):
+        for start, end, text in (
+            (rel["subject_start_idx"], rel["subject_end_idx"], rel["subject_text"]),
+            (rel["object_start_idx"], rel["object_end_idx"], rel["object_text"]),
+        ):
+            for i in range(start, min(end + 1, len(ner_labels))):
+                ner_labels[i] = label_to_id[text]
+
+        relations.append({
+            "subject_start_idx": rel["subject_start_idx"],
+            "subject_end_idx": rel["subject_end_idx"],
+            "object_start_idx": rel["object_start_idx"],
+            "object_end_idx": rel["object_end_idx"],
+            "label": relation_to_id[rel["rel_name"]],
+        })
+    return {"input_ids": input_ids, "ner_labels": ner_labels, "relations": relations}
+
+
+def relation_spans(relations):
+    """[R, 4] subject start/end and object start/end of a list of relations."""
+    return torch.tensor(
+        [[rel["subject_start_idx"], rel["subject_end_idx"], rel["object_start_idx"], rel["object_end_idx"]] for rel in relations],
+        dtype=torch.long,
+    ).view(-1, 4)
+
+
+def pad_examples(examples, pad_id=0, ignore_index=-100):
+    """Pad record_to_example examples to the longest one in the list (dynamic padding)."""
+    seq_len = max(len(example["input_ids"]) for example in examples)
+    max_relations = max(1, max(len(example["relations"]) for example in examples))
+    input_ids = torch.full((len(examples), seq_len), pad_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(examples), seq_len), dtype=torch.long)
+    ner_labels = torch.full((len(examples), seq_len), ignore_index, dtype=torch.long)
+    re_labels = torch.full((len(examples), max_relations), -1, dtype=torch.long)
+    # Padding relations point at token 0 and are masked by re_labels == -1
+    re_spans = torch.zeros((len(examples), max_relations, 4), dtype=torch.long)
+    for b, example in enumerate(examples):
+        length = len(example["input_ids"])
+        input_ids[b, :length] = torch.tensor(example["input_ids"], dtype=torch.long)
+        attention_mask[b, :length] = 1
+        ner_labels[b, :length] = torch.tensor(example["ner_labels"], dtype=torch.long)
+        relations = example["relations"]
+        if relations:
+            re_labels[b, :len(relations)] = torch.tensor([rel["label"] for rel in relations], dtype=torch.long)
+            re_spans[b, :len(relations)] = relation_spans(relations)
+    return {
+        "input_ids": input_ids,
+        "attention_mask": attention_mask,
+        "ner_labels": ner_labels,
+        "re_labels": re_labels,
+        "re_spans": re_spans,
+    }
+
+
+def pack_examples(lengths, max_length):
+    """First-fit decreasing: group example indices into rows of at most max_length tokens."""
+    order = sorted(range(len(lengths)), key=lambda i: (-lengths[i], i))
+    packs, room = [], []
+    for i in order:
+        length = min(lengths[i], max_length)
+        for p, free in enumerate(room):
+            if length <= free:
+                packs[p].append(i)
+                room[p] -= length
+                break
+        else:
+            packs.append([i])
+            room.append(max_length - length)
+    return packs
+
+
+def packing_efficiency(packs, lengths, max_length):
+    """Fraction of non-padding tokens when packed, and when padded one example per row."""
+    tokens = sum(min(length, max_length) for length in lengths)
+    return tokens / (len(packs) * max_length), tokens / (len(lengths) * max_length)
+
+
+class PackedDataset(Dataset):
+    def __init__(self, examples, max_length):
+        self.examples = examples
+        self.max_length = max_length
+        lengths = [len(example["input_ids"]) for example in examples]
+        self.packs = pack_examples(lengths, max_length)
+        packed, unpacked = packing_efficiency(self.packs, lengths, max_length)
+        print(f"Packed {len(examples)} examples into {len(self.packs)} rows ({packed:.0%} real tokens, {unpacked:.0%} unpacked)")
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __getitem__(self, idx):
+        return [self.examples[i] for i in self.packs[idx]]
+
+
+def block_attention_mask(segment_ids):
+    """[B, S, S] mask that lets a token attend only within its own example (segment 0 is padding)."""
+    same = segment_ids[:, :, None] == segment_ids[:, None, :]
+    return same & (segment_ids[:, :, None] > 0)
+
+
+def packed_collate_fn(batch, max_length, pad_id=0, ignore_index=-100):
+    """Collate PackedDataset rows into padded tensors; relations become [B, R, 4] re_spans."""
+    rows = []
+    for pack in batch:
+        input_ids, ner_labels, position_ids, segment_ids, relations = [], [], [], [], []
+        for segment, example in enumerate(pack, start=1):
+            offset = len(input_ids)
+            length = min(len(example["input_ids"]), max_length - offset)
+            input_ids += example["input_ids"][:length]
+            ner_labels += example["ner_labels"][:length]
+            position_ids += range(length)
+            segment_ids += [segment] * length
+            for relation in example["relations"]:
+                shifted = {key: value + offset for key, value in relation.items() if key.endswith("_idx")}
+                if max(shifted.values()) < offset + length:
+                    relations.append(dict(shifted, label=relation["label"]))
+        rows.append((input_ids, ner_labels, position_ids, segment_ids, relations))
+
+    # Pad to the longest row of the batch, not to max_length
+    seq_len = max(len(row[0]) for row in rows)
+    max_relations = max(1, max(len(row[4]) for row in rows))
+    input_ids = torch.full((len(rows), seq_len), pad_id, dtype=torch.long)
+    ner_labels = torch.full((len(rows), seq_len), ignore_index, dtype=torch.long)
+    position_ids = torch.zeros((len(rows), seq_len), dtype=torch.long)
+    segment_ids = torch.zeros((len(rows), seq_len), dtype=torch.long)
+    re_labels = torch.full((len(rows), max_relations), -1, dtype=torch.long)
+    re_spans = torch.zeros((len(rows), max_relations, 4), dtype=torch.long)
+    for b, (row_ids, row_labels, row_positions, row_segments, relations) in enumerate(rows):
+        input_ids[b, :len(row_ids)] = torch.tensor(row_ids, dtype=torch.long)
+        ner_labels[b, :len(row_ids)] = torch.tensor(row_labels, dtype=torch.long)
+        position_ids[b, :len(row_ids)] = torch.tensor(row_positions, dtype=torch.long)
+        segment_ids[b, :len(row_ids)] = torch.tensor(row_segments, dtype=torch.long)
+        if relations:
+            re_labels[b, :len(relations)] = torch.tensor([relation["label"] for relation in relations], dtype=torch.long)
+            re_spans[b, :len(relations)] = relation_spans(relations)
+
+    return {
+        "input_ids": input_ids,
+        "attention_mask": block_attention_mask(segment_ids),
+        "position_ids": position_ids,
+        "ner_labels": ner_labels,
+        "re_labels": re_labels,
+        "re_spans": re_spans,
+    }
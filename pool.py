@@ -0,0 +1,205 @@
+import os
+import copy
+import json
+import time
+import queue
+import argparse
+import logging
+import torch
+import torch.multiprocessing as mp
+from inference import Predictor
+from autotune import apply_profile
+from dict_store import EntityStore
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+
+# Multi-process CPU inference. The model is loaded once in the parent and its
+# parameters are moved to shared memory before the workers start, so N workers
+# cost one copy of the weights plus their activations. Each worker is pinned to
+# its own slice of cores and runs torch with that many intra-op threads; work is
+# handed out as batches of documents.
+#
+# With the default "fork" start method the parent must not run inference before
+# the pool starts: a forked OpenMP thread pool can deadlock in the children.
+# The entity store's sqlite connection cannot be pickled for "spawn" nor shared
+# across a fork, so every worker opens the store again from its path.
+
+_predictor = None
+
+
+def _init_worker(predictor, store_path, core_queue, core_slices, threads_per_worker):
+    global _predictor
+    if predictor is not None:
+        _predictor = predictor
+    if store_path is not None:
+        # A copy, so a forked worker does not touch the parent's connection
+        _predictor = copy.copy(_predictor)
+        _predictor.entity_store = EntityStore(store_path)
+
+    try:
+        cores = core_queue.get(timeout=5)
+    except queue.Empty:
+        # A worker the pool started in place of one that died finds the queue
+        # drained; it takes a slice by its process number instead of blocking
+        cores = core_slices[(mp.current_process()._identity[-1] - 1) % len(core_slices)]
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads_per_worker)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already fixed for this process
+        pass
+
+
+def _predict_batch(args):
+    batch_idx, texts = args
+    return batch_idx, _predictor.predict_batch(texts)
+
+
+def split_cores(num_workers):
+    if hasattr(os, "sched_getaffinity"):
+        cores = sorted(os.sched_getaffinity(0))
+    else:
+        cores = list(range(os.cpu_count() or 1))
+    per_worker = max(1, len(cores) // num_workers)
+    slices = []
+    for i in range(num_workers):
+        chunk = cores[i * per_worker:(i + 1) * per_worker]
+        # More workers than cores: share them round-robin rather than leaving any idle
+        slices.append(chunk if chunk else [cores[i % len(cores)]])
+    return slices, per_worker
+
+
+class InferencePool:
+    def __init__(self, predictor, num_workers=None, threads_per_worker=None, start_method="fork"):
+        global _predictor
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 1) // 4)
+        core_slices, per_worker = split_cores(self.num_workers)
+        self.threads_per_worker = threads_per_worker or per_worker
+
+        # Shared-memory storages are inherited by forked workers and passed by
+        # handle (not copied) to spawned ones
+        predictor.model.share_memory()
+        _predictor = predictor
+
+        store_path = predictor.entity_store.db_path if predictor.entity_store is not None else None
+        if start_method != "fork" and store_path is not None:
+            predictor = copy.copy(predictor)
+            predictor.entity_store = None
+
+        ctx = mp.get_context(start_method)
+        core_queue = ctx.Queue()
+        for cores in core_slices:
+            core_queue.put(cores)
+        self.pool = ctx.Pool(
+            self.num_workers,
+            initializer=_init_worker,
+            initargs=(None if start_method == "fork" else predictor, store_path, core_queue, core_slices, self.threads_per_worker),
+        )
+
+    def predict(self, texts, batch_size=16):
+        """Yield one result per text, in input order."""
+        batches = ((i, texts[start:start + batch_size]) for i, start in enumerate(range(0, len(texts), batch_size)))
+        for _, results in self.pool.imap(_predict_batch, batches):
+            yield from results
+
+    def worker_pids(self):
+        return [p.pid for p in self.pool._pool]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def memory_kb(pid):
+    """(rss, pss) of a process in kB; pss splits shared pages between their users."""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in ("Rss", "Pss"):
+                    values[name] = int(rest.split()[0])
+    except OSError:
+        return None, None
+    return values.get("Rss"), values.get("Pss")
+
+
+def read_texts(path):
+    if os.path.isdir(path):
+        # The training corpus layout: one JSON document per file
+        texts = []
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(".json"):
+                with open(os.path.join(path, file_name), "r") as f:
+                    texts.append(json.load(f)["text"])
+        return texts
+    with open(path, "r") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def run(predictor, texts, num_workers, batch_size, threads_per_worker=None, output=None):
+    with InferencePool(predictor, num_workers, threads_per_worker) as pool:
+        # Warm up every worker so the timing below excludes start-up
+        list(pool.predict(texts[:batch_size * pool.num_workers], batch_size))
+
+        start = time.perf_counter()
+        results = list(pool.predict(texts, batch_size))
+        elapsed = time.perf_counter() - start
+
+        memory = [memory_kb(pid) for pid in pool.worker_pids()]
+
+    if output is not None:
+        with open(output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    return len(texts) / elapsed, memory
+
+
+if __name__ == "__main__":
+    # Thread counts are set per worker below, so only the batch-level settings apply here
+    tuning = apply_profile("inference", {"tokenizers_parallelism": None, "batch_size": 16})
+
+    parser = argparse.ArgumentParser(description="Multi-process CPU inference with shared model weights")
+    parser.add_argument("input", nargs="?", help="JSONL file with a \"text\" field per line, or a directory of JSON documents")
+    parser.add_argument("--model-dir", default="models/combined")
+    parser.add_argument("--tiny", action="store_true", help="Use a tiny random-init model")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=tuning["batch_size"])
+    parser.add_argument("--output", help="Write one JSON result per line")
+    parser.add_argument("--scaling", action="store_true", help="Report docs/s for 1, 2, 4, ... workers")
+    args = parser.parse_args()
+
+    if args.tiny:
+        predictor = Predictor.tiny()
+    else:
+        predictor = Predictor.from_pretrained(args.model_dir)
+
+    if args.input:
+        texts = read_texts(args.input)
+    else:
+        texts = ["Heme oxygenase-1 (HO-1) is a stress-inducible enzyme with diverse cytoprotective effects."] * 2000
+
+    parent_rss, _ = memory_kb(os.getpid())
+    print(f"Parent RSS after loading: {parent_rss / 1024:.0f} MB" if parent_rss else "Parent RSS unavailable")
+
+    max_workers = args.workers or max(1, (os.cpu_count() or 1) // 4)
+    worker_counts = [args.workers or max_workers]
+    if args.scaling:
+        worker_counts = sorted({min(2 ** i, max_workers) for i in range(max_workers.bit_length() + 1)})
+
+    for num_workers in worker_counts:
+        docs_per_second, memory = run(
+            predictor, texts, num_workers, args.batch_size, args.threads_per_worker,
+            output=args.output if num_workers == worker_counts[-1] else None,
+        )
+        pss = sum(p for _, p in memory if p) / 1024
+        print(f"workers={num_workers:3d}  {docs_per_second:8.1f} docs/s  total worker PSS {pss:.0f} MB")
@@ -1,14 +1,18 @@
 import os
 import torch
 import json
-from transformers import BertTokenizer, BertModel
+from transformers import BertTokenizerFast
 from typing import List
 import logging
+from windowing import encode_long_documents
+from dict_store import EntityStore
+from gazetteer import Gazetteer, merge
+from autotune import apply_profile
+from weights import load_model
+from decoding import label_maps, continuation_mask, decode_spans, spans_to_entities
 logging.getLogger("transformers").setLevel(logging.ERROR)
 
-tokenizer = BertTokenizer.from_pretrained("models/combined")
-model = BertModel.from_pretrained("models/combined")
-model.eval()
+apply_profile("inference", {"tokenizers_parallelism": None, "intra_op_threads": None, "inter_op_threads": None})
 
 with open("models/combined/label_to_id.json", "r") as f:
     label_to_id = json.load(f)
@@ -19,67 +23,98 @@ with open("models/combined/relation_to_id.json", "r") as f:
 id_to_label = {v: k for k, v in label_to_id.items()}
 id_to_relation = {v: k for k, v in relation_to_id.items()}
 
+tokenizer = BertTokenizerFast.from_pretrained("models/combined")
+# The trained NER + RE model: its classifier outputs are what gets decoded
+model = load_model("models/combined", len(label_to_id), len(relation_to_id))
 
-def predict_ner(text: str, confidence_threshold: float = 0.0) -> List[dict]:
-    with open("models/combined/label_to_id.json", "r") as f:
-        label_to_id = json.load(f)
-    
-    # Load the id_to_label dictionary using the label_to_id dictionary
-    id_to_label = {v: k for k, v in label_to_id.items()}
-    
-    input_ids = tokenizer.encode(text, add_special_tokens=True, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model(input_ids)
-    predictions = outputs.last_hidden_state.argmax(-1).tolist()[0]
-    scores = torch.softmax(outputs.last_hidden_state, dim=2).max(dim=2).values.tolist()[0]
-
-    tokens = tokenizer.convert_ids_to_tokens(input_ids.tolist()[0])
+label_types, label_begins, type_names = label_maps(id_to_label)
+continuation = continuation_mask(tokenizer)
 
-    entities = []
-    current_entity = {"entityName": "", "entityType": "", "entityId": "", "score": 0.0}
-    for i, (token, prediction, score) in enumerate(zip(tokens, predictions, scores)):
-        if score < confidence_threshold:
-            continue
-        if token.startswith("##"):
-            current_entity["entityName"] += token[2:]
-        else:
-            if current_entity["entityType"]:
-                entities.append(current_entity.copy())
-            current_entity["entityName"] = token
-            current_entity["entityType"] = id_to_label.get(prediction, "O")
-            current_entity["entityId"] = f"T{i}"
-            current_entity["score"] = score
-    if current_entity["entityType"]:
-        entities.append(current_entity.copy())
-    return entities
+# Models trained with label_scheme="type" predict B-/I-{type} only; entity names
+# are looked up in the dictionary store saved next to the model
+label_scheme = getattr(model.config, "label_scheme", "entity")
+# Only B-/I- labels (with "O") carry an entity scheme; preprocess.py's labels are entity texts
+decode_scheme = label_scheme if "O" in id_to_label.values() else None
+entity_store = None
+if label_scheme == "type" and os.path.exists("models/combined/entity_dict.sqlite"):
+    entity_store = EntityStore("models/combined/entity_dict.sqlite")
 
+# Dictionary NER built by gazetteer.py: texts it is confident about skip the encoder
+gazetteer = None
+if os.path.exists("models/combined/gazetteer.pkl"):
+    gazetteer = Gazetteer.load("models/combined/gazetteer.pkl")
 
 
+def resolve_entity_names(entities: List[dict], store: EntityStore) -> List[dict]:
+    for entity in entities:
+        label = entity["entityType"]
+        if label == "O":
+            continue
+        entity_type = label.split("-", 1)[1] if label[:2] in ("B-", "I-") else label
+        entity["resolvedName"] = store.resolve_mention(entity["entityName"], entity_type)
+    return entities
 
-def predict_re(text: str, entities: List[dict]) -> List[dict]:
-    with open("models/combined/relation_to_id.json", "r") as f:
-        relation_to_id = json.load(f)
 
-    # Load the id_to_relation dictionary using the relation_to_id dictionary
-    id_to_relation = {v: k for k, v in relation_to_id.items()}
+def predict_ner(text: str, confidence_threshold: float = 0.0, window_size: int = 128, stride: int = 64, min_share: float = 0.9) -> List[dict]:
+    matches = []
+    if gazetteer is not None:
+        matches, confident = gazetteer.scan(text, min_share)
+        if confident:
+            return matches
+
+    # Long texts are encoded as overlapping windows and merged back to token level
+    document = encode_long_documents(model, tokenizer, [text], window_size=window_size, stride=stride)[0]
+    scores, labels = torch.softmax(document["outputs"].float(), dim=-1).max(dim=-1)
+    input_ids = torch.tensor(document["input_ids"], dtype=torch.long)
+    offsets = torch.tensor(document["offset_mapping"], dtype=torch.long).view(-1, 2)
+
+    # Subword pieces take the label of their word's first piece, as in training
+    spans = decode_spans(
+        labels[None], scores[None], offsets[None], label_types, label_begins,
+        carry=continuation[input_ids][None], threshold=confidence_threshold,
+    )
+    entities = spans_to_entities(spans, type_names, [text], decode_scheme)[0]
+    for entity in entities:
+        del entity["token"]
+    if entity_store is not None:
+        resolve_entity_names(entities, entity_store)
+    # Dictionary matches the model missed
+    return merge(entities, matches)
+
+
+def predict_re(text: str, entities: List[dict], max_length: int = 512) -> List[dict]:
+    max_length = min(max_length, model.config.max_position_embeddings)
+    encoding = tokenizer(text, truncation=True, max_length=max_length, return_offsets_mapping=True, return_tensors="pt")
+    offsets = encoding.pop("offset_mapping")[0]
+    with torch.no_grad():
+        sequence_output = model(**encoding)["sequence_output"][0]
+
+    # Each entity is represented by the first token that ends after its start;
+    # entities past the truncated encoding are left out
+    starts = torch.tensor([entity["start"] for entity in entities], dtype=torch.long)
+    real = offsets[:, 0] != offsets[:, 1]
+    hits = real[None, :] & (offsets[None, :, 1] > starts[:, None])
+    tokens = hits.float().argmax(dim=1)
+    kept = hits.any(dim=1).nonzero(as_tuple=True)[0]
+
+    # Score every ordered pair in one bilinear call
+    subject_idx, object_idx = torch.meshgrid(kept, kept, indexing="ij")
+    pairs = subject_idx != object_idx
+    subject_idx, object_idx = subject_idx[pairs], object_idx[pairs]
+    if subject_idx.numel() == 0:
+        return []
+    with torch.no_grad():
+        re_logits = model.re_classifier(sequence_output[tokens[subject_idx]], sequence_output[tokens[object_idx]])
+    predictions = re_logits.argmax(dim=-1).tolist()
 
     relation_data = []
-    for i, entity1 in enumerate(entities):
-        for j, entity2 in enumerate(entities):
-            if i != j:
-                subject_id = entity1["entityId"]
-                object_id = entity2["entityId"]
-                subject = entity1["entityName"]
-                obj = entity2["entityName"]
-                relation_name = ""
-                input_text = f"{subject} [SEP] {obj}"
-                input_ids = tokenizer.encode(input_text, add_special_tokens=True, return_tensors="pt")
-                with torch.no_grad():
-                    outputs = model(input_ids)
-                prediction = outputs.pooler_output.argmax(-1).item()
-                relation_name = id_to_relation.get(prediction, "UNKNOWN")
-                relation_data.append({"subjectId": subject_id, "objectId": object_id, "subjectName": subject, "objectName": obj, "relationName": relation_name})
+    for i, j, prediction in zip(subject_idx.tolist(), object_idx.tolist(), predictions):
+        subject, obj = entities[i], entities[j]
+        relation_data.append({
+            "subjectId": subject["entityId"],
+            "objectId": obj["entityId"],
+            "subjectName": subject["entityName"],
+            "objectName": obj["entityName"],
+            "relationName": id_to_relation.get(prediction, "UNKNOWN"),
+        })
     return relation_data
-
-
-
@@ -1,9 +1,16 @@
-import json
 import pickle
 import os
-from nltk import sent_tokenize
 import itertools
-import nltk
+import argparse
+from sentences import sentence_boundaries, sentence_span
+from schema import iter_documents
+
+parser = argparse.ArgumentParser(description="Preprocess the JSON corpus into NER and RE training data")
+parser.add_argument("--group-by-sentence", action="store_true",
+                    help="Emit one RE record per sentence carrying all of its relations, instead of one per relation")
+parser.add_argument("--compact", action="store_true",
+                    help="Also write the RE records as a compact preprocessed_re_data.npz (see records.py)")
+args = parser.parse_args()
 
 # Initialize the tokenizer
 label_to_id = {}
@@ -17,31 +24,37 @@ from transformers import DistilBertTokenizerFast
 max_seq_length = 128
 tokenizer = DistilBertTokenizerFast.from_pretrained("distilbert-base-uncased", max_length=max_seq_length, padding="max_length")
 
-def preprocess_data(json_data, label_to_id, relation_to_id):
-    text = json_data["text"]
+def preprocess_data(document, label_to_id, relation_to_id, group_by_sentence=False, doc_id=None):
+    # document is a schema.Document
+    text = document.text
+    # With group_by_sentence, records by (sentence start, sentence end) of this document
+    sentence_records = {}
+
+    # Segment the document once; every relation looks its sentence up in here
+    boundaries = sentence_boundaries(text)
 
     # Find entities in the full text
-    entities = json_data["entities"]
     entity_map = {}
 
-    for entity in entities:
-        entity_text = text[entity["span"]["begin"]:entity["span"]["end"]]
-        entity_map[entity["entityId"]] = {
-            "text": entity_text,
-            "start": entity["span"]["begin"],
-            "end": entity["span"]["end"],
+    for entity in document.entities:
+        if not entity.has_span:
+            continue
+        entity_map[entity.entity_id] = {
+            "text": text[entity.begin:entity.end],
+            "start": entity.begin,
+            "end": entity.end,
         }
 
     # Find relations in the full text
-    relations = json_data["relation_info"]
+    relations = document.relations
     
     ner_data = []
     re_data = []
 
     for relation in relations:
-        subject_id = relation["subjectID"]
-        object_id = relation["objectId"]
-        rel_name = relation["rel_name"]
+        subject_id = relation.subject_id
+        object_id = relation.object_id
+        rel_name = relation.rel_name
         
         if subject_id not in entity_map or object_id not in entity_map:
             print(f"Error: Entity IDs {subject_id} or {object_id} not found in the entity_map.")
@@ -65,21 +78,32 @@ def preprocess_data(json_data, label_to_id, relation_to_id):
             relation_to_id[rel_name] = len(relation_to_id)
 
         # Find sentence containing the relation
-        sentence_start = text.rfind(".", 0, subject_start) + 1
-        sentence_end = text.find(".", object_end) + 1
-        sentence_text = text[sentence_start:sentence_end].strip()
-
-        # Tokenize the sentence
-        sentence_encoding = tokenizer(
-            sentence_text,
-            return_offsets_mapping=True,
-            padding='max_length',
-            truncation=True,
-            max_length=max_seq_length,
-            return_tensors='pt'
+        sentence_start, sentence_end = sentence_span(
+            boundaries, min(subject_start, object_start), max(subject_end, object_end)
         )
-        sentence_tokens = tokenizer.convert_ids_to_tokens(sentence_encoding['input_ids'][0])
-        sentence_token_offsets = sentence_encoding['offset_mapping'][0]
+        sentence_text = text[sentence_start:sentence_end]
+        # Keep sentence_start pointing at the first character of the stripped text
+        stripped_text = sentence_text.lstrip()
+        sentence_start += len(sentence_text) - len(stripped_text)
+        sentence_text = stripped_text.rstrip()
+        sentence_key = (sentence_start, sentence_start + len(sentence_text))
+
+        # Tokenize the sentence (once per sentence when grouping)
+        if group_by_sentence and sentence_key in sentence_records:
+            sentence_record = sentence_records[sentence_key]
+            sentence_tokens = sentence_record["sentence_tokens"]
+            sentence_token_offsets = sentence_record["offsets"]
+        else:
+            sentence_encoding = tokenizer(
+                sentence_text,
+                return_offsets_mapping=True,
+                padding='max_length',
+                truncation=True,
+                max_length=max_seq_length,
+                return_tensors='pt'
+            )
+            sentence_tokens = tokenizer.convert_ids_to_tokens(sentence_encoding['input_ids'][0])
+            sentence_token_offsets = sentence_encoding['offset_mapping'][0]
 
         # Find the entity token indices using the token offsets
         subject_start_idx, subject_end_idx, object_start_idx, object_end_idx = None, None, None, None
@@ -87,6 +111,9 @@ def preprocess_data(json_data, label_to_id, relation_to_id):
         object_tokens = tokenizer.tokenize(obj)
 
         for i, (token_start, token_end) in enumerate(sentence_token_offsets):
+            if token_start == token_end:
+                # [CLS], [SEP] and padding have (0, 0) offsets and would match an entity at offset 0
+                continue
             if token_start == subject_start - sentence_start:
                 subject_start_idx = i
             if token_end == subject_end - sentence_start:
@@ -127,8 +154,7 @@ def preprocess_data(json_data, label_to_id, relation_to_id):
         print(f"Tokenized sentence: {sentence_tokens}")
         print(f"Subject token indices: {subject_start_idx}-{subject_end_idx}")
         print(f"Object token indices: {object_start_idx}-{object_end_idx}\n")
-        re_data.append({
-            "sentence_tokens": sentence_tokens,
+        relation_record = {
             "subject_start_idx": subject_start_idx,
             "subject_end_idx": subject_end_idx,
             "object_start_idx": object_start_idx,
@@ -136,7 +162,22 @@ def preprocess_data(json_data, label_to_id, relation_to_id):
             "rel_name": rel_name,
             "subject_text": subject,  # Add subject_text
             "object_text": obj,  # Add object_text
-        })
+        }
+        if group_by_sentence:
+            # One record per sentence: the encoder runs once for all of its relations
+            if sentence_key not in sentence_records:
+                sentence_records[sentence_key] = {
+                    "sentence_tokens": sentence_tokens,
+                    "offsets": sentence_token_offsets,
+                    "doc_id": doc_id,
+                    "sentence_span": sentence_key,
+                    "relations": [],
+                }
+                re_data.append(sentence_records[sentence_key])
+            if relation_record not in sentence_records[sentence_key]["relations"]:
+                sentence_records[sentence_key]["relations"].append(relation_record)
+        else:
+            re_data.append(dict(relation_record, sentence_tokens=sentence_tokens))
 
         # Assuming you want to store the subject and object entities for ner_data
         ner_data.append({
@@ -147,17 +188,23 @@ def preprocess_data(json_data, label_to_id, relation_to_id):
             "object_start": object_start,
             "object_end": object_end
         })
+
+    for record in sentence_records.values():
+        # Only needed while grouping
+        del record["offsets"]
     return ner_data, re_data
 
 max_label_length = 20
 # Read JSON files
-for file in os.listdir(json_directory):
-    if file.endswith(".json"):
-        with open(os.path.join(json_directory, file), "r") as json_file:
-            json_data = json.load(json_file)
-            ner_data, re_data = preprocess_data(json_data, label_to_id, relation_to_id)
-            preprocessed_ner_data.extend(ner_data)
-            preprocessed_re_data.extend(re_data)
+for json_path, document in iter_documents(json_directory):
+    ner_data, re_data = preprocess_data(document, label_to_id, relation_to_id, args.group_by_sentence, doc_id=os.path.basename(json_path))
+    preprocessed_ner_data.extend(ner_data)
+    preprocessed_re_data.extend(re_data)
+
+if args.group_by_sentence and preprocessed_re_data:
+    num_relations = sum(len(record["relations"]) for record in preprocessed_re_data)
+    print(f"Grouped {num_relations} relations into {len(preprocessed_re_data)} sentences "
+          f"({num_relations / len(preprocessed_re_data):.2f} relations per encoder pass)")
 
 # Save preprocessed data
 with open("preprocessed_ner_data.pkl", "wb") as ner_file:
@@ -165,6 +212,9 @@ with open("preprocessed_ner_data.pkl", "wb") as ner_file:
 
 with open("preprocessed_re_data.pkl", "wb") as re_file:
     pickle.dump(preprocessed_re_data, re_file)
+if args.compact:
+    from records import RecordStore
+    RecordStore.from_records(preprocessed_re_data, tokenizer, label_to_id, relation_to_id).save("preprocessed_re_data.npz")
 with open("label_to_id.pkl", "wb") as f:
     pickle.dump(label_to_id, f)
 
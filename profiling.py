@@ -0,0 +1,148 @@
+import os
+import csv
+import json
+import time
+from contextlib import contextmanager, nullcontext
+import torch
+
+# Training-loop instrumentation. StepTimer records wall time per step for data
+# wait, host->device copy, forward, loss, backward and optimizer step; the
+# averages go to the tqdm postfix and the per-step rows can be exported to CSV or
+# JSON. ProfilerWindow captures a torch.profiler Chrome trace for K steps.
+#
+# Both are off unless enabled, and then cost one attribute check per call.
+#
+#   RE_BERT_STEP_TIMINGS=timings.csv   record step timings and export them
+#   RE_BERT_PROFILE_STEPS=100:5        trace steps 100-104 ...
+#   RE_BERT_PROFILE_TRACE=trace.json   ... into this Chrome trace file
+
+sections = ("data", "h2d", "forward", "loss", "backward", "optimizer")
+_disabled = nullcontext()
+
+
+class StepTimer:
+    def __init__(self, enabled=False, sync_cuda=True, window=50):
+        self.enabled = enabled
+        # Without a sync, CUDA time is charged to whichever section blocks next
+        self.sync_cuda = sync_cuda and torch.cuda.is_available()
+        self.window = window
+        self.rows = []
+        self.current = None
+        self.last_step_end = None
+
+    def _now(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def data_ready(self):
+        """Call first thing in the loop body: the time since the last step is data wait."""
+        if not self.enabled:
+            return
+        now = self._now()
+        self.current = {"step": len(self.rows)}
+        if self.last_step_end is not None:
+            self.current["data"] = now - self.last_step_end
+
+    def section(self, name):
+        if not self.enabled:
+            return _disabled
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name):
+        start = self._now()
+        try:
+            yield
+        finally:
+            if self.current is None:
+                self.current = {"step": len(self.rows)}
+            self.current[name] = self.current.get(name, 0.0) + self._now() - start
+
+    def end_step(self):
+        if not self.enabled:
+            return
+        self.last_step_end = self._now()
+        if self.current is not None:
+            self.rows.append(self.current)
+        self.current = None
+
+    def postfix(self):
+        """Mean milliseconds per section over the last `window` steps."""
+        if not self.enabled or not self.rows:
+            return {}
+        recent = self.rows[-self.window:]
+        return {
+            f"{name}_ms": round(1000 * sum(row.get(name, 0.0) for row in recent) / len(recent), 1)
+            for name in sections
+            if any(name in row for row in recent)
+        }
+
+    def export(self, path):
+        if not self.enabled:
+            return
+        rows = [{"step": row["step"], **{name: row.get(name, 0.0) for name in sections}} for row in self.rows]
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(rows, f)
+        else:
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["step", *sections])
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f"Wrote step timings for {len(rows)} steps to {path}")
+
+
+class ProfilerWindow:
+    """Run torch.profiler over steps [start_step, start_step + num_steps) and save a Chrome trace."""
+
+    def __init__(self, start_step=None, num_steps=0, trace_path="trace.json"):
+        self.start_step = start_step
+        self.num_steps = num_steps
+        self.trace_path = trace_path
+        self.profiler = None
+
+    @property
+    def enabled(self):
+        return self.start_step is not None and self.num_steps > 0
+
+    def step(self, global_step):
+        """Call once per step, before the step runs."""
+        if not self.enabled:
+            return
+        if global_step == self.start_step and self.profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True, with_stack=False)
+            self.profiler.__enter__()
+        elif global_step == self.start_step + self.num_steps:
+            self.stop()
+
+    def stop(self):
+        if self.profiler is None:
+            return
+        self.profiler.__exit__(None, None, None)
+        self.profiler.export_chrome_trace(self.trace_path)
+        print(f"Wrote profiler trace of {self.num_steps} steps to {self.trace_path}")
+        self.profiler = None
+        self.start_step = None
+
+
+def parse_profile_steps(value):
+    """'100:5' -> (100, 5); None or '' -> (None, 0)."""
+    if not value:
+        return None, 0
+    start, _, count = value.partition(":")
+    return int(start), int(count or 1)
+
+
+def add_profiling_args(parser):
+    parser.add_argument("--step-timings", default=os.environ.get("RE_BERT_STEP_TIMINGS"), help="Record per-step timings and export them to this .csv/.json file")
+    parser.add_argument("--profile-steps", default=os.environ.get("RE_BERT_PROFILE_STEPS"), help="START:COUNT steps to capture with torch.profiler")
+    parser.add_argument("--profile-trace", default=os.environ.get("RE_BERT_PROFILE_TRACE", "trace.json"), help="Chrome trace output path")
+
+
+def from_args(args):
+    start_step, num_steps = parse_profile_steps(args.profile_steps)
+    return StepTimer(enabled=bool(args.step_timings)), ProfilerWindow(start_step, num_steps, args.profile_trace)
@@ -0,0 +1,240 @@
+import os
+import copy
+import json
+import shutil
+import argparse
+import logging
+import torch
+import torch.nn.functional as F
+from torch import nn
+from models import BertForNERAndRE, DistilBertForNERAndRE, span_re_logits
+from packing import pad_examples
+from records import load_examples
+from distill import tiny_examples
+from evaluate import Evaluator, split_dataset
+from inference import tiny_tokenizer, tiny_bert_config, tiny_distilbert_config
+from weights import load_model, load_label_maps, load_tokenizer
+from bert_data import dev_window_examples
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+
+# Structured pruning for BertForNERAndRE / DistilBertForNERAndRE: drop whole
+# encoder layers and remove attention heads, ranked by head importance on a
+# validation set (the gradient of the loss with respect to a mask on each
+# head's output, Michel et al. 2019). Removed heads shrink the q/k/v/out
+# projections, and config.pruned_heads / the layer count are saved with the
+# weights, so the pruned checkpoint loads with the usual from_pretrained.
+#
+#   python prune.py --model-dir models/distilbert --levels 0:0 0:0.25 1:0.25 2:0.5
+#   python prune.py --model-dir models/distilbert --save-level 1:0.25 --output models/pruned
+#   python prune.py --model-dir models/combined --corpus test
+#
+# BERT_train.py checkpoints (models/combined) are scored on the windows of the
+# JSON documents BERT_train.py held out; other models on the dev records of --data.
+#
+# A level is "<layers to drop>:<fraction of the remaining heads to prune>".
+
+
+def encoder_layers(model):
+    if isinstance(model, DistilBertForNERAndRE):
+        return model.distilbert.transformer.layer
+    return model.bert.encoder.layer
+
+
+def num_heads(model):
+    return model.config.n_heads if isinstance(model, DistilBertForNERAndRE) else model.config.num_attention_heads
+
+
+def batches(examples, batch_size, pad_id=0, ignore_index=-100):
+    for start in range(0, len(examples), batch_size):
+        yield pad_examples(examples[start:start + batch_size], pad_id, ignore_index)
+
+
+def model_losses(model, batch, device, head_mask=None, ignore_index=-100):
+    outputs = model(
+        input_ids=batch["input_ids"].to(device),
+        attention_mask=batch["attention_mask"].to(device),
+        head_mask=head_mask,
+    )
+    ner_loss = F.cross_entropy(
+        outputs["ner_logits"].reshape(-1, model.num_ner_labels),
+        batch["ner_labels"].to(device).reshape(-1),
+        ignore_index=ignore_index,
+    )
+    # Relation logits from the span pooling both models share
+    re_logits = span_re_logits(model.re_classifier, outputs["sequence_output"], batch["re_spans"])
+    re_loss = F.cross_entropy(re_logits.reshape(-1, model.num_re_labels), batch["re_labels"].to(device).reshape(-1), ignore_index=-1)
+    return outputs, re_logits, ner_loss, re_loss
+
+
+def head_importance(model, examples, batch_size=16, device=None, pad_id=0, ignore_index=-100):
+    """[num_layers, num_heads] importance of each attention head, normalized per layer."""
+    if model.config.pruned_heads:
+        raise ValueError("Head importance needs an unpruned model; prune from the original checkpoint")
+    device = device or next(model.parameters()).device
+    model.eval()
+    head_mask = torch.ones(len(encoder_layers(model)), num_heads(model), device=device, requires_grad=True)
+    importance = torch.zeros_like(head_mask)
+    for batch in batches(examples, batch_size, pad_id, ignore_index):
+        _, _, ner_loss, re_loss = model_losses(model, batch, device, head_mask, ignore_index)
+        loss = ner_loss + re_loss
+        (grad,) = torch.autograd.grad(loss, head_mask)
+        importance += grad.abs().detach()
+    model.zero_grad(set_to_none=True)
+    return importance / importance.norm(dim=-1, keepdim=True).clamp(min=1e-12)
+
+
+def drop_layers(model, keep):
+    """Keep only the encoder layers in `keep`, renumbering them and any pruned heads."""
+    keep = sorted(keep)
+    layers = encoder_layers(model)
+    kept = nn.ModuleList([layers[i] for i in keep])
+    if isinstance(model, DistilBertForNERAndRE):
+        model.distilbert.transformer.layer = kept
+        model.distilbert.transformer.n_layers = len(keep)
+        model.config.n_layers = len(keep)
+    else:
+        model.bert.encoder.layer = kept
+        model.config.num_hidden_layers = len(keep)
+    model.config.pruned_heads = {keep.index(i): heads for i, heads in model.config.pruned_heads.items() if i in keep}
+    return model
+
+
+def prune_model(model, importance, drop=0, head_fraction=0.0):
+    """A pruned copy of model: the `drop` least important layers removed, then the
+    least important `head_fraction` of the remaining heads (at least one head stays per layer)."""
+    model = copy.deepcopy(model)
+    layer_scores = importance.mean(dim=-1)
+    keep = sorted(layer_scores.argsort(descending=True)[:len(layer_scores) - drop].tolist())
+    drop_layers(model, keep)
+
+    scores = importance[keep]
+    to_prune = int(round(head_fraction * scores.numel()))
+    heads = {}
+    for flat in scores.flatten().argsort().tolist():
+        if to_prune == 0:
+            break
+        layer, head = divmod(flat, scores.size(1))
+        if len(heads.get(layer, [])) < scores.size(1) - 1:
+            heads.setdefault(layer, []).append(head)
+            to_prune -= 1
+    if heads:
+        model.prune_heads(heads)
+    return model
+
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+
+def warm_up(model, evaluator):
+    # One untimed batch so kernel selection and allocator growth are not measured
+    batch = evaluator.batches[0]
+    with torch.inference_mode():
+        model(input_ids=batch["input_ids"].to(evaluator.device), attention_mask=batch["attention_mask"].to(evaluator.device))
+
+
+def parse_level(level):
+    drop, fraction = level.split(":")
+    return int(drop), float(fraction)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prune attention heads and drop layers from a trained NER + RE model")
+    parser.add_argument("--model-dir", default="models/distilbert")
+    parser.add_argument("--data", default="preprocessed_re_data.pkl", help="The preprocessed pickle or a records.py .npz")
+    parser.add_argument("--corpus", default="test", help="JSON documents a BERT_train.py checkpoint was trained on")
+    parser.add_argument("--dev-fraction", type=float, default=0.1)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--levels", nargs="+", default=["0:0", "0:0.25", "0:0.5", "1:0.25", "2:0.5"],
+                        help="<layers to drop>:<fraction of remaining heads to prune>")
+    parser.add_argument("--save-level", default=None, help="Save this level's model to --output")
+    parser.add_argument("--output", default="models/pruned")
+    parser.add_argument("--report", default=None, help="Write the F1 / latency / size table to this JSON file")
+    parser.add_argument("--tiny", choices=["bert", "distilbert"], default=None, help="Tiny random-init model on synthetic data")
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.tiny:
+        tokenizer = tiny_tokenizer()
+        label_to_id = {f"L{i}": i for i in range(5)}
+        relation_to_id = {f"R{i}": i for i in range(3)}
+        if args.tiny == "distilbert":
+            config = tiny_distilbert_config(len(tokenizer))
+            config.n_layers = 3
+            model = DistilBertForNERAndRE(config, len(label_to_id), len(relation_to_id))
+        else:
+            config = tiny_bert_config(len(tokenizer))
+            config.num_hidden_layers = 3
+            model = BertForNERAndRE(config, len(label_to_id), len(relation_to_id))
+        val_examples = tiny_examples(len(tokenizer), len(label_to_id), len(relation_to_id), count=32)
+        ignore_index = -100
+    else:
+        label_to_id, relation_to_id = load_label_maps(args.model_dir)
+        model = load_model(args.model_dir, len(label_to_id), len(relation_to_id), trainable=True)
+        tokenizer = load_tokenizer(args.model_dir)
+        label_scheme = getattr(model.config, "label_scheme", None)
+        if label_scheme is not None:
+            # BERT_train.py's B-/I- labels, with subword pieces and special tokens at -100
+            ignore_index = -100
+            val_examples = dev_window_examples(args.corpus, tokenizer, label_to_id, relation_to_id, label_scheme, args.dev_fraction)
+        else:
+            # Same ignore index as DistiliBERT_train.py
+            ignore_index = max(label_to_id.values())
+            examples, keys = load_examples(args.data, tokenizer, label_to_id, relation_to_id, ignore_index)
+            # The same dev split the training scripts hold out
+            _, dev_indices = split_dataset(range(len(keys)), lambda i: keys[i], args.dev_fraction)
+            val_examples = [examples[i] for i in dev_indices]
+    model.to(device)
+
+    evaluator = Evaluator(
+        val_examples,
+        {v: k for k, v in label_to_id.items()},
+        batch_size=args.batch_size,
+        device=device,
+        pad_id=tokenizer.pad_token_id,
+        ignore_index=ignore_index,
+        re_negative=relation_to_id.get("no_relation"),
+    )
+    importance = head_importance(model, val_examples, args.batch_size, device, tokenizer.pad_token_id, ignore_index)
+    print("Head importance (rows are layers):")
+    for layer, scores in enumerate(importance.tolist()):
+        print(f"  {layer}: " + " ".join(f"{s:.2f}" for s in scores))
+
+    levels = list(args.levels)
+    if args.save_level is not None and args.save_level not in levels:
+        levels.append(args.save_level)
+    base_parameters = count_parameters(model)
+    report = []
+    print(f"{'level':>8s} {'layers':>6s} {'heads':>6s} {'params':>10s} {'ms/ex':>8s} {'NER F1':>7s} {'RE F1':>7s}")
+    for level in levels:
+        drop, fraction = parse_level(level)
+        pruned = prune_model(model, importance, drop, fraction)
+        warm_up(pruned, evaluator)
+        result = evaluator.evaluate(pruned)
+        result["ms_per_example"] = 1000 * result["seconds"] / len(evaluator)
+        layers = encoder_layers(pruned)
+        heads = sum(num_heads(pruned) - len(pruned.config.pruned_heads.get(i, [])) for i in range(len(layers)))
+        result.update({"level": level, "layers": len(layers), "heads": heads, "parameters": count_parameters(pruned)})
+        report.append(result)
+        print(f"{level:>8s} {len(layers):6d} {heads:6d} {result['parameters'] / base_parameters:10.1%} "
+              f"{result['ms_per_example']:8.2f} {result['ner_f1']:7.3f} {result['re_f1']:7.3f}")
+
+        if level == args.save_level:
+            os.makedirs(args.output, exist_ok=True)
+            pruned.save_pretrained(args.output, safe_serialization=True)
+            tokenizer.save_pretrained(args.output)
+            with open(os.path.join(args.output, "label_to_id.json"), "w") as f:
+                json.dump(label_to_id, f)
+            with open(os.path.join(args.output, "relation_to_id.json"), "w") as f:
+                json.dump(relation_to_id, f)
+            store_path = os.path.join(args.model_dir, "entity_dict.sqlite")
+            if not args.tiny and os.path.exists(store_path):
+                shutil.copy(store_path, args.output)
+            print(f"Saved level {level} to {args.output}")
+        del pruned
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,242 @@
+import os
+import sys
+import pickle
+import argparse
+import numpy as np
+from packing import record_relations
+
+# Compact storage for the preprocessed RE records. preprocessed_re_data.pkl keeps
+# every sentence as 128 wordpiece strings (padding included) next to the entity
+# texts and relation name of each relation, which costs several KB per record
+# in memory and minutes to unpickle. A RecordStore keeps the same data as a few
+# flat numpy arrays (struct of arrays):
+#
+#   token_ids        int32  all sentences' token ids back to back, no padding
+#   token_offsets    int64  sentence i is token_ids[token_offsets[i]:token_offsets[i + 1]]
+#   spans            int16  [relations, 4] subject start/end, object start/end
+#   relation_ids     int16  relation label ids
+#   subject_ids      int32  NER label ids of the subject / object texts
+#   object_ids       int32
+#   relation_offsets int64  record i's relations are rows relation_offsets[i]:relation_offsets[i + 1]
+#
+# plus the label and relation names, so the ids need no side files. Convert an
+# existing pickle with
+#
+#   python records.py preprocessed_re_data.pkl preprocessed_re_data.npz
+
+
+def sentence_key(tokens):
+    """The split key of a sentence: its wordpieces without padding."""
+    return " ".join(token for token in tokens if token != "[PAD]")
+
+
+class RERecord:
+    """One sentence and its relations, as views into a RecordStore's arrays."""
+
+    __slots__ = ("token_ids", "spans", "relation_ids", "subject_ids", "object_ids")
+
+    def __init__(self, token_ids, spans, relation_ids, subject_ids, object_ids):
+        self.token_ids = token_ids
+        self.spans = spans
+        self.relation_ids = relation_ids
+        self.subject_ids = subject_ids
+        self.object_ids = object_ids
+
+    def __len__(self):
+        return len(self.relation_ids)
+
+
+class RecordStore:
+    fields = ("token_ids", "token_offsets", "spans", "relation_ids", "subject_ids", "object_ids", "relation_offsets")
+
+    def __init__(self, arrays, label_names, relation_names):
+        for field in self.fields:
+            setattr(self, field, arrays[field])
+        self.label_names = list(label_names)
+        self.relation_names = list(relation_names)
+
+    @classmethod
+    def from_records(cls, records, tokenizer, label_to_id, relation_to_id):
+        token_ids, token_offsets = [], [0]
+        spans, relation_ids, subject_ids, object_ids, relation_offsets = [], [], [], [], [0]
+        for record in records:
+            tokens = [token for token in record["sentence_tokens"] if token != tokenizer.pad_token]
+            token_ids.extend(tokenizer.convert_tokens_to_ids(tokens))
+            token_offsets.append(len(token_ids))
+            for rel in record_relations(record):
+                spans.append((rel["subject_start_idx"], rel["subject_end_idx"], rel["object_start_idx"], rel["object_end_idx"]))
+                relation_ids.append(relation_to_id[rel["rel_name"]])
+                subject_ids.append(label_to_id[rel["subject_text"]])
+                object_ids.append(label_to_id[rel["object_text"]])
+            relation_offsets.append(len(relation_ids))
+
+        if spans and max(max(span) for span in spans) > np.iinfo(np.int16).max:
+            raise ValueError("Span indices do not fit in int16")
+        if relation_ids and max(relation_ids) > np.iinfo(np.int16).max:
+            raise ValueError("Relation ids do not fit in int16")
+        arrays = {
+            "token_ids": np.array(token_ids, dtype=np.int32),
+            "token_offsets": np.array(token_offsets, dtype=np.int64),
+            "spans": np.array(spans, dtype=np.int16).reshape(-1, 4),
+            "relation_ids": np.array(relation_ids, dtype=np.int16),
+            "subject_ids": np.array(subject_ids, dtype=np.int32),
+            "object_ids": np.array(object_ids, dtype=np.int32),
+            "relation_offsets": np.array(relation_offsets, dtype=np.int64),
+        }
+        label_names = [label for label, _ in sorted(label_to_id.items(), key=lambda item: item[1])]
+        relation_names = [relation for relation, _ in sorted(relation_to_id.items(), key=lambda item: item[1])]
+        return cls(arrays, label_names, relation_names)
+
+    def save(self, path):
+        np.savez(
+            path,
+            label_names=np.array(self.label_names, dtype=str),
+            relation_names=np.array(self.relation_names, dtype=str),
+            **{field: getattr(self, field) for field in self.fields},
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({field: data[field] for field in cls.fields}, data["label_names"].tolist(), data["relation_names"].tolist())
+
+    @property
+    def label_to_id(self):
+        return {label: i for i, label in enumerate(self.label_names)}
+
+    @property
+    def relation_to_id(self):
+        return {relation: i for i, relation in enumerate(self.relation_names)}
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, field).nbytes for field in self.fields)
+
+    def __len__(self):
+        return len(self.token_offsets) - 1
+
+    def __getitem__(self, idx):
+        tokens = slice(self.token_offsets[idx], self.token_offsets[idx + 1])
+        relations = slice(self.relation_offsets[idx], self.relation_offsets[idx + 1])
+        return RERecord(
+            self.token_ids[tokens],
+            self.spans[relations],
+            self.relation_ids[relations],
+            self.subject_ids[relations],
+            self.object_ids[relations],
+        )
+
+    def lengths(self):
+        return np.diff(self.token_offsets)
+
+    def sentence_key(self, idx, tokenizer):
+        return sentence_key(tokenizer.convert_ids_to_tokens(self[idx].token_ids.tolist()))
+
+    def example(self, idx, ignore_index):
+        """Record idx in packing.record_to_example's format."""
+        record = self[idx]
+        ner_labels = np.full(len(record.token_ids), ignore_index, dtype=np.int64)
+        relations = []
+        for (subject_start, subject_end, object_start, object_end), relation_id, subject_id, object_id in zip(
+            record.spans.tolist(), record.relation_ids.tolist(), record.subject_ids.tolist(), record.object_ids.tolist()
+        ):
+            ner_labels[subject_start:subject_end + 1] = subject_id
+            ner_labels[object_start:object_end + 1] = object_id
+            relations.append({
+                "subject_start_idx": subject_start,
+                "subject_end_idx": subject_end,
+                "object_start_idx": object_start,
+                "object_end_idx": object_end,
+                "label": relation_id,
+            })
+        return {"input_ids": record.token_ids.tolist(), "ner_labels": ner_labels.tolist(), "relations": relations}
+
+    def examples(self, ignore_index, indices=None):
+        return ExampleView(self, ignore_index, indices)
+
+
+class ExampleView:
+    """A sequence of record_to_example-style examples built from a RecordStore on access."""
+
+    def __init__(self, store, ignore_index, indices=None):
+        self.store = store
+        self.ignore_index = ignore_index
+        self.indices = np.arange(len(store)) if indices is None else np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self.store.example(i, self.ignore_index) for i in self.indices[idx].tolist()]
+        return self.store.example(int(self.indices[idx]), self.ignore_index)
+
+
+def load_examples(path, tokenizer, label_to_id, relation_to_id, ignore_index):
+    """(examples, split keys) from a preprocessed pickle or a .npz RecordStore."""
+    if path.endswith(".npz"):
+        store = RecordStore.load(path)
+        if store.label_to_id != label_to_id or store.relation_to_id != relation_to_id:
+            raise ValueError(f"{path} was converted with different label ids; convert it again")
+        keys = [store.sentence_key(i, tokenizer) for i in range(len(store))]
+        return store.examples(ignore_index), keys
+
+    from packing import record_to_example
+    with open(path, "rb") as f:
+        records = pickle.load(f)
+    try:
+        examples = [record_to_example(record, tokenizer, label_to_id, relation_to_id, ignore_index) for record in records]
+    except KeyError as e:
+        # e.g. a BERT_train.py checkpoint, whose B-/I- labels come from the JSON corpus
+        raise ValueError(f"{path} has the label {e} the model does not know; use a model trained on preprocess.py's "
+                         f"label_to_id.pkl / relation_to_id.pkl (DistiliBERT_train.py)") from None
+    return examples, [sentence_key(record["sentence_tokens"]) for record in records]
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate in-memory size of nested dicts / lists / __slots__ objects / strings / ints."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif isinstance(obj, np.ndarray):
+        size += obj.nbytes
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, name), seen) for name in obj.__slots__)
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert preprocessed RE pickles to a compact RecordStore")
+    parser.add_argument("input", nargs="?", default="preprocessed_re_data.pkl")
+    parser.add_argument("output", nargs="?", default="preprocessed_re_data.npz")
+    parser.add_argument("--tokenizer", default="distilbert-base-uncased")
+    parser.add_argument("--label-to-id", default="label_to_id.pkl")
+    parser.add_argument("--relation-to-id", default="relation_to_id.pkl")
+    args = parser.parse_args()
+
+    from transformers import DistilBertTokenizerFast
+
+    tokenizer = DistilBertTokenizerFast.from_pretrained(args.tokenizer)
+    with open(args.input, "rb") as f:
+        records = pickle.load(f)
+    with open(args.label_to_id, "rb") as f:
+        label_to_id = pickle.load(f)
+    with open(args.relation_to_id, "rb") as f:
+        relation_to_id = pickle.load(f)
+
+    store = RecordStore.from_records(records, tokenizer, label_to_id, relation_to_id)
+    store.save(args.output)
+
+    # Deep-size a sample; the whole list can be too large to walk
+    sample = records[:1000]
+    pickle_bytes = deep_sizeof(sample) / max(len(sample), 1)
+    compact_bytes = store.nbytes / max(len(store), 1)
+    print(f"Converted {len(store)} records ({len(store.relation_ids)} relations) to {args.output}")
+    print(f"  in memory: {pickle_bytes:.0f} bytes per record as dicts, {compact_bytes:.0f} compact ({pickle_bytes / max(compact_bytes, 1):.0f}x)")
+    print(f"  on disk:   {os.path.getsize(args.input) / 2 ** 20:.1f} MB pickle, {os.path.getsize(args.output) / 2 ** 20:.1f} MB npz")
@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import random
+import argparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Typed corpus documents. Every loader used to json.load a document into
+# nested dicts, check a few keys in validate_json and then hit KeyError (or
+# worse, a silently wrong offset) on anything else. decode_document parses and
+# validates in one pass and returns small __slots__ objects:
+#
+#   Document(text, entities, relations)
+#   Entity(entity_id, entity_type, entity_name, begin, end)   span may be absent (None)
+#   Relation(subject_id, object_id, rel_name)
+#
+# Ids are strings; the corpus's inconsistent casing (subjectID / objectId) is
+# accepted either way. Anything malformed raises SchemaError with the path of
+# the offending field. orjson is used when installed, the json module otherwise.
+#
+#   python schema.py test     decode throughput against json.load + validate_json
+
+backend = "orjson" if orjson is not None else "json"
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class Entity:
+    __slots__ = ("entity_id", "entity_type", "entity_name", "begin", "end")
+
+    def __init__(self, entity_id, entity_type, entity_name, begin=None, end=None):
+        self.entity_id = entity_id
+        self.entity_type = entity_type
+        self.entity_name = entity_name
+        self.begin = begin
+        self.end = end
+
+    @property
+    def has_span(self):
+        return self.begin is not None
+
+
+class Relation:
+    __slots__ = ("subject_id", "object_id", "rel_name")
+
+    def __init__(self, subject_id, object_id, rel_name):
+        self.subject_id = subject_id
+        self.object_id = object_id
+        self.rel_name = rel_name
+
+
+class Document:
+    __slots__ = ("text", "entities", "relations")
+
+    def __init__(self, text, entities, relations):
+        self.text = text
+        self.entities = entities
+        self.relations = relations
+
+    def to_json(self):
+        """The document in the corpus's JSON layout, with the canonical key names."""
+        entities = []
+        for entity in self.entities:
+            raw = {"entityId": entity.entity_id, "entityType": entity.entity_type, "entityName": entity.entity_name}
+            if entity.has_span:
+                raw["span"] = {"begin": entity.begin, "end": entity.end}
+            entities.append(raw)
+        relations = [
+            {"subjectID": relation.subject_id, "objectId": relation.object_id, "rel_name": relation.rel_name}
+            for relation in self.relations
+        ]
+        return {"text": self.text, "entities": entities, "relation_info": relations}
+
+
+def _field(raw, keys, path, kind=str):
+    for key in keys:
+        if key in raw:
+            value = raw[key]
+            break
+    else:
+        raise SchemaError(f"{path}: missing {keys[0]}")
+    if type(value) is kind:
+        return value
+    # Numeric ids are read as strings, so subject / object ids always match entity ids
+    if kind is str and type(value) is int:
+        return str(value)
+    raise SchemaError(f"{path}.{key}: expected {kind.__name__}, got {type(value).__name__}")
+
+
+def _list(raw, key, path):
+    value = raw.get(key)
+    if value is None:
+        return []
+    if type(value) is not list:
+        raise SchemaError(f"{path}{key}: expected a list, got {type(value).__name__}")
+    return value
+
+
+def _entity(raw, text_length, path):
+    if type(raw) is not dict:
+        raise SchemaError(f"{path}: expected an object, got {type(raw).__name__}")
+    entity_id = _field(raw, ("entityId",), path)
+    entity_type = _field(raw, ("entityType",), path)
+    entity_name = _field(raw, ("entityName",), path)
+    span = raw.get("span")
+    if span is None:
+        return Entity(entity_id, entity_type, entity_name)
+    if type(span) is not dict:
+        raise SchemaError(f"{path}.span: expected an object, got {type(span).__name__}")
+    begin = _field(span, ("begin",), path + ".span", int)
+    end = _field(span, ("end",), path + ".span", int)
+    if not 0 <= begin <= end <= text_length:
+        raise SchemaError(f"{path}.span: [{begin}, {end}) is outside the text (length {text_length})")
+    return Entity(entity_id, entity_type, entity_name, begin, end)
+
+
+def _relation(raw, path):
+    if type(raw) is not dict:
+        raise SchemaError(f"{path}: expected an object, got {type(raw).__name__}")
+    return Relation(
+        _field(raw, ("subjectID", "subjectId"), path),
+        _field(raw, ("objectId", "objectID"), path),
+        _field(raw, ("rel_name",), path),
+    )
+
+
+def parse(data):
+    """Parse JSON text or bytes with the fastest available backend."""
+    try:
+        return orjson.loads(data) if orjson is not None else json.loads(data)
+    except ValueError as e:
+        raise SchemaError(f"invalid JSON: {e}") from None
+
+
+def _checked(raw):
+    """Validate a parsed document field by field, reporting the first problem."""
+    if type(raw) is not dict:
+        raise SchemaError(f"document: expected an object, got {type(raw).__name__}")
+    text = _field(raw, ("text",), "document")
+    entities = [_entity(entity, len(text), f"entities[{i}]") for i, entity in enumerate(_list(raw, "entities", ""))]
+    relations = [_relation(relation, f"relation_info[{i}]") for i, relation in enumerate(_list(raw, "relation_info", ""))]
+    return Document(text, entities, relations)
+
+
+def from_json(raw):
+    """Validate an already parsed document."""
+    # Fast path for well-formed documents with the usual key names and types;
+    # anything unexpected goes through _checked, which also builds the error
+    try:
+        text = raw["text"]
+        text_length = len(text)
+        entities = []
+        for entity in raw.get("entities") or ():
+            entity_id, entity_type, entity_name = entity["entityId"], entity["entityType"], entity["entityName"]
+            span = entity.get("span")
+            if span is None:
+                begin = end = None
+            else:
+                begin, end = span["begin"], span["end"]
+                if type(begin) is not int or type(end) is not int or not 0 <= begin <= end <= text_length:
+                    return _checked(raw)
+            if type(entity_id) is not str or type(entity_type) is not str or type(entity_name) is not str:
+                return _checked(raw)
+            entities.append(Entity(entity_id, entity_type, entity_name, begin, end))
+        relations = []
+        for relation in raw.get("relation_info") or ():
+            subject_id, object_id, rel_name = relation["subjectID"], relation["objectId"], relation["rel_name"]
+            if type(subject_id) is not str or type(object_id) is not str or type(rel_name) is not str:
+                return _checked(raw)
+            relations.append(Relation(subject_id, object_id, rel_name))
+        if type(text) is not str or type(raw.get("entities", [])) is not list or type(raw.get("relation_info", [])) is not list:
+            return _checked(raw)
+    except (KeyError, TypeError, AttributeError):
+        return _checked(raw)
+    return Document(text, entities, relations)
+
+
+def decode_document(data):
+    return from_json(parse(data))
+
+
+def load_document(path):
+    with open(path, "rb") as f:
+        return decode_document(f.read())
+
+
+def iter_documents(json_dir, file_names=None):
+    """(path, Document) for the .json files of json_dir; invalid files are reported and skipped."""
+    if file_names is None:
+        file_names = os.listdir(json_dir)
+    for file_name in file_names:
+        if not file_name.endswith(".json"):
+            continue
+        path = os.path.join(json_dir, file_name)
+        try:
+            yield path, load_document(path)
+        except (SchemaError, OSError) as e:
+            print(f"Skipping {path}: {e}")
+
+
+def synthetic_documents(count, seed=0):
+    """Corpus-shaped JSON documents for benchmarking without the corpus."""
+    rng = random.Random(seed)
+    words = ["protein", "binds", "the", "receptor", "in", "cells", "and", "inhibits", "growth", "of", "tumour"]
+    documents = []
+    for d in range(count):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(100, 400)))
+        entities = []
+        for e in range(rng.randint(5, 20)):
+            begin = rng.randrange(len(text) - 10)
+            entities.append({"entityId": f"E{d}_{e}", "entityType": rng.choice(["GENE", "DISEASE", "CHEMICAL"]),
+                             "entityName": f"name{rng.randrange(1000)}", "span": {"begin": begin, "end": begin + rng.randint(1, 10)}})
+        relations = [{"subjectID": rng.choice(entities)["entityId"], "objectId": rng.choice(entities)["entityId"], "rel_name": rng.choice(["binds", "inhibits"])}
+                     for _ in range(rng.randint(1, 10))]
+        documents.append(json.dumps({"text": text, "entities": entities, "relation_info": relations}).encode("utf-8"))
+    return documents
+
+
+def legacy_decode(data):
+    # The path the loaders used before: json.load from a text file into dicts,
+    # then validate_json's key checks
+    json_data = json.loads(data.decode("utf-8"))
+    if "entities" not in json_data or "relation_info" not in json_data or "text" not in json_data:
+        return None
+    return json_data
+
+
+def throughput(decode, blobs, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for blob in blobs:
+            decode(blob)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark typed document decoding against json.load")
+    parser.add_argument("json_dir", nargs="?", default="test")
+    parser.add_argument("--limit", type=int, default=5000, help="Documents to decode")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.json_dir):
+        blobs = []
+        for file_name in sorted(os.listdir(args.json_dir)):
+            if file_name.endswith(".json") and len(blobs) < args.limit:
+                with open(os.path.join(args.json_dir, file_name), "rb") as f:
+                    blobs.append(f.read())
+    else:
+        print(f"No {args.json_dir} directory; using synthetic documents")
+        blobs = synthetic_documents(args.limit)
+
+    # Files are read up front, so only decoding is timed
+    megabytes = sum(len(blob) for blob in blobs) / 2 ** 20
+    candidates = [("json.load + validate_json", legacy_decode), ("schema, json backend", lambda blob: from_json(json.loads(blob)))]
+    if orjson is not None:
+        candidates.append(("schema, orjson backend", decode_document))
+    baseline = None
+    for name, decode in candidates:
+        seconds = throughput(decode, blobs, args.repeat)
+        baseline = baseline or seconds
+        print(f"{name:>26s}: {len(blobs) / seconds:9.0f} docs/s {megabytes / seconds:7.1f} MB/s ({baseline / seconds:.2f}x)")
+
+    from records import deep_sizeof
+    sample = blobs[:1000]
+    dict_bytes = sum(deep_sizeof(json.loads(blob)) for blob in sample) / len(sample)
+    typed_bytes = sum(deep_sizeof(decode_document(blob)) for blob in sample) / len(sample)
+    print(f"In memory: {dict_bytes:.0f} bytes per document as dicts, {typed_bytes:.0f} typed")
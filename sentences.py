@@ -0,0 +1,70 @@
+from bisect import bisect_right
+
+# Sentence segmentation shared by preprocessing and inference. Each document is
+# segmented once into a sorted array of sentence start offsets; finding the
+# sentence around a span is then a bisect lookup instead of a rescan of the text.
+
+# Abbreviations common in biomedical abstracts that should not end a sentence.
+# Punkt checks one token at a time, so "et al." is covered by "al"
+extra_abbreviations = ["e.g", "i.e", "al", "etc", "fig", "figs", "vs", "approx", "ca", "cf", "resp", "no", "ref", "refs"]
+
+_punkt = None
+
+
+def get_sentence_tokenizer():
+    """Load the punkt sentence tokenizer on first use and reuse it afterwards."""
+    global _punkt
+    if _punkt is None:
+        import nltk
+        from nltk.tokenize.punkt import PunktSentenceTokenizer
+
+        try:
+            _punkt = nltk.data.load("tokenizers/punkt/english.pickle")
+        except LookupError:
+            # Untrained punkt still handles decimals and initials; the extra
+            # abbreviations below cover the rest
+            _punkt = PunktSentenceTokenizer()
+        _punkt._params.abbrev_types.update(extra_abbreviations)
+    return _punkt
+
+
+def sentence_boundaries(text):
+    """Return sorted sentence start offsets for `text`, with len(text) appended.
+
+    Sentence i covers text[boundaries[i]:boundaries[i + 1]].
+    """
+    starts = [start for start, _ in get_sentence_tokenizer().span_tokenize(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    return starts
+
+
+def sentence_index(boundaries, offset):
+    """Index of the sentence containing character `offset`."""
+    return min(max(bisect_right(boundaries, offset) - 1, 0), len(boundaries) - 2)
+
+
+def sentence_span(boundaries, start, end=None):
+    """Return the (start, end) offsets of the sentence(s) covering text[start:end].
+
+    A span that crosses a sentence boundary returns all the sentences it touches.
+    """
+    if end is None:
+        end = start + 1
+    first = sentence_index(boundaries, start)
+    last = sentence_index(boundaries, max(end - 1, start))
+    return boundaries[first], boundaries[last + 1]
+
+
+def split_sentences(text, boundaries=None):
+    """Return (start, sentence) pairs with surrounding whitespace stripped."""
+    if boundaries is None:
+        boundaries = sentence_boundaries(text)
+    sentences = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        chunk = text[start:end]
+        stripped = chunk.lstrip()
+        if stripped.strip():
+            sentences.append((start + len(chunk) - len(stripped), stripped.rstrip()))
+    return sentences
@@ -0,0 +1,277 @@
+import json
+import time
+import signal
+import asyncio
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from inference import Predictor
+from memory import MemoryBudget
+from autotune import apply_profile
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+logger = logging.getLogger("serve")
+
+# asyncio HTTP front end for NER + RE. Concurrent requests are collected by a
+# dynamic micro-batcher into one forward pass of up to max_batch_size texts,
+# waiting at most max_wait_ms for a batch to fill.
+#
+#   GET  /healthz   process is up
+#   GET  /readyz    model loaded and accepting work (503 otherwise)
+#   POST /predict   {"text": "..."} or {"texts": ["...", ...]}
+
+reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+max_body_bytes = 10 * 1024 * 1024
+
+
+class MicroBatcher:
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = asyncio.Queue()
+        # One model thread: batches run back to back while the event loop keeps accepting
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model")
+        self.task = None
+        self.batches = 0
+        self.items = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, texts):
+        futures = []
+        for text in texts:
+            future = asyncio.get_running_loop().create_future()
+            await self.queue.put((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def next_batch(self):
+        item = await self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then stop
+                self.queue.put_nowait(None)
+                break
+            batch.append(item)
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            if batch is None:
+                break
+            texts = [text for text, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.predict_fn, texts)
+            except Exception as e:
+                logger.exception("Batch of %d failed", len(batch))
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    async def stop(self):
+        # Everything queued before the sentinel is still processed
+        await self.queue.put(None)
+        if self.task is not None:
+            await self.task
+        self.executor.shutdown(wait=True)
+
+
+class InferenceServer:
+    def __init__(self, load_predictor, max_batch_size=16, max_wait_ms=5.0):
+        self.load_predictor = load_predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batcher = None
+        self.ready = False
+        self.in_flight = 0
+        self.server = None
+        self.stopping = None
+        self.load_error = None
+
+    async def load(self):
+        try:
+            predictor = await asyncio.get_running_loop().run_in_executor(None, self.load_predictor)
+        except Exception as e:
+            # A server that can never become ready is stopped instead of left up
+            logger.exception("Model load failed, stopping")
+            self.load_error = e
+            self.stopping.set()
+            return
+        self.batcher = MicroBatcher(predictor.predict_batch, self.max_batch_size, self.max_wait_ms)
+        self.batcher.start()
+        self.ready = True
+        logger.info("Model loaded, ready")
+
+    async def handle_predict(self, body):
+        try:
+            payload = json.loads(body or b"{}")
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"invalid JSON: {e}"}
+        if not isinstance(payload, dict):
+            return 400, {"error": "expected a JSON object"}
+        if isinstance(payload.get("texts"), list) and all(isinstance(t, str) for t in payload["texts"]):
+            texts = payload["texts"]
+        elif isinstance(payload.get("text"), str):
+            texts = [payload["text"]]
+        else:
+            return 400, {"error": "expected {\"text\": str} or {\"texts\": [str, ...]}"}
+
+        results = await self.batcher.submit(texts)
+        if "texts" in payload:
+            return 200, {"results": results}
+        return 200, results[0]
+
+    async def route(self, method, path, body):
+        if path == "/healthz":
+            return 200, {"status": "ok"}
+        if path == "/readyz":
+            if self.ready:
+                return 200, {"status": "ready"}
+            return 503, {"status": "not ready"}
+        if path == "/stats":
+            batcher = self.batcher
+            return 200, {
+                "batches": batcher.batches if batcher else 0,
+                "items": batcher.items if batcher else 0,
+                "in_flight": self.in_flight,
+            }
+        if path == "/predict":
+            if method != "POST":
+                return 405, {"error": "use POST"}
+            if not self.ready:
+                return 503, {"error": "not ready"}
+            return await self.handle_predict(body)
+        return 404, {"error": f"unknown path {path}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "malformed request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0) or 0)
+                if length > max_body_bytes:
+                    await self.respond(writer, 413, {"error": "body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                keep_alive = headers.get("connection", "keep-alive").lower() != "close" and not self.stopping.is_set()
+
+                self.in_flight += 1
+                try:
+                    status, payload = await self.route(method, path.split("?", 1)[0], body)
+                except Exception as e:
+                    logger.exception("Request failed")
+                    status, payload = 500, {"error": str(e)}
+                finally:
+                    self.in_flight -= 1
+
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        body = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def serve(self, host, port):
+        self.stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info("Listening on %s:%d", host, port)
+        load_task = loop.create_task(self.load())
+
+        await self.stopping.wait()
+        logger.info("Shutting down")
+
+        # Stop accepting connections and report not ready, then let queued work finish
+        self.ready = False
+        # (idle keep-alive connections are not waited for)
+        self.server.close()
+        await load_task
+        while self.in_flight > 0:
+            await asyncio.sleep(0.01)
+        if self.batcher is not None:
+            await self.batcher.stop()
+            logger.info("Stopped after %d batches / %d texts", self.batcher.batches, self.batcher.items)
+
+
+if __name__ == "__main__":
+    tuning = apply_profile("inference", {"tokenizers_parallelism": None, "intra_op_threads": None, "inter_op_threads": None, "batch_size": 16})
+
+    parser = argparse.ArgumentParser(description="Serve NER + RE over HTTP with dynamic micro-batching")
+    parser.add_argument("--model-dir", default="models/combined")
+    parser.add_argument("--tiny", action="store_true", help="Serve a tiny random-init model (no checkpoint needed)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=tuning["batch_size"])
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--memory-budget-mb", type=float, default=None, help="Split or truncate batches whose estimated activations exceed this")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    def load_predictor():
+        if args.tiny:
+            predictor = Predictor.tiny(max_length=min(args.max_length, 512))
+        else:
+            predictor = Predictor.from_pretrained(args.model_dir, max_length=args.max_length)
+        if args.memory_budget_mb:
+            predictor.memory_budget = MemoryBudget(
+                args.memory_budget_mb, predictor.model.config, len(predictor.id_to_label), training=False
+            )
+        return predictor
+
+    server = InferenceServer(load_predictor, args.max_batch_size, args.max_wait_ms)
+    asyncio.run(server.serve(args.host, args.port))
+    if server.load_error is not None:
+        raise SystemExit(1)
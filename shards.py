@@ -0,0 +1,282 @@
+import os
+import bz2
+import gzip
+import json
+import lzma
+import time
+import random
+import argparse
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from evaluate import in_dev_split
+from schema import decode_document, iter_documents
+
+# Sharded JSONL corpora. Reading the test/ layout (one small .json file per
+# document) means hundreds of thousands of opens and stats before the first
+# batch, which is slow on network filesystems. A converted corpus is a
+# directory of a few large, optionally compressed JSONL shards plus an index:
+#
+#   corpus/index.json              shard names and document counts per split,
+#                                  the entity (type, name) pairs and relation names
+#   corpus/train-00000.jsonl.gz    one document per line
+#   corpus/dev-00000.jsonl.gz      held out by evaluate.in_dev_split on split_key
+#
+#   python shards.py test corpus --docs-per-shard 10000 --entity-dict
+#
+# split_key is the key BERT_train.py splits on without shards (the document's
+# NER tokens joined), so both modes hold out the same documents and their dev
+# F1 scores compare. It depends on the tokenizer, hence --tokenizer.
+#
+# ShardedJSONLDataset streams the shards: every DDP rank and DataLoader worker
+# reads its own shards, preprocesses documents as it goes and shuffles through
+# a buffer, so training starts without reading the corpus first. The label
+# vocabulary comes from the index.
+
+index_name = "index.json"
+# Recorded in the index; BERT_train.py refuses corpora split on another key
+split_key_name = "ner_tokens"
+openers = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def open_shard(path, mode="rt"):
+    opener = openers.get(os.path.splitext(path)[1], open)
+    return opener(path, mode, encoding="utf-8")
+
+
+def shard_lines(path):
+    with open_shard(path) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def load_index(corpus_dir):
+    with open(os.path.join(corpus_dir, index_name), "r") as f:
+        return json.load(f)
+
+
+class ShardWriter:
+    """Writes documents to numbered shards of at most docs_per_shard documents each."""
+
+    def __init__(self, output_dir, prefix, docs_per_shard=10000, compression="gz"):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.docs_per_shard = docs_per_shard
+        self.suffix = ".jsonl" + (f".{compression}" if compression else "")
+        self.shards = []
+        self.file = None
+
+    def write(self, document):
+        if self.file is None or self.shards[-1]["documents"] == self.docs_per_shard:
+            self.close_shard()
+            name = f"{self.prefix}-{len(self.shards):05d}{self.suffix}"
+            self.file = open_shard(os.path.join(self.output_dir, name), "wt")
+            self.shards.append({"path": name, "documents": 0})
+        self.file.write(json.dumps(document, ensure_ascii=False) + "\n")
+        self.shards[-1]["documents"] += 1
+
+    def close_shard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.close_shard()
+        return self.shards
+
+
+def split_key(document, tokenizer):
+    """The text outside entity spans plus every entity's word pieces, as BERT_train.preprocess_data's ner_data joins to."""
+    text = document.text
+    parts, current = [], 0
+    for entity in sorted((entity for entity in document.entities if entity.has_span), key=lambda entity: entity.begin):
+        if current < entity.begin:
+            parts.append(text[current:entity.begin])
+        parts.extend(tokenizer.tokenize(text[entity.begin:entity.end].strip()))
+        current = entity.end
+    parts.append(text[current:])
+    return "".join(parts)
+
+
+def convert(json_dir, output_dir, docs_per_shard=10000, compression="gz", dev_fraction=0.1, seed=0, tokenizer=None):
+    """Convert a directory of .json documents to a sharded corpus; returns its index.
+
+    tokenizer is the training tokenizer, needed for the dev split key.
+    """
+    if tokenizer is None and dev_fraction > 0:
+        raise ValueError("A dev split needs the training tokenizer")
+    os.makedirs(output_dir, exist_ok=True)
+    writers = {split: ShardWriter(output_dir, split, docs_per_shard, compression) for split in ("train", "dev")}
+    # Dicts as ordered sets, so the vocabulary keeps first-seen order
+    entities, relations = {}, {}
+    # Only documents that pass the schema are written, so readers can decode without surprises
+    for _, document in iter_documents(json_dir, sorted(os.listdir(json_dir))):
+        for entity in document.entities:
+            entities.setdefault((entity.entity_type, entity.entity_name), None)
+        for relation in document.relations:
+            relations.setdefault(relation.rel_name, None)
+        split = "dev" if dev_fraction > 0 and in_dev_split(split_key(document, tokenizer), dev_fraction, seed) else "train"
+        writers[split].write(document.to_json())
+
+    shards = {split: writer.close() for split, writer in writers.items()}
+    index = {
+        "shards": shards,
+        "documents": {split: sum(shard["documents"] for shard in split_shards) for split, split_shards in shards.items()},
+        "dev_fraction": dev_fraction,
+        "seed": seed,
+        "split_key": split_key_name,
+        "entities": [list(entity) for entity in entities],
+        "relations": list(relations),
+    }
+    tmp_path = os.path.join(output_dir, index_name + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(output_dir, index_name))
+    return index
+
+
+def read_documents(corpus_dir, split="dev"):
+    """Every schema.Document of a split, in shard order; meant for the small dev split."""
+    for shard in load_index(corpus_dir)["shards"][split]:
+        for line in shard_lines(os.path.join(corpus_dir, shard["path"])):
+            yield decode_document(line)
+
+
+def as_item(document):
+    return [document]
+
+
+def shuffled(items, buffer_size, rng):
+    """Approximate shuffle: emit a random element of a buffer of buffer_size items."""
+    buffer = []
+    for item in items:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        i = rng.randrange(buffer_size)
+        yield buffer[i]
+        buffer[i] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+class ShardedJSONLDataset(IterableDataset):
+    """Streams the training items of a sharded corpus.
+
+    transform(document) returns the items of one schema.Document (a possibly
+    empty list) and runs inside the DataLoader workers. Shards are split across DDP
+    ranks and workers; with fewer shards than readers, every reader goes
+    through all shards and keeps every n-th document instead.
+
+    Like checkpoint.ResumableSampler, the order depends only on (seed, epoch)
+    and set_epoch(epoch, start_index) skips the first start_index items of an
+    epoch, so the dataset can be passed to the training loop as its sampler.
+    Skipping assumes the DataLoader's batch_size, which it takes round-robin
+    from the workers.
+    """
+
+    def __init__(self, corpus_dir, transform=None, split="train", shuffle_buffer=10000, seed=0, shuffle=True, batch_size=1, rank=None, world_size=None):
+        self.index = load_index(corpus_dir)
+        self.shards = [os.path.join(corpus_dir, shard["path"]) for shard in self.index["shards"][split]]
+        self.num_documents = self.index["documents"][split]
+        self.transform = transform or as_item
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.shuffle = shuffle
+        self.batch_size = batch_size
+        distributed = dist.is_available() and dist.is_initialized()
+        self.rank = rank if rank is not None else (dist.get_rank() if distributed else 0)
+        self.world_size = world_size if world_size is not None else (dist.get_world_size() if distributed else 1)
+        self.items_per_document = 1.0
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "start_index": self.start_index}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.set_epoch(state["epoch"], state["start_index"])
+
+    def estimate_items_per_document(self, num_documents=100):
+        """Transform the first documents to size __len__, which the LR schedule and progress bar need."""
+        documents, items = 0, 0
+        for shard in self.shards:
+            for line in shard_lines(shard):
+                items += len(self.transform(decode_document(line)))
+                documents += 1
+                if documents == num_documents:
+                    break
+            if documents == num_documents:
+                break
+        self.items_per_document = items / max(documents, 1)
+        return self.items_per_document
+
+    def __len__(self):
+        # An estimate: the real count is only known after a full pass
+        items = round(self.num_documents / self.world_size * self.items_per_document)
+        return max(1, items - self.start_index)
+
+    def documents(self, reader, num_readers):
+        shards = list(self.shards)
+        if self.shuffle:
+            # Same seed on every reader, so they agree on the shard order
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        if len(shards) >= num_readers:
+            for shard in shards[reader::num_readers]:
+                for line in shard_lines(shard):
+                    yield decode_document(line)
+            return
+        position = 0
+        for shard in shards:
+            for line in shard_lines(shard):
+                # Only this reader's documents are parsed
+                if position % num_readers == reader:
+                    yield decode_document(line)
+                position += 1
+
+    def __iter__(self):
+        worker = get_worker_info()
+        num_workers, worker_id = (1, 0) if worker is None else (worker.num_workers, worker.id)
+        reader = self.rank * num_workers + worker_id
+        num_readers = self.world_size * num_workers
+
+        items = (item for document in self.documents(reader, num_readers) for item in self.transform(document))
+        if self.shuffle and self.shuffle_buffer > 1:
+            items = shuffled(items, self.shuffle_buffer, random.Random((self.seed + self.epoch) * 1000003 + reader))
+
+        # Resuming: skip the batches this worker contributed to the first start_index items
+        first_step = self.start_index // self.batch_size
+        skip = max(0, first_step - worker_id + num_workers - 1) // num_workers * self.batch_size
+        for i, item in enumerate(items):
+            if i >= skip:
+                yield item
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a directory of JSON documents to a sharded JSONL corpus")
+    parser.add_argument("input", nargs="?", default="test")
+    parser.add_argument("output", nargs="?", default="corpus")
+    parser.add_argument("--docs-per-shard", type=int, default=10000)
+    parser.add_argument("--compression", choices=["gz", "bz2", "xz", "none"], default="gz")
+    parser.add_argument("--dev-fraction", type=float, default=0.1, help="Documents written to the dev shards")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tokenizer", default="bert-base-uncased", help="The training tokenizer, for the dev split key")
+    parser.add_argument("--entity-dict", action="store_true", help="Also build entity_dict.sqlite in the output directory")
+    args = parser.parse_args()
+
+    from transformers import BertTokenizerFast
+    tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer)
+    start = time.perf_counter()
+    index = convert(args.input, args.output, args.docs_per_shard, None if args.compression == "none" else args.compression, args.dev_fraction, args.seed, tokenizer)
+    for split, shards in index["shards"].items():
+        print(f"{split}: {index['documents'][split]} documents in {len(shards)} shards")
+    print(f"{len(index['entities'])} entities, {len(index['relations'])} relation names ({time.perf_counter() - start:.1f}s)")
+    if args.entity_dict:
+        from dict_store import build_store
+        num_files, num_entities, num_relations = build_store(args.input, os.path.join(args.output, "entity_dict.sqlite"))
+        print(f"Entity dictionary: {num_entities} entities, {num_relations} relations from {num_files} files")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bert_data import NERRE_Dataset, preprocess_data
+from inference import tiny_tokenizer
+from schema import Document, Entity, Relation
+
+
+def encoded_document():
+    text = "Binding of IL2 to its receptor."
+    entities = [Entity("e1", "Protein", "IL2", 11, 14), Entity("e2", "Protein", "IL2R", 22, 30)]
+    relations = [Relation("e1", "e2", "binds"), Relation("e2", "e1", "binds")]
+    tokenizer = tiny_tokenizer()
+    label_to_id, relation_to_id = {}, {}
+    items = preprocess_data(Document(text, entities, relations), tokenizer, label_to_id, relation_to_id)
+    dataset = NERRE_Dataset(items, tokenizer, 16, label_to_id, relation_to_id)
+    return tokenizer, label_to_id, dataset.documents[0]
+
+
+def test_labels_line_up_with_ids_across_spaces_and_pieces():
+    tokenizer, label_to_id, document = encoded_document()
+    assert len(document['input_ids']) == len(document['ner_labels'])
+    # The text has no [UNK]s, so every "##" piece kept its own id
+    assert tokenizer.unk_token_id not in document['input_ids']
+    assert tokenizer.convert_ids_to_tokens(document['input_ids'])[:7] == ["b", "i", "n", "d", "i", "n", "g"]
+
+
+def test_relations_point_at_entity_first_tokens():
+    tokenizer, label_to_id, document = encoded_document()
+    tokens = tokenizer.convert_ids_to_tokens(document['input_ids'])
+    begins = {label_to_id["B-Protein-IL2"], label_to_id["B-Protein-IL2R"]}
+    assert len(document['re_indices']) == 1
+    for subject, obj in document['re_indices']:
+        assert {document['ner_labels'][subject], document['ner_labels'][obj]} == begins
+        assert {tokens[subject], tokens[obj]} == {"i", "r"}
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from decoding import label_maps, span_boundaries, decode_spans
+
+ID_TO_LABEL = dict(enumerate(["O", "B-Gene", "I-Gene", "B-Chemical", "I-Chemical"]))
+
+
+def test_span_boundaries_carry_pieces_and_split_on_type_changes():
+    types, begins, names = label_maps(ID_TO_LABEL)
+    # [CLS] B-Gene ##piece I-Gene O B-Chemical I-Gene [PAD]
+    labels = torch.tensor([[0, 1, 0, 2, 0, 3, 2, 0]])
+    carry = torch.tensor([[True, False, True, False, False, False, False, False]])
+    outside = torch.tensor([[False] * 7 + [True]])
+    rows, starts, ends, span_types, _ = span_boundaries(labels, types, begins, outside, carry)
+    spans = list(zip(rows.tolist(), starts.tolist(), ends.tolist(), [names[t] for t in span_types.tolist()]))
+    assert spans == [(0, 1, 3, "Gene"), (0, 5, 5, "Chemical"), (0, 6, 6, "Gene")]
+
+
+def test_decode_spans_offsets_scores_and_threshold():
+    types, begins, names = label_maps(ID_TO_LABEL)
+    # "il2 and ho": [CLS] il ##2 and ho [SEP]; the piece's own label and score do not count
+    labels = torch.tensor([[0, 1, 0, 0, 4, 0]])
+    scores = torch.tensor([[1.0, 0.9, 0.1, 0.8, 0.7, 1.0]])
+    offsets = torch.tensor([[[0, 0], [0, 2], [2, 3], [4, 7], [8, 10], [0, 0]]])
+    carry = torch.tensor([[False, False, True, False, False, False]])
+
+    spans = decode_spans(labels, scores, offsets, types, begins, carry=carry)
+    assert spans["token_start"].tolist() == [1, 4]
+    assert spans["token_end"].tolist() == [2, 4]
+    assert [names[t] for t in spans["type"].tolist()] == ["Gene", "Chemical"]
+    assert spans["score"].tolist() == pytest.approx([0.9, 0.7])
+    assert spans["char_start"].tolist() == [0, 8]
+    assert spans["char_end"].tolist() == [3, 10]
+
+    # A token below the threshold is outside every span
+    spans = decode_spans(labels, scores, offsets, types, begins, carry=carry, threshold=0.8)
+    assert [names[t] for t in spans["type"].tolist()] == ["Gene"]
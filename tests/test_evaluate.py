@@ -0,0 +1,37 @@
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from evaluate import Evaluator, extract_spans, span_label_maps
+
+
+def span_key(row, start, end, span_type, seq_len, num_labels):
+    return ((row * seq_len + start) * seq_len + end) * (num_labels + 1) + span_type
+
+
+def test_extract_spans_with_carried_pieces():
+    id_to_label = dict(enumerate(["O", "B-Gene", "I-Gene", "B-Chemical", "I-Chemical"]))
+    types, begins = span_label_maps(id_to_label)
+    # [CLS] B-Gene ##piece I-Gene O I-Chemical O [SEP] [PAD], pieces and special tokens at -100
+    labels = torch.tensor([[-100, 1, -100, 2, 0, 4, 0, -100, -100]])
+    attention_mask = torch.tensor([[1, 1, 1, 1, 1, 1, 1, 1, 0]])
+    evaluator = Evaluator([], id_to_label)
+    outside, carry = evaluator.ner_masks(labels, attention_mask)
+    keys = extract_spans(labels, types, begins, outside, carry).tolist()
+    # An I- label after O opens a span
+    assert keys == [span_key(0, 1, 3, 0, 9, 5), span_key(0, 5, 5, 1, 9, 5)]
+
+
+def test_ignore_index_labels_are_outside():
+    # preprocess.py's labels are entity texts, the last one marking tokens outside any entity
+    id_to_label = dict(enumerate(["IL2", "HO-1", "none"]))
+    types, begins = span_label_maps(id_to_label)
+    labels = torch.tensor([[2, 0, 0, 2, 1, 1, 0, 2]])
+    evaluator = Evaluator([], id_to_label, ignore_index=2)
+    outside, carry = evaluator.ner_masks(labels, torch.ones_like(labels))
+    keys = extract_spans(labels, types, begins, outside, carry).tolist()
+    # Without B- labels a span is a run of one label, and a label change starts a new one
+    assert keys == [span_key(0, 1, 2, 0, 8, 3), span_key(0, 4, 5, 1, 8, 3), span_key(0, 6, 6, 0, 8, 3)]
@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from multitask import TemperatureBatchSampler, task_probabilities
+
+
+@pytest.mark.parametrize("temperature, shares", [(1.0, [0.9, 0.1]), (2.0, [0.75, 0.25])])
+def test_task_shares_follow_the_temperature(temperature, shares):
+    sizes = [900, 100]
+    assert task_probabilities(sizes, temperature) == pytest.approx(shares)
+    sampler = TemperatureBatchSampler(sizes, batch_size=10, temperature=temperature)
+    keys = [key for batch in sampler for key in batch]
+    assert len(keys) == sum(sizes)
+    counts = [sum(1 for task, _ in keys if task == t) for t in range(len(sizes))]
+    assert [count / len(keys) for count in counts] == pytest.approx(shares, abs=0.05)
+
+
+def test_small_tasks_repeat_whole_passes():
+    sampler = TemperatureBatchSampler([900, 100], batch_size=10, temperature=2.0)
+    indices = [index for batch in sampler for task, index in batch if task == 1]
+    # Every index once before any repeats
+    assert len(indices) > 100
+    assert sorted(indices[:100]) == list(range(100))
+
+
+def test_order_depends_only_on_seed_and_epoch():
+    sampler = TemperatureBatchSampler([50, 20], batch_size=8, temperature=2.0, seed=3)
+    first = list(sampler)
+    assert list(sampler) == first
+    assert len(first) == len(sampler) == 9
+    sampler.set_epoch(1)
+    assert list(sampler) != first
@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sentences import sentence_boundaries, split_sentences
+
+
+def test_et_al_does_not_end_a_sentence():
+    assert split_sentences("Smith et al. showed it.") == [(0, "Smith et al. showed it.")]
+
+
+def test_sentences_are_still_split():
+    text = "Smith et al. showed it. IL-2 binds its receptor."
+    assert [sentence for _, sentence in split_sentences(text)] == ["Smith et al. showed it.", "IL-2 binds its receptor."]
+    assert sentence_boundaries(text)[-1] == len(text)
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+
+import pytest
+from torch.utils.data import DataLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from schema import Document, Entity, Relation
+from shards import ShardedJSONLDataset, convert
+
+
+def document_items(document):
+    # Two items per document, so workers yield several batches per shard
+    return [f"{document.text}/{i}" for i in range(2)]
+
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    json_dir = tmp_path / "json"
+    json_dir.mkdir()
+    for d in range(12):
+        text = f"Protein {d} binds receptor {d}."
+        entities = [Entity("e1", "Gene", f"protein{d}", 0, 7), Entity("e2", "Gene", f"receptor{d}", 15 + len(str(d)), 23 + len(str(d)))]
+        document = Document(text, entities, [Relation("e1", "e2", "binds")])
+        with open(json_dir / f"doc{d:02d}.json", "w") as f:
+            json.dump(document.to_json(), f)
+    convert(str(json_dir), str(tmp_path / "corpus"), docs_per_shard=2, compression="none", dev_fraction=0)
+    return str(tmp_path / "corpus")
+
+
+def batches(corpus_dir, num_workers, batch_size, start_index=0):
+    dataset = ShardedJSONLDataset(corpus_dir, document_items, shuffle_buffer=4, batch_size=batch_size)
+    dataset.set_epoch(1, start_index)
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=num_workers)
+    return [tuple(batch) for batch in loader]
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_resume_skips_the_trained_batches(corpus_dir, num_workers):
+    batch_size = 2
+    full = batches(corpus_dir, num_workers, batch_size)
+    assert len(full) == 12
+    # A checkpoint after 4 steps stores start_index = 4 * batch_size
+    resumed = batches(corpus_dir, num_workers, batch_size, start_index=4 * batch_size)
+    # Workers take turns from the first one again, so only the set of batches is fixed
+    assert sorted(resumed) == sorted(full[4:])
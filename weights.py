@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import pickle
+import argparse
+import logging
+import tempfile
+import torch
+import torch.multiprocessing as mp
+from safetensors.torch import load_file
+from contextlib import contextmanager
+from transformers import BertConfig, BertTokenizerFast, DistilBertTokenizerFast
+from transformers.modeling_utils import no_init_weights
+from models import BertForNERAndRE, DistilBertForNERAndRE
+
+logging.getLogger("transformers").setLevel(logging.ERROR)
+
+# Memory-mapped model loading. from_pretrained builds a randomly initialised
+# model, deserializes the checkpoint and copies it into the parameters, so every
+# process pays for the copy and keeps a private set of weights. load_model builds
+# the model on the meta device (no allocation, no init) and assigns tensors that
+# point into a memory-mapped checkpoint instead:
+#
+#   model.safetensors    safetensors maps the file
+#   pytorch_model.bin    torch.load(mmap=True) for older checkpoints
+#
+# Start-up then costs page faults on first use, and processes loading the same
+# file share its pages through the page cache. The mapping is private, so an
+# in-place write copies the page and never reaches the file. Training scripts
+# save with safe_serialization=True; convert older checkpoints with
+#
+#   python weights.py convert models/combined
+#   python weights.py bench models/combined --processes 4
+
+weights_names = ("model.safetensors", "pytorch_model.bin")
+model_classes = {"bert": BertForNERAndRE, "distilbert": DistilBertForNERAndRE}
+# Tokenizer class and the base model to take it from when none was saved
+tokenizer_classes = {"bert": (BertTokenizerFast, "bert-base-uncased"), "distilbert": (DistilBertTokenizerFast, "distilbert-base-uncased")}
+
+
+def model_type(model_dir):
+    with open(os.path.join(model_dir, "config.json"), "r") as f:
+        return json.load(f).get("model_type", "bert")
+
+
+def model_class(model_dir):
+    return model_classes[model_type(model_dir)]
+
+
+def load_tokenizer(model_dir):
+    cls, base = tokenizer_classes[model_type(model_dir)]
+    try:
+        return cls.from_pretrained(model_dir)
+    except OSError:
+        return cls.from_pretrained(base)
+
+
+def label_counts(state):
+    """(num_ner_labels, num_re_labels) of a checkpoint, read off its classifier shapes."""
+    ner = state["classifier.weight"] if "classifier.weight" in state else state["ner_classifier.weight"]
+    return ner.size(0), state["re_classifier.weight"].size(0)
+
+
+def load_label_maps(model_dir):
+    """(label_to_id, relation_to_id) saved next to a checkpoint: the .json maps, or preprocess.py's .pkl maps."""
+    if os.path.exists(os.path.join(model_dir, "label_to_id.json")):
+        with open(os.path.join(model_dir, "label_to_id.json"), "r") as f:
+            label_to_id = json.load(f)
+        with open(os.path.join(model_dir, "relation_to_id.json"), "r") as f:
+            relation_to_id = json.load(f)
+    else:
+        with open(os.path.join(model_dir, "label_to_id.pkl"), "rb") as f:
+            label_to_id = pickle.load(f)
+        with open(os.path.join(model_dir, "relation_to_id.pkl"), "rb") as f:
+            relation_to_id = pickle.load(f)
+    return label_to_id, relation_to_id
+
+
+def load_state(model_dir):
+    """The checkpoint's state dict, backed by a memory map of the file."""
+    for name in weights_names:
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            if name.endswith(".safetensors"):
+                return load_file(path, device="cpu")
+            return torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    raise FileNotFoundError(f"No {' or '.join(weights_names)} in {model_dir}")
+
+
+@contextmanager
+def skip_init(device="meta"):
+    # Parameters are replaced by the checkpoint's tensors, so initialising them
+    # is wasted work; on the meta device the first torch.nn.init call also
+    # imports torch's reference op implementations (~1.5s)
+    names = [name for name in dir(torch.nn.init) if name.endswith("_") and not name.startswith("_")]
+    saved = {name: getattr(torch.nn.init, name) for name in names}
+    for name in names:
+        setattr(torch.nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        with no_init_weights(), torch.device(device):
+            yield
+    finally:
+        for name, init in saved.items():
+            setattr(torch.nn.init, name, init)
+
+
+def _restore_index_buffers(model):
+    # Non-persistent buffers are not in the checkpoint; the ones HF encoders
+    # use are position and token type ids
+    for name, buffer in list(model.named_buffers()):
+        if not buffer.is_meta:
+            continue
+        module_name, _, attr = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if attr == "position_ids":
+            value = torch.arange(buffer.size(-1)).expand(buffer.shape)
+        elif attr == "token_type_ids":
+            value = torch.zeros(buffer.shape)
+        else:
+            raise ValueError(f"{name} is not in the checkpoint; load this model with from_pretrained")
+        module._buffers[attr] = value.to(buffer.dtype)
+
+
+def load_model(model_dir, num_ner_labels, num_re_labels, trainable=False):
+    """A model whose weights are memory-mapped from model_dir.
+
+    The model is frozen for inference unless trainable=True (prune.py and
+    feature_cache.py need gradients); updates then copy the pages they write.
+    """
+    cls = model_class(model_dir)
+    config = cls.config_class.from_pretrained(model_dir)
+    # Pruned heads in the config are applied while building, so shapes match the
+    # checkpoint. Pruning indexes the weights, which meta tensors cannot do, so
+    # pruned models are built from empty (unwritten) CPU tensors instead
+    with skip_init("cpu" if config.pruned_heads else "meta"):
+        model = cls(config, num_ner_labels, num_re_labels)
+    missing, unexpected = model.load_state_dict(load_state(model_dir), strict=False, assign=True)
+    missing = [name for name in missing if name not in dict(model.named_buffers())]
+    if missing:
+        raise ValueError(f"{model_dir} is missing weights: {', '.join(missing[:5])}")
+    _restore_index_buffers(model)
+    if not trainable:
+        model.requires_grad_(False)
+    return model.eval()
+
+
+def convert(model_dir):
+    """Write model.safetensors next to an existing pytorch_model.bin."""
+    cls = model_class(model_dir)
+    state = torch.load(os.path.join(model_dir, "pytorch_model.bin"), map_location="cpu", weights_only=True)
+    config = cls.config_class.from_pretrained(model_dir)
+    model = cls(config, *label_counts(state))
+    model.load_state_dict(state, strict=False)
+    model.save_pretrained(model_dir, safe_serialization=True)
+
+
+def _bench_worker(model_dir, method, num_ner_labels, num_re_labels, results, done):
+    from pool import memory_kb
+    # Memory is reported above the interpreter with torch and transformers imported
+    base_rss, base_pss = memory_kb(os.getpid())
+    start = time.perf_counter()
+    if method == "mmap":
+        model = load_model(model_dir, num_ner_labels, num_re_labels)
+    else:
+        model = model_class(model_dir).from_pretrained(model_dir, num_ner_labels=num_ner_labels, num_re_labels=num_re_labels).eval()
+    loaded = time.perf_counter() - start
+    # First request: touches every weight
+    with torch.inference_mode():
+        model(input_ids=torch.ones(1, 32, dtype=torch.long), attention_mask=torch.ones(1, 32, dtype=torch.long))
+    first = time.perf_counter() - start
+    rss, pss = memory_kb(os.getpid())
+    results.put((loaded, first, rss - base_rss, pss - base_pss))
+    # Stay alive until every process has measured, so PSS splits the shared pages
+    done.wait()
+
+
+def bench(model_dir, num_ner_labels, num_re_labels, processes=2):
+    ctx = mp.get_context("spawn")
+    for method in ("from_pretrained", "mmap"):
+        results, done = ctx.Queue(), ctx.Event()
+        workers = [ctx.Process(target=_bench_worker, args=(model_dir, method, num_ner_labels, num_re_labels, results, done)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        measured = [results.get() for _ in workers]
+        done.set()
+        for worker in workers:
+            worker.join()
+        loaded, first, rss, pss = (sum(values) / len(values) for values in zip(*measured))
+        print(f"{method:>16s}: load {loaded:6.2f}s  first forward done {first:6.2f}s  "
+              f"+RSS {rss / 1024:5.0f} MB  +PSS {pss / 1024:5.0f} MB per process ({processes} processes)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert checkpoints to safetensors and benchmark memory-mapped loading")
+    parser.add_argument("command", choices=["convert", "bench"])
+    parser.add_argument("model_dir", nargs="?", default="models/combined")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--synthetic", action="store_true", help="Benchmark a random bert-base sized model instead of model_dir")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert(args.model_dir)
+        print(f"Wrote {os.path.join(args.model_dir, 'model.safetensors')}")
+    else:
+        model_dir, num_ner_labels, num_re_labels = args.model_dir, None, None
+        if args.synthetic:
+            model_dir = tempfile.mkdtemp(prefix="weights_bench_")
+            num_ner_labels, num_re_labels = 9, 5
+            BertForNERAndRE(BertConfig(), num_ner_labels, num_re_labels).save_pretrained(model_dir, safe_serialization=True)
+        else:
+            num_ner_labels, num_re_labels = label_counts(load_state(model_dir))
+        print(f"Checkpoint {model_dir}: {', '.join(n for n in weights_names if os.path.exists(os.path.join(model_dir, n)))}")
+        bench(model_dir, num_ner_labels, num_re_labels, args.processes)
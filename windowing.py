@@ -0,0 +1,155 @@
+import torch
+
+# Sliding-window encoding for documents that do not fit in one model window.
+# Documents are tokenized once without special tokens, split into overlapping
+# windows of `window_size` tokens ([CLS] + content + [SEP]) that start every
+# `stride` content tokens, encoded in batches and merged back so every document
+# token gets the output of the window in which it has the most context.
+
+default_window_size = 128
+default_stride = 64
+
+
+def window_spans(length, window_size=default_window_size, stride=default_stride):
+    """Return (start, end) content spans covering a document of `length` tokens."""
+    content_size = window_size - 2
+    if content_size <= 0:
+        raise ValueError(f"window_size must be larger than 2, got {window_size}")
+    if stride <= 0 or stride > content_size:
+        raise ValueError(f"stride must be in [1, {content_size}], got {stride}")
+
+    if length <= content_size:
+        return [(0, length)]
+
+    spans = []
+    start = 0
+    while True:
+        end = min(start + content_size, length)
+        spans.append((start, end))
+        if end == length:
+            break
+        start += stride
+    return spans
+
+
+def build_windows(input_ids, spans, cls_token_id, sep_token_id, pad_token_id, window_size=default_window_size):
+    """Cut `input_ids` (a list or 1D tensor without special tokens) into padded window tensors."""
+    input_ids = torch.as_tensor(input_ids, dtype=torch.long)
+    num_windows = len(spans)
+
+    window_ids = torch.full((num_windows, window_size), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((num_windows, window_size), dtype=torch.long)
+    for w, (start, end) in enumerate(spans):
+        n = end - start
+        window_ids[w, 0] = cls_token_id
+        window_ids[w, 1:n + 1] = input_ids[start:end]
+        window_ids[w, n + 1] = sep_token_id
+        attention_mask[w, :n + 2] = 1
+
+    return window_ids, attention_mask
+
+
+def window_documents(documents, tokenizer, window_size=default_window_size, stride=default_stride):
+    """Window several tokenized documents at once.
+
+    `documents` is a list of token id lists (no special tokens). Returns the
+    stacked window tensors plus, for every window, the index of its document
+    and its content span, which is what `merge_window_outputs` needs.
+    """
+    all_ids, all_masks, window_doc, window_span = [], [], [], []
+    for doc_idx, input_ids in enumerate(documents):
+        spans = window_spans(len(input_ids), window_size, stride)
+        ids, mask = build_windows(
+            input_ids,
+            spans,
+            tokenizer.cls_token_id,
+            tokenizer.sep_token_id,
+            tokenizer.pad_token_id,
+            window_size,
+        )
+        all_ids.append(ids)
+        all_masks.append(mask)
+        window_doc.extend([doc_idx] * len(spans))
+        window_span.extend(spans)
+
+    return {
+        "input_ids": torch.cat(all_ids, dim=0),
+        "attention_mask": torch.cat(all_masks, dim=0),
+        "window_doc": window_doc,
+        "window_span": window_span,
+    }
+
+
+def _select_output(outputs):
+    # BertForNERAndRE returns a dict with ner_logits, plain encoders a ModelOutput
+    if isinstance(outputs, dict) and outputs.get("ner_logits") is not None:
+        return outputs["ner_logits"]
+    if hasattr(outputs, "last_hidden_state"):
+        return outputs.last_hidden_state
+    return outputs[0]
+
+
+def encode_windows(model, input_ids, attention_mask, batch_size=32, device=None):
+    """Run `model` over all windows in batches and return the per-token outputs."""
+    if device is None:
+        device = next(model.parameters()).device
+
+    outputs = []
+    with torch.no_grad():
+        for i in range(0, input_ids.size(0), batch_size):
+            batch_ids = input_ids[i:i + batch_size].to(device)
+            batch_mask = attention_mask[i:i + batch_size].to(device)
+            # Trim trailing padding shared by the whole batch
+            used = int(batch_mask.sum(dim=1).max())
+            batch_out = _select_output(model(input_ids=batch_ids[:, :used], attention_mask=batch_mask[:, :used]))
+            if used < input_ids.size(1):
+                pad = batch_out.new_zeros(batch_out.size(0), input_ids.size(1) - used, batch_out.size(-1))
+                batch_out = torch.cat([batch_out, pad], dim=1)
+            outputs.append(batch_out.cpu())
+    return torch.cat(outputs, dim=0)
+
+
+def merge_window_outputs(window_outputs, window_doc, window_span, doc_lengths):
+    """Merge [num_windows, window_size, D] outputs back into one [length, D] tensor per document.
+
+    Every token takes the output of the window where it is furthest from a window
+    edge, so overlapping windows never average a well-contextualised prediction
+    with one made at the border.
+    """
+    dim = window_outputs.size(-1)
+    merged = [window_outputs.new_zeros(length, dim) for length in doc_lengths]
+    best_context = [torch.full((length,), -1, dtype=torch.long) for length in doc_lengths]
+
+    for w, (doc_idx, (start, end)) in enumerate(zip(window_doc, window_span)):
+        n = end - start
+        positions = torch.arange(n)
+        # A window edge that coincides with the document edge loses no context
+        left = positions if start > 0 else torch.full_like(positions, n)
+        right = n - 1 - positions if end < doc_lengths[doc_idx] else torch.full_like(positions, n)
+        context = torch.minimum(left, right)
+
+        current = best_context[doc_idx][start:end]
+        take = context > current
+        merged[doc_idx][start:end][take] = window_outputs[w, 1:n + 1][take]
+        current[take] = context[take]
+
+    return merged
+
+
+def encode_long_documents(model, tokenizer, texts, window_size=default_window_size, stride=default_stride, batch_size=32):
+    """Tokenize `texts`, encode them window by window and return per-document outputs.
+
+    Returns a list of dicts with the document token ids, the character offsets of
+    every token and the merged [length, D] output tensor.
+    """
+    encodings = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    documents = encodings["input_ids"]
+
+    windows = window_documents(documents, tokenizer, window_size, stride)
+    window_outputs = encode_windows(model, windows["input_ids"], windows["attention_mask"], batch_size=batch_size)
+    merged = merge_window_outputs(window_outputs, windows["window_doc"], windows["window_span"], [len(d) for d in documents])
+
+    return [
+        {"input_ids": input_ids, "offset_mapping": offsets, "outputs": outputs}
+        for input_ids, offsets, outputs in zip(documents, encodings["offset_mapping"], merged)
+    ]